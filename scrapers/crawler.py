@@ -0,0 +1,146 @@
+import asyncio
+import random
+import time
+from collections.abc import Callable
+from urllib.parse import urlsplit
+
+import requests
+
+from http_cache import CachedResponse, HttpCache
+
+# status codes worth another attempt, everything else fails right away
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    __slots__ = 'capacity', 'lock', 'rate', 'tokens', 'updated'
+    capacity: float
+    lock: asyncio.Lock
+    # tokens per second
+    rate: float
+    tokens: float
+    updated: float
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, cost: float = 1.0):
+        # the lock keeps waiting requests in order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+def add_arguments(parser):
+    parser.add_argument('--concurrency', type=int, default=8)
+    # politeness budget per host
+    parser.add_argument('--rate', type=float, default=0.5, help='requests per second and host')
+    parser.add_argument('--burst', type=float, default=1.0)
+    parser.add_argument('--retries', type=int, default=3)
+
+
+class Crawler:
+    __slots__ = 'backoff', 'buckets', 'burst', 'cache', 'concurrency', 'rate', 'retries', 'revalidate_cost'
+    backoff: float
+    # one token bucket per host
+    buckets: dict[str, TokenBucket]
+    burst: float
+    cache: HttpCache
+    concurrency: int
+    rate: float
+    retries: int
+    # share of a token a conditional request costs if the url is already cached
+    revalidate_cost: float
+
+    def __init__(self, cache: HttpCache, concurrency: int = 8, rate: float = 0.5, burst: float = 1.0,
+                 retries: int = 3, backoff: float = 1.0, revalidate_cost: float = 0.1):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.revalidate_cost = revalidate_cost
+        self.buckets = {}
+
+        # the connection pool needs one connection per concurrent request
+        adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        cache.session.mount('http://', adapter)
+        cache.session.mount('https://', adapter)
+
+    def get_bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    async def fetch(self, url: str) -> CachedResponse:
+        cost = self.revalidate_cost if self.cache.load_entry(url) else 1.0
+        for attempt in range(0, self.retries + 1):
+            await self.get_bucket(url).acquire(cost)
+            try:
+                return await asyncio.to_thread(self.cache.get, url)
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                if attempt == self.retries or (response is not None
+                                               and response.status_code not in RETRY_STATUS_CODES):
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                print(f'Retrying {url} in {delay:.1f} s: {e}')
+                await asyncio.sleep(delay)
+
+    async def crawl(self, urls: list[str], parse: Callable[[CachedResponse], dict],
+                    on_row: Callable[[str, dict, bool], None]) -> int:
+        # on_row gets (url, row, changed) in the order of urls as soon as all earlier urls are done, urls that failed
+        # after all retries or could not be parsed are left out, returns their number
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # finished urls waiting for an earlier one, None for failed urls
+        pending = {}
+        next_index = 0
+        failed = 0
+
+        async def crawl_url(index: int, url: str):
+            nonlocal next_index, failed
+            async with semaphore:
+                try:
+                    response = await self.fetch(url)
+                except requests.RequestException as e:
+                    print(f'No response for {url}: {e}')
+                    response = None
+
+            # unchanged pages reuse their parsed row
+            if response is None:
+                failed += 1
+                pending[index] = None
+            elif not response.changed and response.data is not None:
+                pending[index] = (response.data, False)
+            else:
+                try:
+                    row = parse(response)
+                except Exception as e:
+                    # a page the parser does not understand fails like an unreachable one
+                    print(f'Could not parse {url}: {e!r}')
+                    failed += 1
+                    pending[index] = None
+                else:
+                    self.cache.set_data(url, row)
+                    pending[index] = (row, True)
+
+            while next_index in pending:
+                result = pending.pop(next_index)
+                if result is not None:
+                    on_row(urls[next_index], *result)
+                next_index += 1
+
+        await asyncio.gather(*(crawl_url(index, url) for index, url in enumerate(urls)))
+        return failed
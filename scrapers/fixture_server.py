@@ -0,0 +1,60 @@
+import argparse
+import email.utils
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from http_cache import HttpCache
+
+# replays the pages recorded in an HttpCache directory with ETag and Last-Modified support, run a scraper with
+# --base-url http://localhost:<port> against it
+
+
+def load_fixtures(directory: str) -> dict[str, tuple[str, str, str]]:
+    fixtures = {}
+    for entry, html_file in HttpCache(directory).entries():
+        url = urlsplit(entry['url'])
+        path = url.path + ('?' + url.query if url.query else '')
+        etag = entry.get('etag', '"' + entry['body_hash'] + '"')
+        last_modified = entry.get('last_modified', email.utils.formatdate(os.path.getmtime(html_file), usegmt=True))
+        fixtures[path] = (html_file, etag, last_modified)
+    return fixtures
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    fixtures: dict[str, tuple[str, str, str]] = {}
+
+    def do_GET(self):
+        fixture = self.fixtures.get(self.path)
+        if fixture is None:
+            self.send_error(404)
+            return
+
+        html_file, etag, last_modified = fixture
+        if self.headers.get('If-None-Match') == etag or \
+                ('If-None-Match' not in self.headers and self.headers.get('If-Modified-Since') == last_modified):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        with open(html_file, 'rb') as file:
+            body = file.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cache', help='HttpCache directory with the recorded pages')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    FixtureHandler.fixtures = load_fixtures(args.cache)
+    print(f'serving {len(FixtureHandler.fixtures)} fixtures on port {args.port}')
+    ThreadingHTTPServer(('localhost', args.port), FixtureHandler).serve_forever()
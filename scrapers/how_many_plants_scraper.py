@@ -1,30 +1,22 @@
-import pandas as pd
+import argparse
+import asyncio
 import parsel
-import requests
-import time
+
+from crawler import Crawler, add_arguments
+from http_cache import HttpCache
+from row_writer import RowWriter
 
 BASE_URL = 'https://www.howmanyplants.com'
 LIST_PATH = '/plant-guides'
+COLUMNS = ['name', 'official_name', 'alias', 'origins', 'climate', 'description', 'difficulty', 'water', 'light',
+           'humidity', 'temperature', 'toxicity', 'format', 'leaf_shape', 'image_url', 'url', 'height', 'width']
 
-# get all paths to plants
-print('load plant urls...')
-response = requests.get(BASE_URL + LIST_PATH)
-selection = parsel.Selector(response.text)
-plant_paths = selection.css('div.plant-index-grid a::attr(href)').getall()
-
-# initialize dataframe to store data
-plant_df = pd.DataFrame(columns=[
-    'name', 'official_name', 'alias', 'origins', 'climate', 'description', 'difficulty', 'water', 'light', 'humidity',
-    'temperature', 'toxicity', 'format', 'leaf_shape', 'image_url', 'url', 'height', 'width'])
 
-# iterate through each url and store data in dataframe
-print('iterate plant urls and parse info...')
-for path in plant_paths:
-    resp = requests.get(BASE_URL + path)
-    sel = parsel.Selector(resp.text)
+def parse_plant(text: str, url: str) -> dict:
+    sel = parsel.Selector(text)
     # extract information from hero section
     plant_attr = dict()
-    plant_attr['url'] = BASE_URL + path
+    plant_attr['url'] = url
     plant_attr['name'] = sel.css('div.hero-title > h1::text').get().strip()
     plant_attr['image_url'] = sel.css('img.hero-image').xpath('@src').get()
     basic_info = sel.css('div.plants-hero-grid-text > p::text').getall()
@@ -53,7 +45,6 @@ for path in plant_paths:
     # extract information from the details
     details = sel.css('div.attribute-details-para-a > p::text').getall()
     size_details = details[5].strip()
-    print(size_details)
     words = size_details.split(' ')
     word_index = 0
     while word_index < len(words):
@@ -70,13 +61,36 @@ for path in plant_paths:
             plant_attr['width'] = plant_attr['height']
             break
         word_index += 1
+    return plant_attr
+
+
+async def main(args):
+    cache = HttpCache(args.cache)
+    crawler = Crawler(cache, args.concurrency, args.rate, args.burst, args.retries)
+
+    # get all paths to plants
+    print('load plant urls...')
+    response = await crawler.fetch(args.base_url + LIST_PATH)
+    selection = parsel.Selector(response.text)
+    plant_paths = selection.css('div.plant-index-grid a::attr(href)').getall()
+
+    # rows are written as soon as they are parsed, an interrupted run continues after the pages already written
+    with RowWriter(args.output, COLUMNS, args.changes) as writer:
+        urls = [args.base_url + path for path in plant_paths]
+        print('iterate plant urls and parse info...')
+        await crawler.crawl([url for url in urls if url not in writer],
+                            lambda resp: parse_plant(resp.text, resp.url), writer.write)
+
+        rows, changed_rows = writer.finish()
+        print(f'exported plant data to csv, {changed_rows} of {rows} plants changed')
 
-    # concat plant_attr to plant_df
-    plant_df = pd.concat([plant_df, pd.DataFrame(plant_attr, index=[0])])
-    # sleep to avoid being blocked from further requests
-    print(f"parsed data for {plant_attr['name']}")
-    time.sleep(2)
 
-print('export plant data to csv...')
-# save plant_df to csv
-plant_df.to_csv('data/how_many_plants_data.csv', index=False)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--cache', default='data/.http_cache/how_many_plants')
+    parser.add_argument('--output', default='data/how_many_plants_data.csv')
+    parser.add_argument('--changes', default='data/how_many_plants_data.changes.csv',
+                        help='csv with only the rows of new or changed pages')
+    add_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import time
+
+import requests
+
+
+class CachedResponse:
+    __slots__ = 'changed', 'data', 'status_code', 'text', 'url'
+    # False if the server answered 304 or sent the same body again
+    changed: bool
+    # whatever was stored with set_data() for the unchanged page, e.g. the parsed row
+    data: object
+    status_code: int
+    text: str
+    url: str
+
+    def __init__(self, url: str, status_code: int, text: str, changed: bool, data: object = None):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.changed = changed
+        self.data = data
+
+
+class HttpCache:
+    __slots__ = 'directory', 'session', 'timeout'
+    directory: str
+    session: requests.Session
+    timeout: float
+
+    def __init__(self, directory: str, session: requests.Session = None, timeout: float = 30.0):
+        self.directory = directory
+        self.session = requests.Session() if session is None else session
+        self.timeout = timeout
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def load_entry(self, url: str) -> dict:
+        path = self.get_path(url)
+        if not os.path.exists(path + '.json') or not os.path.exists(path + '.html'):
+            return {}
+        with open(path + '.json') as json_file:
+            return json.load(json_file)
+
+    def save_entry(self, url: str, entry: dict, text: str = None):
+        # the body is written before the metadata, so a metadata file always has its body
+        path = self.get_path(url)
+        if text is not None:
+            with open(path + '.html.tmp', 'w', encoding='utf-8') as html_file:
+                html_file.write(text)
+            os.replace(path + '.html.tmp', path + '.html')
+        with open(path + '.json.tmp', 'w') as json_file:
+            json.dump(entry, json_file)
+        os.replace(path + '.json.tmp', path + '.json')
+
+    def get(self, url: str) -> CachedResponse:
+        entry = self.load_entry(url)
+        headers = {}
+        if 'etag' in entry:
+            headers['If-None-Match'] = entry['etag']
+        if 'last_modified' in entry:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and entry:
+            with open(self.get_path(url) + '.html', encoding='utf-8') as html_file:
+                text = html_file.read()
+            return CachedResponse(url, 304, text, False, entry.get('data'))
+        response.raise_for_status()
+
+        # servers without validators still save the parsing if the body did not change
+        text = response.text
+        body_hash = hashlib.sha256(text.encode()).hexdigest()
+        changed = entry.get('body_hash') != body_hash
+        new_entry = {'url': url, 'body_hash': body_hash, 'fetched': time.time()}
+        if 'ETag' in response.headers:
+            new_entry['etag'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            new_entry['last_modified'] = response.headers['Last-Modified']
+        if not changed and 'data' in entry:
+            new_entry['data'] = entry['data']
+        self.save_entry(url, new_entry, text if changed else None)
+        return CachedResponse(url, response.status_code, text, changed, new_entry.get('data'))
+
+    def set_data(self, url: str, data: object):
+        entry = self.load_entry(url)
+        if entry:
+            entry['data'] = data
+            self.save_entry(url, entry)
+
+    def entries(self):
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.endswith('.json'):
+                with open(os.path.join(self.directory, file_name)) as json_file:
+                    yield json.load(json_file), os.path.join(self.directory, file_name[:-len('.json')] + '.html')
@@ -1,49 +1,68 @@
-import pandas as pd
+import argparse
+import asyncio
 import parsel
 import requests
-import time
+
+from crawler import Crawler, add_arguments
+from http_cache import HttpCache
+from row_writer import RowWriter
 
 BASE_URL = 'https://nobleapps.noble.org/plantimagegallery/'
-INDEX_URL = BASE_URL + 'PlantList.aspx?IndexType=ScientificName&PlantTypeID='
+INDEX_PATH = 'PlantList.aspx?IndexType=ScientificName&PlantTypeID='
 PLANT_TYPES = {
     'FORBS': '1',
     'GRASSES_GRASSLIKES': '2',
     'TREES_SHRUBS_WOODY_WINES': '3',
     'AQUATICS': '4',
 }
+COLUMNS = ['scientific_name', 'image_url']
+
+
+def parse_plant(text: str) -> dict:
+    plant_attr = dict()
+    plant_selection = parsel.Selector(text)
+
+    scientific_name = plant_selection.xpath('//tr[2]/td[2]/h6/i/i/text()').get()
+    if scientific_name is None:
+        scientific_name = plant_selection.xpath('//tr[2]/td[2]/h6/i/text()').get()
+    plant_attr['scientific_name'] = scientific_name
+
+    image_url = plant_selection.xpath('//div[@id="plantCarousel"]//img/@src').get()
+    plant_attr['image_url'] = image_url
+    return plant_attr
+
 
-plant_df = pd.DataFrame(columns=['scientific_name', 'image_url'])
-
-for plant_type, plant_type_id in PLANT_TYPES.items():
-    print(f'Scraping index for {plant_type}')
-    try:
-        index_response = requests.get(INDEX_URL + plant_type_id)
-    except:
-        print('No response')
-        break
-    index_selection = parsel.Selector(index_response.text)
-    link_list = index_selection.xpath('//table[@id="ContentPlaceHolder1_tblIndex"]//a/@href').getall()
-    for link in link_list:
-        time.sleep(2)
-        plant_attr = dict()
+async def main(args):
+    cache = HttpCache(args.cache)
+    crawler = Crawler(cache, args.concurrency, args.rate, args.burst, args.retries)
+
+    urls = []
+    for plant_type, plant_type_id in PLANT_TYPES.items():
+        print(f'Scraping index for {plant_type}')
         try:
-            plant_response = requests.get(BASE_URL + link)
-        except:
-            print('No response')
-            break
-        plant_selection = parsel.Selector(plant_response.text)
-
-        scientific_name = plant_selection.xpath('//tr[2]/td[2]/h6/i/i/text()').get()
-        if scientific_name is None:
-            scientific_name = plant_selection.xpath('//tr[2]/td[2]/h6/i/text()').get()
-        plant_attr['scientific_name'] = scientific_name
-
-        image_url = plant_selection.xpath('//div[@id="plantCarousel"]//img/@src').get()
-        plant_attr['image_url'] = image_url
-
-        print(f'Scraped data for {scientific_name}')
-        plant_df = pd.concat([plant_df, pd.DataFrame(plant_attr, index=[0])])
-    time.sleep(2)
-
-print('Export plant data to csv...')
-plant_df.to_csv('data/plant_image_gallery.csv', index=False)
+            index_response = await crawler.fetch(args.base_url + INDEX_PATH + plant_type_id)
+        except requests.RequestException as e:
+            print(f'No response for the {plant_type} index: {e}')
+            continue
+        index_selection = parsel.Selector(index_response.text)
+        link_list = index_selection.xpath('//table[@id="ContentPlaceHolder1_tblIndex"]//a/@href').getall()
+        urls.extend(args.base_url + link for link in link_list)
+
+    # rows are written as soon as they are parsed, an interrupted run continues after the pages already written
+    with RowWriter(args.output, COLUMNS, args.changes) as writer:
+        await crawler.crawl([url for url in urls if url not in writer],
+                            lambda response: parse_plant(response.text), writer.write)
+
+        rows, changed_rows = writer.finish()
+        print(f'Exported plant data to csv, {changed_rows} of {rows} plants changed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--cache', default='data/.http_cache/plant_image_gallery')
+    parser.add_argument('--output', default='data/plant_image_gallery.csv')
+    parser.add_argument('--changes', default='data/plant_image_gallery.changes.csv',
+                        help='csv with only the rows of new or changed pages')
+    add_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
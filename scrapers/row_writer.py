@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+from typing import Optional
+
+
+class RowWriter:
+    __slots__ = 'changes_file', 'columns', 'file', 'flush_every', 'journal', 'journal_file', 'keys', 'unsynced'
+    # csv with only the changed rows, written together with the output
+    changes_file: Optional[str]
+    columns: list[str]
+    file: str
+    # rows are synced to disk after this many rows, every row is flushed to the os right away
+    flush_every: int
+    journal: object
+    # one json record per row with its key, the csv files are only written by finish()
+    journal_file: str
+    # keys of the rows in the journal, e.g. the page urls
+    keys: set[str]
+    unsynced: int
+
+    def __init__(self, file: str, columns: list[str], changes_file: Optional[str] = None, flush_every: int = 20):
+        self.file = file
+        self.columns = columns
+        self.changes_file = changes_file
+        self.flush_every = flush_every
+        self.journal_file = file + '.part.jsonl'
+        self.keys = set()
+        self.unsynced = 0
+
+        # a journal left by an interrupted run is resumed, a partly written last record is dropped
+        valid_size = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as journal:
+                for line in journal:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    self.keys.add(record['key'])
+                    valid_size += len(line)
+            print(f'resuming {self.journal_file} with {len(self.keys)} rows')
+        self.journal = open(self.journal_file, 'ab')
+        self.journal.truncate(valid_size)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def write(self, key: str, row: dict, changed: bool = True):
+        record = {'key': key, 'changed': changed, 'row': row}
+        self.journal.write(json.dumps(record).encode() + b'\n')
+        self.journal.flush()
+        self.keys.add(key)
+        self.unsynced += 1
+        if self.unsynced >= self.flush_every:
+            self.sync()
+
+    def sync(self):
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.unsynced = 0
+
+    def write_csv(self, file: str, changed_only: bool) -> int:
+        # written next to the target and renamed, readers never see a half written csv
+        count = 0
+        with open(self.journal_file, 'rb') as journal, open(file + '.tmp', 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, self.columns, extrasaction='ignore', lineterminator='\n')
+            writer.writeheader()
+            for line in journal:
+                record = json.loads(line)
+                if record['changed'] or not changed_only:
+                    writer.writerow(record['row'])
+                    count += 1
+        os.replace(file + '.tmp', file)
+        return count
+
+    def finish(self) -> tuple[int, int]:
+        # returns the number of rows and of changed rows
+        self.sync()
+        self.journal.close()
+        rows = self.write_csv(self.file, False)
+        changed_rows = self.write_csv(self.changes_file, True) if self.changes_file is not None else 0
+        os.remove(self.journal_file)
+        return rows, changed_rows
+
+    def close(self):
+        # keeps the journal for the next run
+        if not self.journal.closed:
+            self.sync()
+            self.journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import plant_image_gallery_scraper
+from fixture_server import FixtureHandler, load_fixtures
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'plant_image_gallery')
+PLANT_ROWS = [
+    {'scientific_name': 'Achillea millefolium', 'image_url': 'Images/Achillea_millefolium.jpg'},
+    {'scientific_name': 'Echinacea angustifolia', 'image_url': 'Images/Echinacea_angustifolia.jpg'},
+    {'scientific_name': 'Andropogon gerardii', 'image_url': 'Images/Andropogon_gerardii.jpg'},
+]
+
+
+@pytest.fixture
+def fixture_server():
+    # records the status code of every request next to the replayed fixtures
+    statuses = []
+
+    class RecordingHandler(FixtureHandler):
+        fixtures = load_fixtures(FIXTURES)
+
+        def send_response(self, code, message=None):
+            statuses.append((self.path, code))
+            super().send_response(code, message)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', 0), RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://localhost:{server.server_port}/plantimagegallery/', statuses
+    server.shutdown()
+    server.server_close()
+
+
+def run_scraper(base_url: str, directory) -> argparse.Namespace:
+    args = argparse.Namespace(base_url=base_url, cache=str(directory / 'cache'), output=str(directory / 'plants.csv'),
+                              changes=str(directory / 'plants.changes.csv'), concurrency=4, rate=1000.0, burst=10.0,
+                              retries=0)
+    asyncio.run(plant_image_gallery_scraper.main(args))
+    return args
+
+
+def read_csv(file: str) -> list[dict]:
+    with open(file, newline='') as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def test_rerun_revalidates_and_writes_no_changes(fixture_server, tmp_path):
+    base_url, statuses = fixture_server
+    args = run_scraper(base_url, tmp_path)
+    assert read_csv(args.output) == PLANT_ROWS
+    assert read_csv(args.changes) == PLANT_ROWS
+    assert all(status == 200 for _, status in statuses)
+
+    statuses.clear()
+    run_scraper(base_url, tmp_path)
+    assert read_csv(args.output) == PLANT_ROWS
+    assert read_csv(args.changes) == []
+    # every page is answered with 304 because the cache sends the recorded etags
+    assert len(statuses) == 4 + len(PLANT_ROWS)
+    assert all(status == 304 for _, status in statuses)
+    assert not os.path.exists(args.output + '.part.jsonl')
+
+
+def test_interrupted_run_is_resumed(fixture_server, tmp_path):
+    base_url, statuses = fixture_server
+    output = str(tmp_path / 'plants.csv')
+    # journal of a run that was killed while writing its second row
+    with open(output + '.part.jsonl', 'wb') as journal:
+        record = {'key': base_url + 'PlantDetail.aspx?ID=101', 'changed': True, 'row': PLANT_ROWS[0]}
+        journal.write(json.dumps(record).encode() + b'\n')
+        journal.write(b'{"key": "' + base_url.encode() + b'PlantDetail.aspx?ID=102", "cha')
+
+    args = run_scraper(base_url, tmp_path)
+    assert read_csv(args.output) == PLANT_ROWS
+    assert read_csv(args.changes) == PLANT_ROWS
+    # the page already in the journal is not requested again
+    assert '/plantimagegallery/PlantDetail.aspx?ID=101' not in [path for path, _ in statuses]
+    assert not os.path.exists(args.output + '.part.jsonl')
+
+
+def test_page_that_fails_to_parse_is_skipped(fixture_server, tmp_path, monkeypatch, capsys):
+    base_url, _ = fixture_server
+    parse_plant = plant_image_gallery_scraper.parse_plant
+
+    def failing_parse_plant(text: str) -> dict:
+        if 'Echinacea' in text:
+            raise ValueError('unexpected layout')
+        return parse_plant(text)
+
+    monkeypatch.setattr(plant_image_gallery_scraper, 'parse_plant', failing_parse_plant)
+    args = run_scraper(base_url, tmp_path)
+    # the rows after the broken page are still written
+    assert read_csv(args.output) == [PLANT_ROWS[0], PLANT_ROWS[2]]
+    assert 'Could not parse ' + base_url in capsys.readouterr().out
+    assert not os.path.exists(args.output + '.part.jsonl')
@@ -0,0 +1,166 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from internal.snapshot import *
+from internal.synthetic import *
+
+# usage: python benchmark.py [--sizes 1000,10000,100000] [--output results.json] [--compare previous.json]
+RESULT_VERSION = 1
+
+
+def get_peak_memory_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_latency_metrics(prefix: str, latencies: list[float]) -> dict[str, float]:
+    latencies = np.array(latencies) * 1000
+    return {f'{prefix}_ms_mean': float(latencies.mean()),
+            f'{prefix}_ms_p50': float(np.percentile(latencies, 50)),
+            f'{prefix}_ms_p95': float(np.percentile(latencies, 95)),
+            f'{prefix}_ms_p99': float(np.percentile(latencies, 99)),
+            f'{prefix}_per_second': float(len(latencies) / latencies.sum() * 1000)}
+
+
+def run_size(number_plants: int, args: argparse.Namespace) -> dict:
+    # every size runs in a fresh process, so the peak memory belongs to this size only
+    result = {'plants': number_plants, 'users': args.users}
+    if args.profile == 'default':
+        profile = CatalogProfile.get_default(copy_attributes(Plant.plant_attributes), args.seed)
+    else:
+        profile_attributes = copy_attributes(Plant.plant_attributes)
+        profile = CatalogProfile.from_plants(parse_plants(args.profile, profile_attributes), profile_attributes)
+
+    start = time.perf_counter()
+    plants = generate_plants(profile, number_plants, Plant.other_attributes, args.seed)
+    result['generate_seconds'] = time.perf_counter() - start
+
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    all_attributes = plant_attributes + copy_attributes(Plant.other_attributes)
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file = os.path.join(directory, 'plants.csv')
+        export_plants(csv_file, plants, all_attributes)
+        del plants
+        result['csv_mb'] = os.path.getsize(csv_file) / 2 ** 20
+        start = time.perf_counter()
+        plants = parse_plants(csv_file, all_attributes)
+        result['ingest_seconds'] = time.perf_counter() - start
+    result['ingest_plants_per_second'] = number_plants / result['ingest_seconds']
+    result['ingest_peak_memory_mb'] = get_peak_memory_mb()
+
+    start = time.perf_counter()
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    result['init_features_seconds'] = time.perf_counter() - start
+    result['init_features_peak_memory_mb'] = get_peak_memory_mb()
+
+    users = generate_users(plants, len(plant_attributes), args.users, args.seed, args.min_user_plants,
+                           args.max_user_plants)
+    result['user_plants_mean'] = float(np.mean([len(user.user_plants) for user in users]))
+    latencies = []
+    for user in users:
+        start = time.perf_counter()
+        UserService.init_user_attributes(user, plant_attributes, feature_store)
+        latencies.append(time.perf_counter() - start)
+    result.update(get_latency_metrics('profile', latencies))
+
+    if args.metrics:
+        METRICS.enable(MemorySink())
+    latencies = []
+    for user in users:
+        start = time.perf_counter()
+        PlantRecommender.recommend_plant(plants, plant_attributes, user, True, feature_store, args.top_k)
+        latencies.append(time.perf_counter() - start)
+    result.update(get_latency_metrics('recommend', latencies))
+    if args.metrics:
+        sink = METRICS.sinks[0]
+        METRICS.disable()
+        result['metrics'] = {name + get_label_text(labels): histogram.mean
+                             for (name, labels), histogram in sorted(sink.histograms.items())}
+
+    start = time.perf_counter()
+    PlantRecommender.recommend_batch(plants, plant_attributes, users, True, feature_store, args.top_k)
+    result['batch_seconds'] = time.perf_counter() - start
+    result['batch_users_per_second'] = len(users) / result['batch_seconds']
+    result['peak_memory_mb'] = get_peak_memory_mb()
+    return result
+
+
+def print_result(result: dict):
+    print(f"{result['plants']} plants, {result['users']} users with {result['user_plants_mean']:.1f} plants on average")
+    for name, value in result.items():
+        if name not in ('plants', 'users', 'metrics'):
+            print(f'    {name:32s} {value:12.3f}')
+    for name, value in result.get('metrics', {}).items():
+        if '_seconds' in name:
+            print(f'    {name:64s} {value * 1000:12.3f} ms')
+        else:
+            print(f'    {name:64s} {value:12.3f}')
+
+
+def compare(previous: dict, current: dict):
+    # lower is better except for throughputs
+    print(f"changes against {previous.get('commit')} ({previous.get('time')})")
+    previous_results = {result['plants']: result for result in previous['results']}
+    for result in current['results']:
+        previous_result = previous_results.get(result['plants'])
+        if previous_result is None:
+            continue
+        print(f"{result['plants']} plants")
+        for name, value in result.items():
+            old_value = previous_result.get(name)
+            if name in ('plants', 'users') or not isinstance(value, float) or not old_value:
+                continue
+            change = value / old_value - 1
+            better = change > 0 if name.endswith('_per_second') else change < 0
+            print(f"    {name:32s} {old_value:12.3f} -> {value:12.3f} {change:+8.1%} "
+                  f"{'better' if better else 'worse' if change else ''}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000', help='catalog sizes, e.g. 1000,10000,100000,1000000')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--min-user-plants', type=int, default=1)
+    parser.add_argument('--max-user-plants', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', default='../export/plants.csv',
+                        help='export whose value frequencies the catalogs follow, or "default" for zipf values')
+    parser.add_argument('--metrics', action='store_true', help='add the mean time per instrumented stage')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='results of an earlier run')
+    args = parser.parse_args()
+
+    report = {'version': RESULT_VERSION, 'commit': get_commit(), 'time': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+              'cpu_count': os.cpu_count(), 'parameters': vars(args), 'results': []}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        with ProcessPoolExecutor(1) as executor:
+            result = executor.submit(run_size, size, args).result()
+        print_result(result)
+        report['results'].append(result)
+
+    with open(args.output, 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+    print(f'results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as json_file:
+            compare(json.load(json_file), report)
@@ -0,0 +1,63 @@
+import argparse
+import random
+import time
+
+from internal.snapshot import *
+
+# usage: python benchmark_ann.py [number_users] [top_k] [--save-index]
+parser = argparse.ArgumentParser()
+parser.add_argument('number_users', nargs='?', type=int, default=200)
+parser.add_argument('top_k', nargs='?', type=int, default=10)
+# the exhaustive scan is faster for small catalogs like the export, so the index is only saved on request
+parser.add_argument('--save-index', action='store_true', help='save the index next to the snapshot')
+args = parser.parse_args()
+number_users = args.number_users
+top_k = args.top_k
+
+plant_attributes = Plant.plant_attributes
+snapshot = '../export/plants.snapshot'
+
+feature_store = load_or_build_snapshot(snapshot, '../export/plants.csv', plant_attributes, Plant.other_attributes)
+plants = feature_store.plants
+
+start = time.perf_counter()
+index = IvfIndex.build(feature_store.matrix, plant_attributes)
+print(f'built index with {len(index.centroids)} lists in {(time.perf_counter() - start) * 1000:.1f} ms')
+if args.save_index:
+    save_index(snapshot, index)
+
+rng = random.Random(0)
+users = []
+for user_id in range(0, number_users):
+    user_plants = [UserPlant(plant, rng.choice([1.0, 3.0, 5.0])) for plant in rng.sample(plants, rng.randint(1, 20))]
+    user = User(user_id, f'user {user_id}', [rng.random() + 0.1 for _ in plant_attributes], user_plants)
+    UserService.init_user_attributes(user, plant_attributes, feature_store)
+    users.append(user)
+
+
+def run(n_probe: Optional[int]) -> tuple[float, list[list[PlantRecommendation]]]:
+    results = []
+    start_time = time.perf_counter()
+    for current_user in users:
+        results.append(PlantRecommender.recommend_plant(plants, plant_attributes, current_user, True, feature_store,
+                                                        top_k, None if n_probe is None else index, n_probe or 0))
+    return (time.perf_counter() - start_time) / len(users) * 1000, results
+
+
+exhaustive_latency, exhaustive = run(None)
+print(f'exhaustive: {exhaustive_latency:.3f} ms/request')
+print('n_probe  recall@k  ms/request')
+fastest_latency = float('inf')
+n_probe = 1
+while n_probe <= len(index.centroids):
+    latency, approximate = run(n_probe)
+    hits = 0
+    for expected, actual in zip(exhaustive, approximate):
+        hits += len({id(r.plant) for r in expected} & {id(r.plant) for r in actual})
+    recall = hits / sum(len(expected) for expected in exhaustive)
+    print(f'{n_probe:7d}  {recall:8.3f}  {latency:10.3f}')
+    if recall >= 0.9:
+        fastest_latency = min(fastest_latency, latency)
+    n_probe *= 2
+if fastest_latency >= exhaustive_latency:
+    print(f'the exhaustive scan is faster than a recall of 0.9 for {len(plants)} plants, recommend without an index')
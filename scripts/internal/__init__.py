@@ -1,6 +1,2 @@
 # TODO
-# use CIE LAB color space to compare colors
-# add support for multiple category values (maybe bit mask?)
 # try out different comparisons for numeric values
-# add support for multiple unique attributes
-# move feature vector out of plant?
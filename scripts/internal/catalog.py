@@ -0,0 +1,67 @@
+from .snapshot import *
+
+
+class SharedCatalog:
+    __slots__ = "mask_codes", "path", "plant_attributes", "reader"
+    # distinct masks of the mapped snapshot, computed on the first recommendation
+    mask_codes: Optional[dict[str, tuple[np.ndarray, np.ndarray]]]
+    path: str
+    plant_attributes: list[PlantAttribute]
+    reader: Optional[SnapshotReader]
+
+    def __init__(self, path: str, plant_attributes: list[PlantAttribute]):
+        self.path = path
+        self.plant_attributes = plant_attributes
+        self.mask_codes = None
+        self.reader = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        directory = resolve_snapshot(self.path)
+        if self.reader is not None and self.reader.directory == directory:
+            return False
+
+        # read-only mappings share the page cache between all workers
+        reader = SnapshotReader(directory, mmap_mode='r')
+        reader.apply_attribute_metadata(self.plant_attributes)
+        self.reader = reader
+        self.mask_codes = None
+        return True
+
+    @property
+    def version(self) -> str:
+        return os.path.basename(self.reader.directory)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.reader.matrix
+
+    def __len__(self):
+        return len(self.reader)
+
+    def get_plant(self, row: int) -> Plant:
+        return self.reader.read_plant(row)
+
+    def find_plant(self, key: str) -> Optional[Plant]:
+        row = self.reader.find_row(key)
+        return None if row is None else self.reader.read_plant(row)
+
+    def recommend_plant(self, user: User, filter_user_plants: bool = False,
+                        top_k: int = -1) -> list[PlantRecommendation]:
+        # plants are only materialized for the user plants and the winners
+        reader = self.reader
+        if self.mask_codes is None:
+            self.mask_codes = {
+                plant_attribute.attribute_name: PlantRecommender.get_masks(reader.matrix, plant_attribute, None)
+                for plant_attribute in self.plant_attributes
+                if plant_attribute.attribute_type == PlantAttributeType.MULTI_CATEGORICAL}
+        scores = PlantRecommender.score_plants(reader.matrix, self.plant_attributes, user, self.mask_codes)
+
+        if filter_user_plants:
+            key_attribute = reader.manifest['key_attribute']
+            user_rows = [reader.find_row(getattr(user_plant.plant, key_attribute)) for user_plant in user.user_plants]
+            candidates = np.delete(np.arange(len(scores)), [row for row in user_rows if row is not None])
+            order = candidates[TopKSelector.select(scores[candidates], top_k)]
+        else:
+            order = TopKSelector.select(scores, top_k)
+        return [PlantRecommendation(reader.read_plant(int(index)), float(scores[index])) for index in order]
@@ -1,6 +1,16 @@
+from .mapper import *
+from .metrics import *
 from .model import *
-from collections.abc import Callable
+from .store import *
+from collections.abc import Callable, Iterable, Iterator
 import csv
+import itertools
+import json
+import os
+import re
+
+# the hybrid sign and the whitespace around it, "Abelia ×grandiflora" becomes "Abelia x grandiflora"
+HYBRID_SIGN = re.compile(r'\s*×\s*')
 
 
 def convert_unit(value: float, source_unit: str, target_unit: str):
@@ -12,14 +22,16 @@ def convert_unit(value: float, source_unit: str, target_unit: str):
     return value
 
 
-def extract_keys(plants: list[Plant], plant_attributes: list[PlantAttribute]) -> set:
-    keys = set()
-    unique_plant_attribute = None
+def get_unique_attribute(plant_attributes: list[PlantAttribute]) -> Optional[PlantAttribute]:
     for plant_attribute in plant_attributes:
         if plant_attribute.unique:
-            unique_plant_attribute = plant_attribute
-            break
+            return plant_attribute
+    return None
 
+
+def extract_keys(plants: list[Plant], plant_attributes: list[PlantAttribute]) -> set:
+    keys = set()
+    unique_plant_attribute = get_unique_attribute(plant_attributes)
     if unique_plant_attribute is not None:
         for plant in plants:
             keys.add(getattr(plant, unique_plant_attribute.attribute_name))
@@ -63,143 +75,452 @@ class DerivedAttribute:
         self.mapping = mapping
 
 
-def parse(file: str, csv_attributes: list[CsvAttribute], constant_attributes: list[ConstantAttribute],
-          derived_attributes: list[DerivedAttribute], true_name='True', max_count=-1, unique_keys: set = None,
-          delimiter=',', quote_char='"') -> list[Plant]:
-    if unique_keys is None:
-        unique_keys = set()
-    result = []
+class JoinKey:
+    __slots__ = 'collapse_whitespace', 'column_names', 'ignore_case', 'normalize_hybrid', 'plant_attributes'
+    collapse_whitespace: bool
+    # csv columns holding the key, defaults to the attribute names
+    column_names: list[str]
+    ignore_case: bool
+    # "Abelia ×grandiflora" and "Abelia x grandiflora" are the same plant
+    normalize_hybrid: bool
+    plant_attributes: list[PlantAttribute]
+
+    def __init__(self, plant_attributes: Optional[list[PlantAttribute]] = None,
+                 column_names: Optional[list[str]] = None, ignore_case=True, collapse_whitespace=True,
+                 normalize_hybrid=True):
+        if plant_attributes is None:
+            plant_attributes = [get_unique_attribute(Plant.other_attributes)]
+        self.plant_attributes = plant_attributes
+        if column_names is None:
+            column_names = [plant_attribute.attribute_name for plant_attribute in plant_attributes]
+        self.column_names = column_names
+        self.ignore_case = ignore_case
+        self.collapse_whitespace = collapse_whitespace
+        self.normalize_hybrid = normalize_hybrid
+
+    def normalize(self, value) -> str:
+        value = str(value)
+        if self.normalize_hybrid:
+            value = HYBRID_SIGN.sub(lambda match: ' x ' if match.start() else 'x ', value)
+        if self.collapse_whitespace:
+            value = ' '.join(value.split())
+        if self.ignore_case:
+            value = value.casefold()
+        return value
 
-    with open(file, newline='') as csv_file:
-        csv_reader = csv.DictReader(csv_file, delimiter=delimiter, quotechar=quote_char)
-        current_count = 0
-        for row in csv_reader:
-            if current_count == max_count:
-                break
+    def get_plant_key(self, plant: Plant) -> tuple:
+        return tuple(self.normalize(getattr(plant, plant_attribute.attribute_name, ''))
+                     for plant_attribute in self.plant_attributes)
 
-            plant = Plant()
-            valid = True
-            for csv_attribute in csv_attributes:
-                plant_attribute = csv_attribute.plant_attribute
-                column_name = csv_attribute.name
-                string_value = row[column_name]
+    def get_row_keys(self, columns: dict[str, tuple[str, ...]]) -> list[tuple]:
+        return list(zip(*[[self.normalize(value) for value in columns[column_name]]
+                          for column_name in self.column_names]))
 
-                if not string_value and not plant_attribute.optional:
-                    valid = False
-                    continue
+    def build_index(self, plants: list[Plant]) -> dict[tuple, Plant]:
+        # the first plant wins if several plants share a key
+        index = {}
+        for plant in plants:
+            index.setdefault(self.get_plant_key(plant), plant)
+        return index
 
-                if csv_attribute.mapping_function is not None:
-                    string_value = csv_attribute.mapping_function(string_value)
 
-                match plant_attribute.attribute_type:
-                    case PlantAttributeType.NUMERIC:
-                        if not string_value:
-                            value = 0
-                        else:
-                            value = convert_unit(float(string_value), csv_attribute.unit, plant_attribute.unit)
-                    case PlantAttributeType.BOOL:
-                        value = string_value == true_name
-                    case PlantAttributeType.COLOR:
-                        value = string_value
-                    case PlantAttributeType.CATEGORICAL:
-                        value = string_value
-
-                if valid and plant_attribute.unique:
-                    if value in unique_keys:
-                        valid = False
-                        continue
-                    else:
-                        unique_keys.add(value)
+class MergeStats:
+    __slots__ = 'duplicate', 'matched', 'unmatched', 'unmatched_keys'
+    # rows whose key was already merged before, the later row overwrites the values
+    duplicate: int
+    matched: int
+    unmatched: int
+    unmatched_keys: list[tuple]
+
+    def __init__(self):
+        self.duplicate = 0
+        self.matched = 0
+        self.unmatched = 0
+        self.unmatched_keys = []
 
-                setattr(plant, plant_attribute.attribute_name, value)
+    def __str__(self):
+        return f'matched: {self.matched}, unmatched: {self.unmatched}, duplicate: {self.duplicate}'
+
+
+def read_chunks(file: str, column_names: list[str], chunk_size: int = 4096, delimiter=',',
+                quote_char='"') -> Iterator[dict[str, tuple[str, ...]]]:
+    # yields the requested columns of up to chunk_size rows at a time, short rows are padded with ''
+    with open(file, newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=delimiter, quotechar=quote_char)
+        header = next(csv_reader, None)
+        if header is None:
+            return
+        for column_name in column_names:
+            if column_name not in header:
+                raise KeyError(f'Column {column_name} not found in {file}')
+        positions = [header.index(column_name) for column_name in column_names]
+        width = len(header)
+        while True:
+            rows = list(itertools.islice(csv_reader, chunk_size))
+            if not rows:
+                break
+            if min(map(len, rows)) < width or max(map(len, rows)) > width:
+                rows = [(row + [''] * (width - len(row)))[:width] for row in rows if row]
+                if not rows:
+                    continue
+            columns = list(zip(*rows))
+            yield {column_name: columns[position] for column_name, position in zip(column_names, positions)}
+
+
+def map_column(strings: Iterable[str], mapping_function: Callable[[str], str], skip_empty: bool) -> list[str]:
+    # a Mapper memoizes itself and counts every row, other functions map every distinct value of a chunk once
+    if isinstance(mapping_function, Mapper):
+        return [mapping_function(string_value) if string_value or not skip_empty else string_value
+                for string_value in strings]
+    mapped = {}
+    for string_value in strings:
+        if string_value not in mapped and (string_value or not skip_empty):
+            mapped[string_value] = mapping_function(string_value)
+    return [mapped.get(string_value, string_value) for string_value in strings]
+
+
+def convert_column(strings: Iterable[str], plant_attribute: PlantAttribute, true_name='True', unit='') -> list:
+    match plant_attribute.attribute_type:
+        case PlantAttributeType.NUMERIC:
+            values = np.array(strings, dtype=object)
+            # empty strings and mapping functions returning None are missing values
+            empty = np.array([not string_value for string_value in values], dtype=bool)
+            values[empty] = '0'
+            values = (values.astype(np.float64) * convert_unit(1.0, unit, plant_attribute.unit)).tolist()
+            # missing values stay an integer 0 like in the exports
+            for row in np.flatnonzero(empty):
+                values[row] = 0
+            return values
+        case PlantAttributeType.BOOL:
+            return [string_value == true_name for string_value in strings]
+        case _:
+            return list(strings)
+
+
+def is_missing(value) -> bool:
+    # missing NUMERIC values are an integer 0, written as '0' to the exports, measured values are floats
+    return value is None or value in ('', '0') or (type(value) is int and value == 0)
+
+
+def build_plants(value_columns: list[Iterable], attribute_names: list[str], valid: Iterable[bool]) -> list[Plant]:
+    plants = []
+    for values in itertools.compress(zip(*value_columns), valid):
+        plant = Plant()
+        vars(plant).update(zip(attribute_names, values))
+        plants.append(plant)
+    return plants
+
+
+class ConflictPolicy(Enum):
+    # the existing row is kept and the new one dropped
+    SKIP = 0
+    # the new row overwrites the existing row
+    REPLACE = 1
+    # empty values of the existing row are filled from the new row
+    MERGE = 2
+
+
+class DedupIndex:
+    __slots__ = 'join_keys', 'keys', 'plants', 'size', 'updates'
+    join_keys: list[JoinKey]
+    # one dict per join key from normalized key to row
+    keys: list[dict[tuple, int]]
+    # rows added since the index was loaded, older rows are only known by their keys
+    plants: dict[int, Plant]
+    size: int
+    # conflicts with older rows, written to the export by apply_updates()
+    updates: dict[int, list[tuple[ConflictPolicy, dict[str, any]]]]
+
+    def __init__(self, join_keys: list[JoinKey]):
+        self.join_keys = join_keys
+        self.keys = [{} for _ in join_keys]
+        self.plants = {}
+        self.size = 0
+        self.updates = {}
+
+    @staticmethod
+    def get_join_keys(plant_attributes: list[PlantAttribute]) -> list[JoinKey]:
+        # every unique attribute is a key on its own
+        return [JoinKey([plant_attribute]) for plant_attribute in plant_attributes if plant_attribute.unique]
+
+    def __len__(self):
+        return self.size
+
+    def find(self, plant: Plant) -> int:
+        for join_key, keys in zip(self.join_keys, self.keys):
+            row = keys.get(join_key.get_plant_key(plant), -1)
+            if row >= 0:
+                return row
+        return -1
+
+    def add_keys(self, row: int, plant: Plant):
+        for join_key, keys in zip(self.join_keys, self.keys):
+            keys.setdefault(join_key.get_plant_key(plant), row)
+
+    def add(self, plant: Plant, policy: ConflictPolicy = ConflictPolicy.SKIP) -> bool:
+        # returns True if the plant is new, otherwise the conflict is resolved with policy
+        row = self.find(plant)
+        if row < 0:
+            row = self.size
+            self.size += 1
+            self.plants[row] = plant
+            self.add_keys(row, plant)
+            return True
+        if policy == ConflictPolicy.SKIP:
+            return False
+
+        values = {name: value for name, value in vars(plant).items() if name != 'features'}
+        existing = self.plants.get(row)
+        if existing is None:
+            self.updates.setdefault(row, []).append((policy, values))
+        elif policy == ConflictPolicy.REPLACE:
+            vars(existing).update(values)
+        else:
+            for name, value in values.items():
+                if is_missing(getattr(existing, name, '')):
+                    setattr(existing, name, value)
+        self.add_keys(row, plant)
+        return False
+
+    def add_rows(self, columns: dict[str, tuple[str, ...]]):
+        row_keys = [join_key.get_row_keys(columns) for join_key in self.join_keys]
+        size = len(row_keys[0]) if row_keys else 0
+        for keys, key_list in zip(self.keys, row_keys):
+            for row in range(0, size):
+                keys.setdefault(key_list[row], self.size + row)
+        self.size += size
+
+    @staticmethod
+    def build(file: str, join_keys: list[JoinKey], chunk_size: int = 4096, delimiter=',',
+              quote_char='"') -> 'DedupIndex':
+        # only the key columns of the export are read, no plants are created
+        dedup_index = DedupIndex(join_keys)
+        column_names = list(dict.fromkeys(column_name for join_key in join_keys
+                                          for column_name in join_key.column_names))
+        if os.path.exists(file):
+            for columns in read_chunks(file, column_names, chunk_size, delimiter, quote_char):
+                dedup_index.add_rows(columns)
+        return dedup_index
+
+    def get_description(self) -> list[dict]:
+        return [{'column_names': join_key.column_names, 'ignore_case': join_key.ignore_case,
+                 'collapse_whitespace': join_key.collapse_whitespace, 'normalize_hybrid': join_key.normalize_hybrid}
+                for join_key in self.join_keys]
+
+    def save(self, file: str):
+        data = {
+            'join_keys': self.get_description(),
+            'size': self.size,
+            'keys': [[[list(key), row] for key, row in keys.items()] for keys in self.keys],
+        }
+        with open(file + '.tmp', 'w') as json_file:
+            json.dump(data, json_file)
+        os.replace(file + '.tmp', file)
+
+    @staticmethod
+    def load(file: str, join_keys: list[JoinKey]) -> Optional['DedupIndex']:
+        # returns None if the saved index was built for different keys
+        with open(file) as json_file:
+            data = json.load(json_file)
+        dedup_index = DedupIndex(join_keys)
+        if data['join_keys'] != dedup_index.get_description():
+            return None
+        dedup_index.size = data['size']
+        dedup_index.keys = [{tuple(key): row for key, row in keys} for keys in data['keys']]
+        return dedup_index
+
+    @staticmethod
+    def load_or_build(export_file: str, join_keys: list[JoinKey]) -> 'DedupIndex':
+        # the index is kept next to the export and rebuilt when the export is newer
+        index_file = export_file + '.keys.json'
+        if os.path.exists(index_file) and os.path.exists(export_file) \
+                and os.path.getmtime(index_file) >= os.path.getmtime(export_file):
+            dedup_index = DedupIndex.load(index_file, join_keys)
+            if dedup_index is not None:
+                return dedup_index
+        dedup_index = DedupIndex.build(export_file, join_keys)
+        dedup_index.save(index_file)
+        return dedup_index
+
+    def apply_updates(self, export_file: str, delimiter=',', quote_char='"') -> int:
+        # rewrites only the conflicting rows while streaming the export, returns the number of updated rows
+        if not self.updates:
+            return 0
+        updated = 0
+        with open(export_file, newline='') as csv_file, open(export_file + '.tmp', 'w', newline='') as out_file:
+            csv_reader = csv.reader(csv_file, delimiter=delimiter, quotechar=quote_char)
+            csv_writer = csv.writer(out_file, delimiter=delimiter, quotechar=quote_char)
+            header = next(csv_reader)
+            positions = {column_name: position for position, column_name in enumerate(header)}
+            csv_writer.writerow(header)
+            for row, values in enumerate(csv_reader):
+                for policy, update in self.updates.get(row, []):
+                    for name, value in update.items():
+                        position = positions.get(name)
+                        if position is not None and (policy == ConflictPolicy.REPLACE or is_missing(values[position])):
+                            values[position] = '' if value is None else value
+                    updated += 1
+                csv_writer.writerow(values)
+        os.replace(export_file + '.tmp', export_file)
+        self.updates = {}
+        return updated
+
+
+def parse_chunks(file: str, csv_attributes: list[CsvAttribute], constant_attributes: list[ConstantAttribute],
+                 derived_attributes: list[DerivedAttribute], true_name='True', max_count=-1, unique_keys: set = None,
+                 delimiter=',', quote_char='"', chunk_size: int = 4096, dedup_index: Optional[DedupIndex] = None,
+                 on_conflict: ConflictPolicy = ConflictPolicy.SKIP) -> Iterator[list[Plant]]:
+    # a dedup_index replaces the unique_keys of the unique attribute
+    if unique_keys is None:
+        unique_keys = set()
+    column_names = [csv_attribute.name for csv_attribute in csv_attributes] + \
+                   [derived_attribute.name for derived_attribute in derived_attributes]
+    attribute_names = [csv_attribute.plant_attribute.attribute_name for csv_attribute in csv_attributes] + \
+                      [derived_attribute.plant_attribute.attribute_name for derived_attribute in derived_attributes] + \
+                      [constant_attribute.plant_attribute.attribute_name for constant_attribute in constant_attributes]
+
+    current_count = 0
+    source = os.path.basename(file)
+    for columns in read_chunks(file, column_names, chunk_size, delimiter, quote_char):
+        if current_count == max_count:
+            break
 
-            for derived_attribute in derived_attributes:
-                string_value = row[derived_attribute.name]
-                setattr(plant, derived_attribute.plant_attribute.attribute_name,
-                        derived_attribute.mapping(string_value))
+        start = METRICS.start()
+        size = len(columns[column_names[0]])
+        valid = [True] * size
+        added_keys = []
+        value_columns = []
+        for csv_attribute in csv_attributes:
+            plant_attribute = csv_attribute.plant_attribute
+            strings = columns[csv_attribute.name]
+            if not plant_attribute.optional:
+                valid = [is_valid and string_value != '' for is_valid, string_value in zip(valid, strings)]
+            if csv_attribute.mapping_function is not None:
+                strings = map_column(strings, csv_attribute.mapping_function, not plant_attribute.optional)
+            values = convert_column(strings, plant_attribute, true_name, csv_attribute.unit)
+
+            # only rows that are valid so far claim their key
+            if plant_attribute.unique and dedup_index is None:
+                for row in range(0, size):
+                    if valid[row]:
+                        if values[row] in unique_keys:
+                            valid[row] = False
+                        else:
+                            unique_keys.add(values[row])
+                            added_keys.append((row, values[row]))
+            value_columns.append(values)
+
+        for derived_attribute in derived_attributes:
+            value_columns.append([derived_attribute.mapping(string_value)
+                                  for string_value in columns[derived_attribute.name]])
+        for constant_attribute in constant_attributes:
+            value_columns.append(itertools.repeat(constant_attribute.value))
+
+        # rows after the max_count-th plant are never read, so they must not keep their keys
+        valid_rows = [row for row in range(0, size) if valid[row]]
+        if dedup_index is None and max_count >= 0 and current_count + len(valid_rows) > max_count:
+            last_row = valid_rows[max_count - current_count - 1]
+            valid[last_row + 1:] = [False] * (size - last_row - 1)
+            for row, key in added_keys:
+                if row > last_row:
+                    unique_keys.discard(key)
+
+        plants = build_plants(value_columns, attribute_names, valid)
+        if dedup_index is not None:
+            new_plants = []
+            for plant in plants:
+                if current_count + len(new_plants) == max_count:
+                    break
+                if dedup_index.add(plant, on_conflict):
+                    new_plants.append(plant)
+            plants = new_plants
+        current_count += len(plants)
+        METRICS.stop('parse_chunk', start, source=source)
+        METRICS.increment('parse_rows_total', size, source=source)
+        METRICS.increment('parse_plants_total', len(plants), source=source)
+        yield plants
 
-            if valid:
-                for constant_attribute in constant_attributes:
-                    setattr(plant, constant_attribute.plant_attribute.attribute_name, constant_attribute.value)
 
-                result.append(plant)
-                current_count += 1
+def parse(file: str, csv_attributes: list[CsvAttribute], constant_attributes: list[ConstantAttribute],
+          derived_attributes: list[DerivedAttribute], true_name='True', max_count=-1, unique_keys: set = None,
+          delimiter=',', quote_char='"', chunk_size: int = 4096, dedup_index: Optional[DedupIndex] = None,
+          on_conflict: ConflictPolicy = ConflictPolicy.SKIP) -> list[Plant]:
+    result = []
+    for plants in parse_chunks(file, csv_attributes, constant_attributes, derived_attributes, true_name, max_count,
+                               unique_keys, delimiter, quote_char, chunk_size, dedup_index, on_conflict):
+        result.extend(plants)
     return result
 
 
 def parse_and_merge(file: str, csv_attributes: list[CsvAttribute], plant_list: list[Plant], true_name='True',
-                    delimiter=',', quote_char='"') -> list[Plant]:
-    with open(file, newline='') as csv_file:
-        csv_reader = csv.DictReader(csv_file, delimiter=delimiter, quotechar=quote_char)
-        for row in csv_reader:
-            scientific_name = row['scientific_name']
-            plant = None
-            for p in plant_list:
-                if p.scientific_name == scientific_name:
-                    plant = p
-                    break
-
+                    delimiter=',', quote_char='"', chunk_size: int = 4096, join_key: Optional[JoinKey] = None,
+                    stats: Optional[MergeStats] = None, key_index: Optional[dict[tuple, Plant]] = None) -> list[Plant]:
+    # key_index can be built once with join_key.build_index() and shared by several sources
+    if join_key is None:
+        join_key = JoinKey()
+    if stats is None:
+        stats = MergeStats()
+    if key_index is None:
+        key_index = join_key.build_index(plant_list)
+
+    merged_keys = set()
+    column_names = list(dict.fromkeys(join_key.column_names + [csv_attribute.name for csv_attribute in csv_attributes]))
+    source = os.path.basename(file)
+    for columns in read_chunks(file, column_names, chunk_size, delimiter, quote_char):
+        start = METRICS.start()
+        value_columns = []
+        for csv_attribute in csv_attributes:
+            strings = columns[csv_attribute.name]
+            if csv_attribute.mapping_function is not None:
+                strings = map_column(strings, csv_attribute.mapping_function, False)
+            value_columns.append(convert_column(strings, csv_attribute.plant_attribute, true_name, csv_attribute.unit))
+
+        keys = join_key.get_row_keys(columns)
+        for row in range(0, len(keys)):
+            plant = key_index.get(keys[row])
             if plant is None:
-                print(f'No matching plant found for {scientific_name}')
+                stats.unmatched += 1
+                stats.unmatched_keys.append(keys[row])
                 continue
 
-            for csv_attribute in csv_attributes:
-                plant_attribute = csv_attribute.plant_attribute
-                column_name = csv_attribute.name
-                string_value = row[column_name]
-
-                if csv_attribute.mapping_function is not None:
-                    string_value = csv_attribute.mapping_function(string_value)
+            stats.matched += 1
+            if keys[row] in merged_keys:
+                stats.duplicate += 1
+            merged_keys.add(keys[row])
 
-                match plant_attribute.attribute_type:
-                    case PlantAttributeType.NUMERIC:
-                        if not string_value:
-                            value = 0
-                        else:
-                            value = convert_unit(float(string_value), csv_attribute.unit, plant_attribute.unit)
-                    case PlantAttributeType.BOOL:
-                        value = string_value == true_name
-                    case PlantAttributeType.COLOR:
-                        value = string_value
-                    case PlantAttributeType.CATEGORICAL:
-                        value = string_value
-
-                setattr(plant, plant_attribute.attribute_name, value)
+            for csv_attribute, values in zip(csv_attributes, value_columns):
+                setattr(plant, csv_attribute.plant_attribute.attribute_name, values[row])
+        METRICS.stop('merge_chunk', start, source=source)
+        METRICS.increment('merge_rows_total', len(keys), source=source)
     return plant_list
 
 
-def parse_plants(file: str, plant_attributes: list[PlantAttribute], max_count=-1) -> list[Plant]:
+def parse_plants_chunks(file: str, plant_attributes: list[PlantAttribute], max_count=-1,
+                        chunk_size: int = 4096) -> Iterator[list[Plant]]:
+    attribute_names = [plant_attribute.attribute_name for plant_attribute in plant_attributes]
+    current_count = 0
+    source = os.path.basename(file)
+    for columns in read_chunks(file, attribute_names, chunk_size):
+        if current_count == max_count:
+            break
+        start = METRICS.start()
+        value_columns = [convert_column(columns[plant_attribute.attribute_name], plant_attribute)
+                         for plant_attribute in plant_attributes]
+        size = len(value_columns[0])
+        if max_count >= 0:
+            size = min(size, max_count - current_count)
+        plants = build_plants(value_columns, attribute_names, itertools.repeat(True, size))
+        current_count += len(plants)
+        METRICS.stop('parse_chunk', start, source=source)
+        METRICS.increment('parse_plants_total', len(plants), source=source)
+        yield plants
+
+
+def parse_plants(file: str, plant_attributes: list[PlantAttribute], max_count=-1,
+                 chunk_size: int = 4096) -> list[Plant]:
     result = []
-    with open(file, newline='') as csv_file:
-        csv_reader = csv.DictReader(csv_file, delimiter=',', quotechar='"')
-        current_count = 0
-        for row in csv_reader:
-            if current_count == max_count:
-                break
-
-            plant = Plant()
-
-            for plant_attribute in plant_attributes:
-                column_name = plant_attribute.attribute_name
-                string_value = row[column_name]
-
-                match plant_attribute.attribute_type:
-                    case PlantAttributeType.NUMERIC:
-                        if not string_value:
-                            value = 0
-                        else:
-                            value = float(string_value)
-                    case PlantAttributeType.BOOL:
-                        value = string_value == 'True'
-                    case PlantAttributeType.COLOR:
-                        value = string_value
-                    case PlantAttributeType.CATEGORICAL:
-                        value = string_value
-
-                setattr(plant, plant_attribute.attribute_name, value)
-
-            result.append(plant)
-            current_count += 1
+    for plants in parse_plants_chunks(file, plant_attributes, max_count, chunk_size):
+        result.extend(plants)
     return result
 
 
@@ -263,3 +584,12 @@ def export_plants(file: str, plants: list[Plant], plant_attributes: list[PlantAt
                 else:
                     row.append('')
             csv_writer.writerow(row)
+
+
+def export_features(file: str, feature_store: FeatureStore):
+    with open(file, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"')
+        csv_writer.writerow([feature_store.key_attribute] + feature_store.get_feature_names())
+        matrix = feature_store.matrix
+        for row in range(0, len(feature_store)):
+            csv_writer.writerow([feature_store.get_key(feature_store.plants[row])] + matrix[row].tolist())
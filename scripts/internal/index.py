@@ -0,0 +1,283 @@
+import itertools
+
+from .model import *
+
+
+# rows are assigned to their lists in chunks, the distances of a chunk to all lists stay small
+ASSIGN_CHUNK_SIZE = 16384
+# k-means is trained on a sample of at most this many rows per list
+TRAINING_ROWS_PER_LIST = 256
+# CATEGORICAL scores are divided by the number of categories, attributes with more categories hardly matter
+INDEX_MAX_CATEGORIES = 32
+# weight of a MULTI_CATEGORICAL bit relative to a NUMERIC column, found with benchmark_ann.py
+MASK_BIT_WEIGHT = 0.2
+# source of IvfIndex.token, unlike id() a token is never reused
+INDEX_TOKENS = itertools.count()
+
+
+class IvfIndex:
+    __slots__ = "assignments", "category_columns", "category_sizes", "centroids", "color_columns", "columns", \
+                "list_offsets", "list_rows", "mask_columns", "mask_sizes", "number_features", "token"
+    # inverted file index over the NUMERIC columns, the LAB coordinates of the COLOR codes, the one-hot CATEGORICAL
+    # codes and the bits of the MULTI_CATEGORICAL masks
+    assignments: np.ndarray
+    # CATEGORICAL columns and their number of categories when the index was built, later categories have no column
+    category_columns: np.ndarray
+    category_sizes: np.ndarray
+    centroids: np.ndarray
+    color_columns: np.ndarray
+    columns: np.ndarray
+    list_offsets: np.ndarray
+    list_rows: np.ndarray
+    # first column of every MULTI_CATEGORICAL attribute and its number of categories
+    mask_columns: np.ndarray
+    mask_sizes: np.ndarray
+    # width of the feature matrix the index was built on, columns are only ever inserted, so a different width means
+    # the columns moved, see FeatureStore.update_index()
+    number_features: int
+    # changes whenever the lists change, results are cached per token
+    token: int
+
+    def __init__(self, columns: np.ndarray, color_columns: np.ndarray, category_columns: np.ndarray,
+                 category_sizes: np.ndarray, mask_columns: np.ndarray, mask_sizes: np.ndarray, centroids: np.ndarray,
+                 assignments: np.ndarray, number_features: int):
+        self.columns = columns
+        self.color_columns = color_columns
+        self.category_columns = category_columns
+        self.category_sizes = category_sizes
+        self.mask_columns = mask_columns
+        self.mask_sizes = mask_sizes
+        self.centroids = centroids
+        self.assignments = assignments
+        self.number_features = number_features
+        self.update_lists()
+
+    @staticmethod
+    def get_columns(plant_attributes: list[PlantAttribute]) -> tuple[np.ndarray, ...]:
+        columns = []
+        color_columns = []
+        category_columns = []
+        category_sizes = []
+        mask_columns = []
+        mask_sizes = []
+        for plant_attribute in plant_attributes:
+            match plant_attribute.attribute_type:
+                case PlantAttributeType.NUMERIC:
+                    columns.append(plant_attribute.feature_index)
+                case PlantAttributeType.COLOR:
+                    color_columns.append(plant_attribute.feature_index)
+                case PlantAttributeType.CATEGORICAL:
+                    if 1 < len(plant_attribute.categories) <= INDEX_MAX_CATEGORIES:
+                        category_columns.append(plant_attribute.feature_index)
+                        category_sizes.append(len(plant_attribute.categories))
+                case PlantAttributeType.MULTI_CATEGORICAL:
+                    if plant_attribute.categories:
+                        mask_columns.append(plant_attribute.feature_index)
+                        mask_sizes.append(len(plant_attribute.categories))
+        return tuple(np.array(values, dtype=np.intp) for values in (columns, color_columns, category_columns,
+                                                                    category_sizes, mask_columns, mask_sizes))
+
+    @staticmethod
+    def get_bits(words: np.ndarray, size: int) -> np.ndarray:
+        # the first size bits of every mask as weighted 0/1 columns
+        words = words.astype(np.uint32)
+        bits = np.empty((len(words), size))
+        for code in range(0, size):
+            bits[:, code] = (words[:, code // MULTI_CATEGORY_BITS] >> np.uint32(code % MULTI_CATEGORY_BITS)) & 1
+        return bits * MASK_BIT_WEIGHT
+
+    def get_vectors(self, feature_matrix: np.ndarray) -> np.ndarray:
+        # LAB coordinates are scaled like COLOR_SIMILARITY, one-hot codes shrink with the number of categories like
+        # the CATEGORICAL scores, but less than them, which gave the best recall with benchmark_ann.py
+        color_lab = COLOR_LAB / COLOR_DELTA_E.max()
+        vectors = [np.asarray(feature_matrix[:, self.columns], dtype=np.float64)]
+        for column in self.color_columns:
+            vectors.append(color_lab[feature_matrix[:, column].astype(np.intp)])
+        for column, size in zip(self.category_columns, self.category_sizes):
+            one_hot = np.vstack([np.eye(size), np.zeros(size)]) / size ** 0.25
+            vectors.append(one_hot[np.minimum(feature_matrix[:, column].astype(np.intp), size)])
+        for column, size in zip(self.mask_columns, self.mask_sizes):
+            slots = -(-size // MULTI_CATEGORY_BITS)
+            vectors.append(IvfIndex.get_bits(feature_matrix[:, column:column + slots], size))
+        return np.hstack(vectors)
+
+    @staticmethod
+    def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # ||x - c||^2 without the constant ||x||^2 term
+        distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def assign_rows(self, feature_matrix: np.ndarray) -> np.ndarray:
+        assignments = [np.array([], dtype=np.intp)]
+        for start in range(0, len(feature_matrix), ASSIGN_CHUNK_SIZE):
+            vectors = self.get_vectors(feature_matrix[start:start + ASSIGN_CHUNK_SIZE])
+            assignments.append(IvfIndex.assign(vectors, self.centroids))
+        return np.concatenate(assignments)
+
+    @staticmethod
+    def build(feature_matrix: np.ndarray, plant_attributes: list[PlantAttribute], number_lists: int = -1,
+              iterations: int = 10, seed: int = 0) -> 'IvfIndex':
+        index = IvfIndex(*IvfIndex.get_columns(plant_attributes), np.zeros((0, 0)), np.array([], dtype=np.intp),
+                         feature_matrix.shape[1])
+        if number_lists < 0:
+            number_lists = max(1, int(np.sqrt(len(feature_matrix))))
+        number_lists = min(number_lists, len(feature_matrix))
+
+        # k-means with Lloyd's algorithm on a sample, empty lists keep their previous centroid
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(feature_matrix), TRAINING_ROWS_PER_LIST * number_lists)
+        sample = np.sort(rng.choice(len(feature_matrix), sample_size, replace=False))
+        vectors = index.get_vectors(feature_matrix[sample])
+        centroids = vectors[rng.choice(len(vectors), number_lists, replace=False)].copy()
+        for _ in range(0, iterations):
+            assignments = IvfIndex.assign(vectors, centroids)
+            counts = np.bincount(assignments, minlength=number_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        index.centroids = centroids
+        index.assignments = index.assign_rows(feature_matrix)
+        index.update_lists()
+        return index
+
+    def update_lists(self):
+        self.list_rows = np.argsort(self.assignments, kind='stable')
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))])
+        self.token = next(INDEX_TOKENS)
+
+    def rebuild(self, feature_matrix: np.ndarray, plant_attributes: list[PlantAttribute]):
+        # trains the same number of lists again on the current columns
+        index = IvfIndex.build(feature_matrix, plant_attributes, len(self.centroids))
+        for name in IvfIndex.__slots__:
+            setattr(self, name, getattr(index, name))
+
+    def update(self, feature_matrix: np.ndarray, start: int, reassign: bool = False):
+        # new rows from start on are assigned to the closest list, reassign=True redistributes all rows
+        if reassign:
+            start = 0
+        self.assignments = np.concatenate([self.assignments[:start], self.assign_rows(feature_matrix[start:])])
+        self.update_lists()
+
+    def get_query(self, user: User, plant_attributes: list[PlantAttribute]) -> np.ndarray:
+        # rating weighted centroid of the user plants in the index space
+        attribute_indices = {plant_attributes[attribute_index].feature_index: attribute_index
+                             for attribute_index in range(0, len(plant_attributes))}
+        query = []
+        for column in self.columns:
+            data = user.attribute_data[attribute_indices[column]]
+            query.append([data.value_sum / user.rating_sum])
+        for column in self.color_columns:
+            data = user.attribute_data[attribute_indices[column]]
+            query.append((data.color_weights @ COLOR_LAB) / COLOR_DELTA_E.max() / user.rating_sum)
+        for column, size in zip(self.category_columns, self.category_sizes):
+            data = user.attribute_data[attribute_indices[column]]
+            distribution = np.zeros(size)
+            distribution[:min(size, len(data.category_distribution))] = data.category_distribution[:size]
+            query.append(distribution / user.rating_sum / size ** 0.25)
+        for column, size in zip(self.mask_columns, self.mask_sizes):
+            data = user.attribute_data[attribute_indices[column]]
+            query.append(data.mask_weights @ IvfIndex.get_bits(data.masks, size) / user.rating_sum)
+        return np.concatenate(query)
+
+    def search(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        # n_probe trades recall for latency, on the export 8 of 41 lists find about 92% of the exact top 10
+        # at least the closest list is probed, e.g. for n_probe=0
+        n_probe = max(1, min(n_probe, len(self.centroids)))
+        distances = ((self.centroids - query) ** 2).sum(axis=1)
+        lists = np.argpartition(distances, n_probe - 1)[:n_probe]
+        rows = [self.list_rows[self.list_offsets[index]:self.list_offsets[index + 1]] for index in lists]
+        # catalog order keeps ties stable like the exhaustive scorer
+        return np.sort(np.concatenate(rows))
+
+    def save(self, file: str):
+        np.savez(file, columns=self.columns, color_columns=self.color_columns, category_columns=self.category_columns,
+                 category_sizes=self.category_sizes, mask_columns=self.mask_columns, mask_sizes=self.mask_sizes,
+                 centroids=self.centroids, assignments=self.assignments, number_features=self.number_features)
+
+    @staticmethod
+    def load(file: str) -> 'IvfIndex':
+        with np.load(file) as data:
+            return IvfIndex(data['columns'], data['color_columns'], data['category_columns'], data['category_sizes'],
+                            data['mask_columns'], data['mask_sizes'], data['centroids'], data['assignments'],
+                            int(data['number_features']) if 'number_features' in data else -1)
+
+
+class CategoryIndex:
+    __slots__ = "category_rows", "size"
+    # sorted row arrays per category of every CATEGORICAL and MULTI_CATEGORICAL attribute
+    category_rows: dict[str, list[np.ndarray]]
+    size: int
+
+    def __init__(self):
+        self.category_rows = {}
+        self.size = 0
+
+    def update(self, feature_matrix: np.ndarray, plant_attributes: list[PlantAttribute]):
+        # rows are only ever appended and category codes never change, so new rows extend the lists
+        start = self.size
+        for plant_attribute in plant_attributes:
+            if plant_attribute.attribute_type not in (PlantAttributeType.CATEGORICAL,
+                                                      PlantAttributeType.MULTI_CATEGORICAL):
+                continue
+            rows = self.category_rows.setdefault(plant_attribute.attribute_name, [])
+            while len(rows) < len(plant_attribute.categories):
+                rows.append(np.array([], dtype=np.intp))
+            if plant_attribute.attribute_type == PlantAttributeType.MULTI_CATEGORICAL:
+                # a plant is listed under every category whose bit is set
+                feature_index = plant_attribute.feature_index
+                for code in range(0, len(plant_attribute.categories)):
+                    word = feature_matrix[start:, feature_index + code // MULTI_CATEGORY_BITS].astype(np.uint32)
+                    matches = np.flatnonzero((word >> np.uint32(code % MULTI_CATEGORY_BITS)) & np.uint32(1))
+                    if len(matches):
+                        rows[code] = np.concatenate([rows[code], start + matches])
+                continue
+            codes = feature_matrix[start:, plant_attribute.feature_index].astype(np.intp)
+            order = np.argsort(codes, kind='stable')
+            boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+            for group in np.split(order, boundaries):
+                if len(group):
+                    code = codes[group[0]]
+                    rows[code] = np.concatenate([rows[code], start + group])
+        self.size = len(feature_matrix)
+
+    def get_rows(self, plant_attribute: PlantAttribute, value: str) -> np.ndarray:
+        if plant_attribute.attribute_type not in (PlantAttributeType.CATEGORICAL,
+                                                  PlantAttributeType.MULTI_CATEGORICAL):
+            raise ValueError(f'Attribute {plant_attribute.attribute_name} is not categorical')
+        code = plant_attribute.category_index.get(value)
+        if code is None:
+            return np.array([], dtype=np.intp)
+        return self.category_rows[plant_attribute.attribute_name][code]
+
+    def filter(self, plant_attributes: list[PlantAttribute], conditions: dict[str, str | list[str]]) -> np.ndarray:
+        # values of one attribute are combined with OR, different attributes with AND
+        attributes = {plant_attribute.attribute_name: plant_attribute for plant_attribute in plant_attributes}
+        row_sets = []
+        for attribute_name, values in conditions.items():
+            if attribute_name not in attributes:
+                raise ValueError(f'Unknown attribute {attribute_name}')
+            if isinstance(values, str):
+                values = [values]
+            rows = [self.get_rows(attributes[attribute_name], value) for value in values]
+            row_sets.append(rows[0] if len(rows) == 1 else np.unique(np.concatenate(rows)))
+
+        if not row_sets:
+            return np.arange(self.size)
+        row_sets.sort(key=len)
+        result = row_sets[0]
+        for rows in row_sets[1:]:
+            result = np.intersect1d(result, rows, assume_unique=True)
+        return result
+
+    @staticmethod
+    def parse_conditions(expression: str) -> dict[str, list[str]]:
+        # "type == Indoor Plant and toxicity == None"
+        conditions = {}
+        for condition in expression.split(' and '):
+            attribute_name, separator, value = condition.partition('==')
+            if not separator:
+                raise ValueError(f'Invalid condition "{condition}"')
+            conditions.setdefault(attribute_name.strip(), []).append(value.strip())
+        return conditions
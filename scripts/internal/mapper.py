@@ -0,0 +1,153 @@
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Optional
+
+# unmatched values kept as examples for the report
+MAX_UNMATCHED_VALUES = 5
+
+
+class MapperStats:
+    __slots__ = 'hits', 'misses', 'name', 'time', 'unmatched', 'unmatched_values'
+    hits: int
+    misses: int
+    name: str
+    # seconds spent in the mapping function, cache hits are not timed
+    time: float
+    # distinct values without a category, the first of them are kept in unmatched_values
+    unmatched: int
+    unmatched_values: list[str]
+
+    def __init__(self, name: str, hits: int = 0, misses: int = 0, time: float = 0.0):
+        self.name = name
+        self.hits = hits
+        self.misses = misses
+        self.time = time
+        self.unmatched = 0
+        self.unmatched_values = []
+
+    @property
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+    def add_unmatched(self, value: str):
+        self.unmatched += 1
+        if len(self.unmatched_values) < MAX_UNMATCHED_VALUES:
+            self.unmatched_values.append(value)
+
+    def add(self, other: 'MapperStats'):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.time += other.time
+        self.unmatched += other.unmatched
+        self.unmatched_values = (self.unmatched_values + other.unmatched_values)[:MAX_UNMATCHED_VALUES]
+
+    def __str__(self):
+        text = f'{self.name}: {self.hits + self.misses} calls, {self.hit_rate:.1%} hits, ' \
+               f'{self.misses} mapped in {self.time * 1000:.1f} ms'
+        if self.unmatched:
+            text += f', {self.unmatched} values without a category, e.g. ' \
+                    + ', '.join(f'"{value}"' for value in self.unmatched_values)
+        return text
+
+
+class Mapper:
+    __slots__ = 'cache', 'function', 'max_size', 'stats'
+    # least recently used values are evicted first
+    cache: OrderedDict
+    function: Optional[Callable[[str], any]]
+    max_size: int
+    stats: MapperStats
+
+    def __init__(self, function: Optional[Callable[[str], any]], name: Optional[str] = None, max_size: int = 65536):
+        self.function = function
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        if name is None:
+            name = function.__name__ if function is not None else type(self).__name__
+        self.stats = MapperStats(name)
+
+    def map(self, value: str):
+        return self.function(value)
+
+    def __call__(self, value: str):
+        cache = self.cache
+        if value in cache:
+            cache.move_to_end(value)
+            self.stats.hits += 1
+            return cache[value]
+
+        start = time.perf_counter()
+        result = self.map(value)
+        self.stats.time += time.perf_counter() - start
+        self.stats.misses += 1
+        cache[value] = result
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        self.cache = OrderedDict()
+        self.stats = MapperStats(self.stats.name)
+
+
+class KeywordMapper(Mapper):
+    __slots__ = 'categories', 'default_value', 'multiple', 'patterns', 'replacements', 'report_missing'
+    # first keyword of every entry
+    categories: list[str]
+    default_value: Optional[str]
+    # all matching categories joined by ',' or only the first category in table order
+    multiple: bool
+    # every pattern finds all keyword occurrences in one scan, a keyword that is a prefix of a keyword of another
+    # category goes to another pattern so that both are found at the same position
+    patterns: list[tuple[re.Pattern, dict[str, int]]]
+    replacements: list[tuple[str, str]]
+    # values without a category are counted in the stats
+    report_missing: bool
+
+    def __init__(self, name: str, entry_list: list[list[str]], default_value: Optional[str] = None,
+                 multiple: bool = True, replacements: Optional[list[tuple[str, str]]] = None,
+                 report_missing: bool = True, max_size: int = 65536):
+        super().__init__(None, name, max_size)
+        self.categories = [entry[0] for entry in entry_list]
+        self.default_value = default_value
+        self.multiple = multiple
+        self.replacements = [] if replacements is None else replacements
+        self.report_missing = report_missing
+
+        keyword_groups = []
+        for category, entry in enumerate(entry_list):
+            for keyword in entry:
+                keyword = keyword.lower()
+                for group in keyword_groups:
+                    if not any(category != other_category and (keyword.startswith(other) or other.startswith(keyword))
+                               for other, other_category in group.items()):
+                        group.setdefault(keyword, category)
+                        break
+                else:
+                    keyword_groups.append({keyword: category})
+
+        self.patterns = []
+        for group in keyword_groups:
+            keywords = sorted(group, key=len, reverse=True)
+            pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in keywords) + '))')
+            self.patterns.append((pattern, group))
+
+    def map(self, value: str) -> str:
+        value_formatted = value.lower()
+        for old, new in self.replacements:
+            value_formatted = value_formatted.replace(old, new)
+
+        found = set()
+        for pattern, group in self.patterns:
+            found.update(group[match.group(1)] for match in pattern.finditer(value_formatted))
+
+        if not found:
+            if self.report_missing:
+                self.stats.add_unmatched(value)
+            return '' if self.default_value is None else self.default_value
+        if not self.multiple:
+            return self.categories[min(found)]
+        return ','.join(self.categories[category] for category in sorted(found))
@@ -0,0 +1,235 @@
+import abc
+import bisect
+import json
+import time
+import tracemalloc
+from typing import Optional, TextIO
+
+# upper bounds of the histogram buckets, metrics named *_seconds use the time buckets
+TIME_BUCKETS = [1e-6 * 10 ** (exponent / 8) for exponent in range(0, 65)]
+SIZE_BUCKETS = [2 ** (exponent / 4) for exponent in range(0, 121)]
+
+
+def get_size_class(size: int) -> str:
+    # low cardinality label for collection sizes, the next power of 4
+    size_class = 1
+    while size_class < size:
+        size_class *= 4
+    return str(size_class)
+
+
+class Histogram:
+    __slots__ = 'bounds', 'bucket_counts', 'count', 'max', 'min', 'sum'
+    bounds: list[float]
+    # the last bucket counts the values above all bounds
+    bucket_counts: list[int]
+    count: int
+    max: float
+    min: float
+    sum: float
+
+    def __init__(self, bounds: list[float]):
+        self.bounds = bounds
+        self.bucket_counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the quantile, clamped to the observed range
+        rank = q * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                bound = self.bounds[bucket] if bucket < len(self.bounds) else self.max
+                return min(max(bound, self.min), self.max)
+        return 0.0
+
+
+def get_label_text(labels: tuple[tuple[str, str], ...]) -> str:
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}' if labels else ''
+
+
+class MetricSink(abc.ABC):
+    __slots__ = ()
+
+    @abc.abstractmethod
+    def observe(self, name: str, value: float, labels: tuple[tuple[str, str], ...]):
+        pass
+
+    @abc.abstractmethod
+    def increment(self, name: str, value: float, labels: tuple[tuple[str, str], ...]):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySink(MetricSink):
+    __slots__ = 'counters', 'histograms'
+    counters: dict[tuple[str, tuple], float]
+    histograms: dict[tuple[str, tuple], Histogram]
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def observe(self, name: str, value: float, labels: tuple[tuple[str, str], ...]):
+        key = (name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(TIME_BUCKETS if name.endswith('_seconds') else SIZE_BUCKETS)
+        self.histograms[key].add(value)
+
+    def increment(self, name: str, value: float, labels: tuple[tuple[str, str], ...]):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def get_counter(self, name: str, **labels: str) -> float:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def get_report(self) -> str:
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            scale, unit = (1000, ' ms') if name.endswith('_seconds') else (1, '')
+            lines.append(f'{name}{get_label_text(labels)}: {histogram.count} x, '
+                         f'mean {histogram.mean * scale:.3f}{unit}, p50 {histogram.quantile(0.5) * scale:.3f}{unit}, '
+                         f'p99 {histogram.quantile(0.99) * scale:.3f}{unit}, max {histogram.max * scale:.3f}{unit}')
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f'{name}{get_label_text(labels)}: {value:g}')
+        return '\n'.join(lines)
+
+    def get_prometheus_text(self, prefix: str = 'plant_recommender_') -> str:
+        # text exposition format with cumulative buckets
+        lines = []
+        for name in sorted({name for name, labels in self.histograms}):
+            lines.append(f'# TYPE {prefix}{name} histogram')
+            for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.bounds + [float('inf')], histogram.bucket_counts):
+                    cumulative += bucket_count
+                    bound_text = '+Inf' if bound == float('inf') else f'{bound:.6g}'
+                    lines.append(f'{prefix}{name}_bucket{get_label_text(labels + (("le", bound_text),))} {cumulative}')
+                lines.append(f'{prefix}{name}_sum{get_label_text(labels)} {histogram.sum:g}')
+                lines.append(f'{prefix}{name}_count{get_label_text(labels)} {histogram.count}')
+        for name in sorted({name for name, labels in self.counters}):
+            lines.append(f'# TYPE {prefix}{name} counter')
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f'{prefix}{name}{get_label_text(labels)} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+class JsonLinesSink(MetricSink):
+    __slots__ = 'file', 'owned'
+    file: TextIO
+    # the sink only closes files it opened itself
+    owned: bool
+
+    def __init__(self, file: str | TextIO):
+        self.owned = isinstance(file, str)
+        self.file = open(file, 'a') if self.owned else file
+
+    def write(self, kind: str, name: str, value: float, labels: tuple[tuple[str, str], ...]):
+        record = {'time': time.time(), 'kind': kind, 'name': name, 'value': value, **dict(labels)}
+        self.file.write(json.dumps(record) + '\n')
+
+    def observe(self, name: str, value: float, labels: tuple[tuple[str, str], ...]):
+        self.write('observation', name, value, labels)
+
+    def increment(self, name: str, value: float, labels: tuple[tuple[str, str], ...]):
+        self.write('counter', name, value, labels)
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class Metrics:
+    __slots__ = 'enabled', 'sinks', 'started_tracing', 'trace_allocations'
+    # every hook returns right away while disabled
+    enabled: bool
+    sinks: list[MetricSink]
+    # tracemalloc is only stopped again if enable() started it
+    started_tracing: bool
+    # stages also record the bytes they leave allocated, tracemalloc slows everything down considerably
+    trace_allocations: bool
+
+    def __init__(self):
+        self.enabled = False
+        self.sinks = []
+        self.started_tracing = False
+        self.trace_allocations = False
+
+    def enable(self, *sinks: MetricSink, trace_allocations: bool = False):
+        self.sinks = list(sinks) if sinks else [MemorySink()]
+        self.trace_allocations = trace_allocations
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        for sink in self.sinks:
+            sink.close()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        self.trace_allocations = False
+
+    def start(self) -> Optional[tuple[float, int]]:
+        if not self.enabled:
+            return None
+        allocated = tracemalloc.get_traced_memory()[0] if self.trace_allocations else 0
+        return time.perf_counter(), allocated
+
+    def stop(self, name: str, start: Optional[tuple[float, int]], **labels: str):
+        # records <name>_seconds and with traced allocations <name>_allocated_bytes
+        if start is None or not self.enabled:
+            return
+        elapsed = time.perf_counter() - start[0]
+        labels = tuple(sorted(labels.items()))
+        for sink in self.sinks:
+            sink.observe(name + '_seconds', elapsed, labels)
+        if self.trace_allocations:
+            allocated = tracemalloc.get_traced_memory()[0] - start[1]
+            for sink in self.sinks:
+                sink.observe(name + '_allocated_bytes', max(allocated, 0), labels)
+
+    def observe(self, name: str, value: float, **labels: str):
+        if not self.enabled:
+            return
+        labels = tuple(sorted(labels.items()))
+        for sink in self.sinks:
+            sink.observe(name, value, labels)
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        labels = tuple(sorted(labels.items()))
+        for sink in self.sinks:
+            sink.increment(name, value, labels)
+
+
+# process wide instrumentation used by the services and loaders, e.g. METRICS.enable(MemorySink())
+METRICS = Metrics()
@@ -20,15 +20,45 @@ COLOR_DICT = {
 }
 
 
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    # sRGB in 0-255 -> linear RGB -> CIE XYZ (D65) -> CIE LAB
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    rgb = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = rgb @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                          [0.3575761, 0.7151522, 0.1191920],
+                          [0.1804375, 0.0721750, 0.9503041]])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+# colors are stored as codes into COLOR_NAMES, unknown colors fall back to black
+COLOR_NAMES = list(COLOR_DICT)
+COLOR_CODES = {color_name: code for code, color_name in enumerate(COLOR_NAMES)}
+DEFAULT_COLOR_CODE = COLOR_CODES['Black']
+COLOR_LAB = rgb_to_lab(list(COLOR_DICT.values()))
+# 1 - CIE76 delta E between all pairs of colors, scaled to [0, 1] by the largest distance
+COLOR_DELTA_E = np.sqrt(((COLOR_LAB[:, None, :] - COLOR_LAB[None, :, :]) ** 2).sum(axis=-1))
+COLOR_SIMILARITY = 1 - COLOR_DELTA_E / COLOR_DELTA_E.max()
+
+
+# multiple category values are packed as bit masks, 24 bits per feature slot stay exact in float32 and float64,
+# attributes start with max_categories bits and get more slots when update_features() finds more categories
+MULTI_CATEGORY_BITS = 24
+MULTI_CATEGORY_SEPARATOR = ','
+
+
 class PlantAttributeType(Enum):
     NUMERIC = 0
     BOOL = 1
     COLOR = 2
     CATEGORICAL = 3
+    MULTI_CATEGORICAL = 4
 
 
 class PlantAttribute:
-    __slots__ = "feature_index", "attribute_name", "attribute_type", "unique", "max_value", "min_value", "optional", "unit", "categories"
+    __slots__ = "feature_index", "attribute_name", "attribute_type", "unique", "max_value", "min_value", "optional", "unit", "categories", \
+                "category_index", "max_categories"
     # general
     attribute_name: str
     attribute_type: PlantAttributeType
@@ -40,12 +70,14 @@ class PlantAttribute:
 
     # used for recommendations
     categories: list[str]
+    category_index: dict[str, int]
     feature_index: int
+    max_categories: int
     max_value: float
     min_value: float
 
     def __init__(self, attribute_name: str, attribute_type: PlantAttributeType, unit: str = '', unique: bool = False,
-                 optional: bool = False):
+                 optional: bool = False, max_categories: int = 2 * MULTI_CATEGORY_BITS):
         self.feature_index = -1
         self.attribute_name = attribute_name
         self.attribute_type = attribute_type
@@ -55,6 +87,8 @@ class PlantAttribute:
         self.unique = unique
         self.unit = unit
         self.categories = []
+        self.category_index = {}
+        self.max_categories = max_categories
 
 
 class Plant:
@@ -85,9 +119,9 @@ class Plant:
     features: np.array
 
     plant_attributes: list[PlantAttribute] = [
-        PlantAttribute("active_growth_period", PlantAttributeType.CATEGORICAL),
+        PlantAttribute("active_growth_period", PlantAttributeType.MULTI_CATEGORICAL),
         PlantAttribute("bloom_period", PlantAttributeType.CATEGORICAL),
-        PlantAttribute("climate", PlantAttributeType.CATEGORICAL),
+        PlantAttribute("climate", PlantAttributeType.MULTI_CATEGORICAL),
         PlantAttribute("difficulty", PlantAttributeType.CATEGORICAL),
         PlantAttribute("drought_tolerance", PlantAttributeType.CATEGORICAL),
         PlantAttribute("duration", PlantAttributeType.CATEGORICAL),
@@ -98,14 +132,14 @@ class Plant:
         PlantAttribute("foliage_porosity_winter", PlantAttributeType.CATEGORICAL),
         PlantAttribute("frost_free_days", PlantAttributeType.NUMERIC),
         PlantAttribute("fruit_color", PlantAttributeType.COLOR),
-        PlantAttribute("growth_habit", PlantAttributeType.CATEGORICAL),
+        PlantAttribute("growth_habit", PlantAttributeType.MULTI_CATEGORICAL),
         PlantAttribute("growth_rate", PlantAttributeType.CATEGORICAL),
         PlantAttribute("height", PlantAttributeType.NUMERIC, 'm', optional=True),
         PlantAttribute("humidity", PlantAttributeType.CATEGORICAL),
-        PlantAttribute("leaf_shape", PlantAttributeType.CATEGORICAL),
+        PlantAttribute("leaf_shape", PlantAttributeType.MULTI_CATEGORICAL),
         PlantAttribute("lifespan", PlantAttributeType.CATEGORICAL),
         PlantAttribute("light", PlantAttributeType.CATEGORICAL),
-        PlantAttribute("origin", PlantAttributeType.CATEGORICAL),
+        PlantAttribute("origin", PlantAttributeType.MULTI_CATEGORICAL),
         PlantAttribute("ph_minimum", PlantAttributeType.NUMERIC),
         PlantAttribute("ph_maximum", PlantAttributeType.NUMERIC),
         PlantAttribute("temperature", PlantAttributeType.CATEGORICAL),
@@ -135,26 +169,49 @@ class UserPlant:
         self.rating = rating
 
 
+# aggregates are weighted by UserPlant.rating and rescaled to the number of user plants when scoring
 class UserAttributeData:
-    __slots__ = "priority", "num_true", "true_ratio", "category_distribution"
+    __slots__ = "priority", "num_true", "true_ratio", "category_distribution", "value_sum", "square_sum", \
+                "color_weights", "masks", "mask_weights"
     priority: float
+
+    # BOOL
     num_true: float
     true_ratio: float
+
+    # CATEGORICAL
     category_distribution: np.array
 
+    # MULTI_CATEGORICAL
+    masks: np.array
+    mask_weights: np.array
+
+    # NUMERIC
+    value_sum: float
+    square_sum: float
+
+    # COLOR, rating weights indexed by color code
+    color_weights: np.array
+
     def __init__(self, priority: float):
         self.priority = priority
         self.num_true = 0.0
         self.true_ratio = 0.0
         self.category_distribution = np.array([])
+        self.value_sum = 0.0
+        self.square_sum = 0.0
+        self.color_weights = np.zeros(len(COLOR_NAMES))
+        self.masks = np.zeros((0, 0))
+        self.mask_weights = np.array([])
 
 
 class User:
-    __slots__ = "user_id", "name", "user_plants", "attribute_data"
+    __slots__ = "user_id", "name", "user_plants", "attribute_data", "rating_sum"
     user_id: int
     name: str
     user_plants: list[UserPlant]
     attribute_data: list[UserAttributeData]
+    rating_sum: float
 
     def __init__(self,
                  user_id: int,
@@ -166,6 +223,7 @@ class User:
         self.user_id = user_id
         self.name = name
         self.user_plants = user_plants
+        self.rating_sum = 0.0
 
         self.attribute_data = []
         for attribute_index in range(0, len(attribute_priority)):
@@ -0,0 +1,162 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .mapper import *
+from .snapshot import *
+
+
+class Source:
+    __slots__ = 'chunk_size', 'constant_attributes', 'csv_attributes', 'derived_attributes', 'file', 'name', \
+                'on_conflict', 'true_name'
+    chunk_size: int
+    constant_attributes: list[ConstantAttribute]
+    csv_attributes: list[CsvAttribute]
+    derived_attributes: list[DerivedAttribute]
+    file: str
+    name: str
+    # how plants already added by an earlier source are handled
+    on_conflict: ConflictPolicy
+    true_name: str
+
+    def __init__(self, name: str, file: str, csv_attributes: list[CsvAttribute],
+                 constant_attributes: Optional[list[ConstantAttribute]] = None,
+                 derived_attributes: Optional[list[DerivedAttribute]] = None, true_name='True',
+                 on_conflict: ConflictPolicy = ConflictPolicy.SKIP, chunk_size: int = 4096):
+        self.name = name
+        self.file = file
+        self.csv_attributes = csv_attributes
+        self.constant_attributes = [] if constant_attributes is None else constant_attributes
+        self.derived_attributes = [] if derived_attributes is None else derived_attributes
+        self.true_name = true_name
+        self.on_conflict = on_conflict
+        self.chunk_size = chunk_size
+
+
+class MergeSource:
+    __slots__ = 'csv_attributes', 'file', 'join_key', 'name', 'targets', 'true_name'
+    csv_attributes: list[CsvAttribute]
+    file: str
+    join_key: Optional[JoinKey]
+    name: str
+    # names of the sources whose plants are enriched, None for all
+    targets: Optional[list[str]]
+    true_name: str
+
+    def __init__(self, name: str, file: str, csv_attributes: list[CsvAttribute],
+                 targets: Optional[list[str]] = None, join_key: Optional[JoinKey] = None, true_name='True'):
+        self.name = name
+        self.file = file
+        self.csv_attributes = csv_attributes
+        self.targets = targets
+        self.join_key = join_key
+        self.true_name = true_name
+
+
+def to_mapper(function: Callable[[str], any]) -> Mapper:
+    # plain mapping functions are pure string functions and get memoized as well
+    return function if isinstance(function, Mapper) else Mapper(function)
+
+
+def memoize_source(source: Source) -> Source:
+    csv_attributes = [CsvAttribute(csv_attribute.name, csv_attribute.plant_attribute, csv_attribute.unit,
+                                   None if csv_attribute.mapping_function is None
+                                   else to_mapper(csv_attribute.mapping_function))
+                      for csv_attribute in source.csv_attributes]
+    derived_attributes = [DerivedAttribute(derived_attribute.name, derived_attribute.plant_attribute,
+                                           to_mapper(derived_attribute.mapping))
+                          for derived_attribute in source.derived_attributes]
+    return Source(source.name, source.file, csv_attributes, source.constant_attributes, derived_attributes,
+                  source.true_name, source.on_conflict, source.chunk_size)
+
+
+def get_mappers(source: Source) -> list[Mapper]:
+    # a mapper shared by several attributes is only listed once
+    mappers = [csv_attribute.mapping_function for csv_attribute in source.csv_attributes] + \
+              [derived_attribute.mapping for derived_attribute in source.derived_attributes]
+    return list({id(mapper): mapper for mapper in mappers if isinstance(mapper, Mapper)}.values())
+
+
+def parse_source(source: Source) -> tuple[list[Plant], list[MapperStats]]:
+    source = memoize_source(source)
+    plants = parse(source.file, source.csv_attributes, source.constant_attributes, source.derived_attributes,
+                   source.true_name, chunk_size=source.chunk_size)
+    # workers only send the statistics back, not the caches
+    return plants, [mapper.stats for mapper in get_mappers(source)]
+
+
+def fill_missing_attributes(plants: list[Plant], plant_attributes: list[PlantAttribute]):
+    # plants get the values they would have after a round trip through the export
+    for plant_attribute in plant_attributes:
+        match plant_attribute.attribute_type:
+            case PlantAttributeType.NUMERIC:
+                default = 0
+            case PlantAttributeType.BOOL:
+                default = False
+            case _:
+                default = ''
+        attribute_name = plant_attribute.attribute_name
+        for plant in plants:
+            if getattr(plant, attribute_name, None) is None:
+                setattr(plant, attribute_name, default)
+
+
+class BuildPipeline:
+    __slots__ = 'merge_sources', 'other_attributes', 'plant_attributes', 'sources'
+    merge_sources: list[MergeSource]
+    other_attributes: list[PlantAttribute]
+    plant_attributes: list[PlantAttribute]
+    sources: list[Source]
+
+    def __init__(self, plant_attributes: list[PlantAttribute], other_attributes: list[PlantAttribute]):
+        self.plant_attributes = plant_attributes
+        self.other_attributes = other_attributes
+        self.sources = []
+        self.merge_sources = []
+
+    def add_source(self, source: Source):
+        self.sources.append(source)
+
+    def add_merge_source(self, merge_source: MergeSource):
+        self.merge_sources.append(merge_source)
+
+    def parse_sources(self, processes: int = -1) -> list[tuple[list[Plant], list[MapperStats]]]:
+        # sources are independent, so every source is parsed in its own process
+        if processes < 0:
+            processes = os.cpu_count() or 1
+        processes = min(processes, len(self.sources))
+        if processes <= 1:
+            return [parse_source(source) for source in self.sources]
+        with ProcessPoolExecutor(processes) as executor:
+            return list(executor.map(parse_source, self.sources))
+
+    def run(self, export_file: str, snapshot_directory: Optional[str] = None, processes: int = -1) -> list[Plant]:
+        all_attributes = self.plant_attributes + self.other_attributes
+
+        # sources are combined in order, later sources resolve conflicts with their policy
+        dedup_index = DedupIndex(DedupIndex.get_join_keys(all_attributes))
+        source_plants = {}
+        for source, (plants, mapper_stats) in zip(self.sources, self.parse_sources(processes)):
+            source_plants[source.name] = [plant for plant in plants if dedup_index.add(plant, source.on_conflict)]
+            print(f'{source.name}: {len(source_plants[source.name])} of {len(plants)} plants added')
+            for stats in mapper_stats:
+                print(f'    {stats}')
+
+        for merge_source in self.merge_sources:
+            targets = self.sources if merge_source.targets is None else \
+                [source for source in self.sources if source.name in merge_source.targets]
+            plants = [plant for source in targets for plant in source_plants[source.name]]
+            stats = MergeStats()
+            parse_and_merge(merge_source.file, merge_source.csv_attributes, plants, merge_source.true_name,
+                            join_key=merge_source.join_key, stats=stats)
+            print(f'{merge_source.name}: {stats}')
+
+        # the export, its dedup keys and the feature snapshot are all written from the plants in memory
+        plants = [plant for source in self.sources for plant in source_plants[source.name]]
+        export_plants(export_file, plants, all_attributes)
+        # rows of the dedup index were numbered in export order
+        dedup_index.save(export_file + '.keys.json')
+        if snapshot_directory is not None:
+            fill_missing_attributes(plants, all_attributes)
+            feature_store = PlantRecommender.init_features(plants, self.plant_attributes)
+            publish_snapshot(snapshot_directory, feature_store, self.plant_attributes, self.other_attributes)
+        return plants
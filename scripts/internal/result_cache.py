@@ -0,0 +1,240 @@
+import hashlib
+import heapq
+import itertools
+import json
+import sys
+import time
+from collections import OrderedDict
+
+from .service import *
+
+# bytes of a cached recommendation, the plants themselves belong to the catalog
+RECOMMENDATION_SIZE = sys.getsizeof(PlantRecommendation(None, 0.0)) + sys.getsizeof(0.0)
+# key, entry and ordered dict node
+ENTRY_SIZE = 256
+
+
+class CachedResult:
+    __slots__ = 'expires', 'recommendations', 'rows', 'size', 'updatable', 'version'
+    # monotonic time, -1 for no expiry
+    expires: float
+    # copies, callers never see the cached objects
+    recommendations: tuple[PlantRecommendation, ...]
+    # rows of the catalog the result was computed on
+    rows: int
+    # estimated bytes
+    size: int
+    # results of an exhaustive scan take appended rows by scoring only them, index results are computed again
+    updatable: bool
+    # catalog version the result was computed on
+    version: int
+
+    def __init__(self, recommendations: tuple[PlantRecommendation, ...], expires: float, size: int, version: int,
+                 rows: int, updatable: bool):
+        self.recommendations = recommendations
+        self.expires = expires
+        self.size = size
+        self.version = version
+        self.rows = rows
+        self.updatable = updatable
+
+
+class ResultCacheStats:
+    __slots__ = 'bypasses', 'evictions', 'expirations', 'hits', 'invalidations', 'misses', 'updates'
+    # requests that cannot be cached, e.g. for plant lists other than the catalog
+    bypasses: int
+    # entries dropped for the entry or memory limit
+    evictions: int
+    expirations: int
+    hits: int
+    # entries dropped because rows they were computed on changed
+    invalidations: int
+    misses: int
+    # entries brought up to date by scoring only the rows appended since
+    updates: int
+
+    def __init__(self):
+        self.bypasses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.hits = 0
+        self.invalidations = 0
+        self.misses = 0
+        self.updates = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses + self.updates
+        return self.hits / requests if requests else 0.0
+
+    def __str__(self):
+        return f'{self.hits + self.misses + self.updates} requests, {self.hit_rate:.1%} hits, ' \
+               f'{self.updates} updated, {self.bypasses} bypassed, {self.evictions} evicted, ' \
+               f'{self.expirations} expired, {self.invalidations} invalidated'
+
+
+class ResultCache:
+    __slots__ = 'entries', 'feature_store', 'max_bytes', 'max_entries', 'rewritten_version', 'size', 'stats', 'ttl'
+    # least recently used first
+    entries: OrderedDict[bytes, CachedResult]
+    # catalog the entries were computed on
+    feature_store: Optional[FeatureStore]
+    max_bytes: int
+    max_entries: int
+    # FeatureStore.rewritten_version the entries were last checked against
+    rewritten_version: int
+    # estimated bytes of all entries
+    size: int
+    stats: ResultCacheStats
+    # seconds until an entry expires, -1 for no expiry
+    ttl: float
+
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 64 * 2 ** 20, ttl: float = -1):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.feature_store = None
+        self.rewritten_version = 0
+        self.size = 0
+        self.stats = ResultCacheStats()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def get_key(user: User, feature_store: FeatureStore, filter_user_plants: bool, top_k: int,
+                conditions: Optional[dict[str, str | list[str]]], index: Optional[IvfIndex], n_probe: int) -> bytes:
+        # stable for the same plants, ratings and priorities, no matter in which order the plants were added or
+        # whether the numbers came as int or float
+        user_plants = sorted((str(feature_store.get_key(user_plant.plant)), float(user_plant.rating))
+                             for user_plant in user.user_plants)
+        priorities = [float(data.priority) for data in user.attribute_data]
+        if conditions:
+            conditions = sorted((name, value if isinstance(value, str) else sorted(value))
+                                for name, value in conditions.items())
+        probe = None if index is None else [index.token, max(1, min(int(n_probe), len(index.centroids)))]
+        request = json.dumps([user_plants, priorities, bool(filter_user_plants), int(top_k), conditions or None, probe])
+        return hashlib.blake2b(request.encode(), digest_size=16).digest()
+
+    @staticmethod
+    def copy(recommendations: Iterable[PlantRecommendation]) -> list[PlantRecommendation]:
+        return [PlantRecommendation(recommendation.plant, recommendation.score) for recommendation in recommendations]
+
+    @staticmethod
+    def merge(recommendations: Iterable[PlantRecommendation], appended: list[PlantRecommendation],
+              top_k: int) -> list[PlantRecommendation]:
+        # appended rows come after the cached ones, so ties keep catalog order like TopKSelector
+        merged = heapq.merge(recommendations, appended,
+                             key=lambda recommendation: -np.round(recommendation.score, RANK_DECIMALS))
+        return list(merged if top_k < 0 else itertools.islice(merged, top_k))
+
+    def remove(self, key: bytes):
+        self.size -= self.entries.pop(key).size
+
+    def invalidate(self, keys: list[bytes]):
+        for key in keys:
+            self.remove(key)
+        if keys:
+            self.stats.invalidations += len(keys)
+            METRICS.increment('recommend_cache_dropped_total', len(keys), reason='invalidated')
+
+    def set_feature_store(self, feature_store: FeatureStore):
+        # entries computed before rows of the catalog were rewritten are dropped, entries that only miss appended
+        # rows are kept and updated on their next request
+        if feature_store is not self.feature_store:
+            self.invalidate(list(self.entries))
+            self.feature_store = feature_store
+        elif feature_store.rewritten_version != self.rewritten_version:
+            self.invalidate([key for key, entry in self.entries.items()
+                             if entry.version < feature_store.rewritten_version])
+        self.rewritten_version = feature_store.rewritten_version
+
+    def lookup(self, key: bytes) -> Optional[CachedResult]:
+        # the entry for key if it is still valid, it may miss rows appended since
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.set_feature_store(self.feature_store)
+        if key not in self.entries:
+            return None
+        if 0 <= entry.expires < time.monotonic():
+            self.remove(key)
+            self.stats.expirations += 1
+            METRICS.increment('recommend_cache_dropped_total', reason='expired')
+            return None
+        if entry.version != self.feature_store.version and not entry.updatable:
+            self.invalidate([key])
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def hit(self, entry: CachedResult) -> list[PlantRecommendation]:
+        self.stats.hits += 1
+        METRICS.increment('recommend_cache_requests_total', result='hit')
+        return ResultCache.copy(entry.recommendations)
+
+    def miss(self):
+        self.stats.misses += 1
+        METRICS.increment('recommend_cache_requests_total', result='miss')
+
+    def get(self, key: bytes) -> Optional[list[PlantRecommendation]]:
+        # only results that are up to date with the catalog, recommend_plant() also updates older ones
+        entry = self.lookup(key)
+        if entry is None or entry.version != self.feature_store.version:
+            self.miss()
+            return None
+        return self.hit(entry)
+
+    def put(self, key: bytes, recommendations: list[PlantRecommendation], updatable: bool = True):
+        # recommendations computed on the current version of the catalog given to set_feature_store()
+        if key in self.entries:
+            self.remove(key)
+        size = ENTRY_SIZE + sys.getsizeof(tuple(recommendations)) + len(recommendations) * RECOMMENDATION_SIZE
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl >= 0 else -1
+        self.entries[key] = CachedResult(tuple(ResultCache.copy(recommendations)), expires, size,
+                                         self.feature_store.version, len(self.feature_store), updatable)
+        self.size += size
+
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.stats.evictions += 1
+            METRICS.increment('recommend_cache_dropped_total', reason='evicted')
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def recommend_plant(self, plants: list[Plant], plant_attributes: list[PlantAttribute], user: User,
+                        filter_user_plants: bool = False, feature_store: Optional[FeatureStore] = None,
+                        top_k: int = -1, index: Optional[IvfIndex] = None, n_probe: int = 8,
+                        conditions: Optional[dict[str, str | list[str]]] = None) -> list[PlantRecommendation]:
+        # same arguments as PlantRecommender.recommend_plant, only requests on the whole catalog of a feature store
+        # are cached, user profiles have to be up to date with the catalog
+        if feature_store is None or not feature_store.is_catalog(plants):
+            self.stats.bypasses += 1
+            METRICS.increment('recommend_cache_requests_total', result='bypass')
+            return PlantRecommender.recommend_plant(plants, plant_attributes, user, filter_user_plants, feature_store,
+                                                    top_k, index, n_probe, conditions)
+
+        self.set_feature_store(feature_store)
+        key = ResultCache.get_key(user, feature_store, filter_user_plants, top_k, conditions, index, n_probe)
+        entry = self.lookup(key)
+        if entry is not None and entry.version == feature_store.version:
+            return self.hit(entry)
+        if entry is not None:
+            # only the rows appended since are scored, the rows before kept their features
+            appended = PlantRecommender.recommend_plant(plants[entry.rows:len(feature_store)], plant_attributes, user,
+                                                        filter_user_plants, feature_store, top_k, None, n_probe,
+                                                        conditions) if entry.rows < len(feature_store) else []
+            recommendations = ResultCache.merge(entry.recommendations, appended, top_k)
+            self.stats.updates += 1
+            METRICS.increment('recommend_cache_requests_total', result='update')
+        else:
+            self.miss()
+            recommendations = PlantRecommender.recommend_plant(plants, plant_attributes, user, filter_user_plants,
+                                                               feature_store, top_k, index, n_probe, conditions)
+        self.put(key, recommendations, index is None)
+        return recommendations
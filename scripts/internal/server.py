@@ -0,0 +1,292 @@
+import asyncio
+import json
+import math
+from http import HTTPStatus
+
+from .result_cache import *
+
+
+class BatchRequest:
+    __slots__ = 'filter_user_plants', 'future', 'top_k', 'user'
+    filter_user_plants: bool
+    future: asyncio.Future
+    top_k: int
+    user: User
+
+    def __init__(self, user: User, filter_user_plants: bool, top_k: int, future: asyncio.Future):
+        self.user = user
+        self.filter_user_plants = filter_user_plants
+        self.top_k = top_k
+        self.future = future
+
+
+class MicroBatcher:
+    __slots__ = 'batches', 'feature_store', 'max_batch_size', 'max_wait', 'plant_attributes', 'queue', 'requests', \
+                'task'
+    batches: int
+    feature_store: FeatureStore
+    max_batch_size: int
+    # seconds a batch that is not full waits for more requests
+    max_wait: float
+    plant_attributes: list[PlantAttribute]
+    # bounded, submit() fails right away if it is full
+    queue: asyncio.Queue
+    requests: int
+    task: Optional[asyncio.Task]
+
+    def __init__(self, feature_store: FeatureStore, plant_attributes: list[PlantAttribute], max_batch_size: int = 64,
+                 max_wait: float = 0.002, max_queue: int = 1024):
+        self.feature_store = feature_store
+        self.plant_attributes = plant_attributes
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(max_queue)
+        self.batches = 0
+        self.requests = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    def submit(self, user: User, filter_user_plants: bool, top_k: int) -> asyncio.Future:
+        # raises asyncio.QueueFull when the batcher is behind
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(BatchRequest(user, filter_user_plants, top_k, future))
+        return future
+
+    def take_queued(self, batch: list[BatchRequest]):
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+
+    def score(self, batch: list[BatchRequest]) -> list[list[PlantRecommendation]]:
+        # one matrix operation per filter setting, with the largest top_k of the group
+        results = [None] * len(batch)
+        for filter_user_plants in (False, True):
+            positions = [position for position in range(0, len(batch))
+                         if batch[position].filter_user_plants == filter_user_plants]
+            if not positions:
+                continue
+            top_ks = [batch[position].top_k for position in positions]
+            top_k = -1 if min(top_ks) < 0 else max(top_ks)
+            recommendations = PlantRecommender.recommend_batch(
+                self.feature_store.plants, self.plant_attributes, [batch[position].user for position in positions],
+                filter_user_plants, self.feature_store, top_k, chunk_size=self.max_batch_size)
+            for position, user_recommendations in zip(positions, recommendations):
+                results[position] = user_recommendations if batch[position].top_k < 0 \
+                    else user_recommendations[:batch[position].top_k]
+        return results
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            self.take_queued(batch)
+            if len(batch) < self.max_batch_size and self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+                self.take_queued(batch)
+
+            # requests that timed out while waiting are not scored
+            batch = [request for request in batch if not request.future.done()]
+            if not batch:
+                continue
+            start = METRICS.start()
+            try:
+                # the event loop keeps accepting requests while the batch is scored
+                results = await asyncio.to_thread(self.score, batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            for request, recommendations in zip(batch, results):
+                if not request.future.done():
+                    request.future.set_result(recommendations)
+            self.batches += 1
+            self.requests += len(batch)
+            METRICS.stop('server_batch', start)
+            METRICS.observe('server_batch_size', len(batch))
+
+
+class RecommendationServer:
+    __slots__ = 'batcher', 'cache', 'failed', 'feature_store', 'idle_timeout', 'max_body', 'plant_attributes', \
+                'rejected', 'request_timeout', 'timed_out'
+    batcher: MicroBatcher
+    # None to score every request
+    cache: Optional[ResultCache]
+    # requests answered with 500 because scoring raised
+    failed: int
+    feature_store: FeatureStore
+    # seconds a keep-alive connection may wait for its next request
+    idle_timeout: float
+    max_body: int
+    plant_attributes: list[PlantAttribute]
+    # requests answered with 503 because the batch queue was full
+    rejected: int
+    request_timeout: float
+    timed_out: int
+
+    def __init__(self, feature_store: FeatureStore, plant_attributes: list[PlantAttribute], batcher: MicroBatcher,
+                 cache: Optional[ResultCache] = None, request_timeout: float = 5.0, idle_timeout: float = 30.0,
+                 max_body: int = 2 ** 20):
+        self.feature_store = feature_store
+        self.plant_attributes = plant_attributes
+        self.batcher = batcher
+        self.cache = cache
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+        self.max_body = max_body
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        if cache is not None:
+            cache.set_feature_store(feature_store)
+
+    def parse_user(self, json_data: dict) -> User:
+        # same format as example.json, plants are names or {"name": ..., "rating": ...}
+        json_user = json_data['user']
+        priorities = json_user.get('priorities') or [1.0] * len(self.plant_attributes)
+        if len(priorities) != len(self.plant_attributes):
+            raise ValueError(f'Expected {len(self.plant_attributes)} priorities, got {len(priorities)}')
+        priorities = [float(priority) for priority in priorities]
+        # inf would turn the scores into NaN, which is not valid json
+        if not all(math.isfinite(priority) and priority >= 0 for priority in priorities) \
+                or not 0 < sum(priorities) < math.inf:
+            raise ValueError('Priorities must be finite, not negative and at least one must be positive')
+        user = User(json_user.get('user_id', 0), json_user.get('name', ''), priorities)
+
+        for json_plant in json_user['plants']:
+            name, rating = (json_plant, 5.0) if isinstance(json_plant, str) else \
+                (json_plant['name'], float(json_plant.get('rating', 5.0)))
+            if not (math.isfinite(rating) and rating >= 0):
+                raise ValueError(f'Rating for {name} must be finite and not negative')
+            plant = self.feature_store.get_plant(name)
+            if plant is None:
+                raise ValueError(f'Unknown plant {name}')
+            user.user_plants.append(UserPlant(plant, rating))
+        if not user.user_plants or not 0 < sum(user_plant.rating for user_plant in user.user_plants) < math.inf:
+            raise ValueError('The user needs plants with a positive finite rating sum')
+        return user
+
+    def to_json(self, recommendation: PlantRecommendation) -> dict:
+        plant = recommendation.plant
+        return {'name': self.feature_store.get_key(plant), 'common_name': getattr(plant, 'common_name', ''),
+                'score': recommendation.score}
+
+    async def recommend(self, body: bytes) -> tuple[HTTPStatus, dict]:
+        try:
+            json_data = json.loads(body)
+            user = self.parse_user(json_data)
+            filter_user_plants = bool(json_data.get('filter_user_plants', True))
+            top_k = int(json_data.get('top_k', 10))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+
+        key = None
+        if self.cache is not None:
+            key = ResultCache.get_key(user, self.feature_store, filter_user_plants, top_k, None, None, 0)
+            recommendations = self.cache.get(key)
+            if recommendations is not None:
+                return HTTPStatus.OK, {'recommendations': [self.to_json(r) for r in recommendations]}
+
+        try:
+            future = self.batcher.submit(user, filter_user_plants, top_k)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            METRICS.increment('server_rejected_total')
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'Too many requests, try again later'}
+        try:
+            recommendations = await asyncio.wait_for(future, self.request_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            METRICS.increment('server_timed_out_total')
+            return HTTPStatus.GATEWAY_TIMEOUT, {'error': 'Request timed out'}
+        except Exception as e:
+            # scoring errors are reported to the client instead of dropping the connection
+            self.failed += 1
+            METRICS.increment('server_failed_total')
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f'{type(e).__name__}: {e}'}
+
+        if self.cache is not None:
+            self.cache.put(key, recommendations)
+        return HTTPStatus.OK, {'recommendations': [self.to_json(r) for r in recommendations]}
+
+    def get_stats(self) -> dict:
+        batcher = self.batcher
+        return {'plants': len(self.feature_store), 'batches': batcher.batches, 'requests': batcher.requests,
+                'mean_batch_size': batcher.requests / batcher.batches if batcher.batches else 0.0,
+                'queued': batcher.queue.qsize(), 'rejected': self.rejected, 'timed_out': self.timed_out,
+                'failed': self.failed, 'cache': None if self.cache is None else str(self.cache.stats)}
+
+    async def handle_request(self, method: str, path: str, body: bytes) -> tuple[HTTPStatus, dict]:
+        if path == '/recommend':
+            if method != 'POST':
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use POST'}
+            return await self.recommend(body)
+        if path == '/stats' and method == 'GET':
+            return HTTPStatus.OK, self.get_stats()
+        return HTTPStatus.NOT_FOUND, {'error': f'No route for {method} {path}'}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # minimal http/1.1 with keep-alive, one request at a time per connection
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                try:
+                    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                    method, path, version = request_line.split(' ', 2)
+                    headers = {}
+                    for line in header_lines:
+                        if line:
+                            name, value = line.split(':', 1)
+                            headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError(f'Negative Content-Length {length}')
+                except ValueError as e:
+                    # the end of the request is unknown, so the connection cannot be reused
+                    status, payload = HTTPStatus.BAD_REQUEST, {'error': f'Malformed request: {e}'}
+                    keep_alive = False
+                else:
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                    if length > self.max_body:
+                        status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': 'Request body too large'}
+                        keep_alive = False
+                    else:
+                        try:
+                            body = await asyncio.wait_for(reader.readexactly(length), self.request_timeout)
+                        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                            break
+                        status, payload = await self.handle_request(method, path.split('?', 1)[0], body)
+
+                content = json.dumps(payload).encode()
+                response_headers = [f'HTTP/1.1 {status.value} {status.phrase}', 'Content-Type: application/json',
+                                    f'Content-Length: {len(content)}',
+                                    'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+                if status == HTTPStatus.SERVICE_UNAVAILABLE:
+                    response_headers.append('Retry-After: 1')
+                writer.write(('\r\n'.join(response_headers) + '\r\n\r\n').encode('latin-1') + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = 'localhost', port: int = 8080):
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
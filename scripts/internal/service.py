@@ -1,6 +1,15 @@
-import math
+import heapq
+from collections.abc import Iterable, Iterator
 
+from .index import *
+from .metrics import *
 from .model import *
+from .store import *
+
+BIT_COUNTS = np.array([bin(byte).count('1') for byte in range(0, 256)], dtype=np.uint8)
+# plants are ranked by their scores rounded to this many decimals, so rounding errors of the vectorized sums
+# (about 1e-10) cannot reorder plants with equal scores, ties keep their catalog order
+RANK_DECIMALS = 9
 
 
 class PlantAttributeService:
@@ -12,27 +21,171 @@ class PlantAttributeService:
             case PlantAttributeType.BOOL:
                 return 1
             case PlantAttributeType.COLOR:
-                return 3
+                return 1
             case PlantAttributeType.CATEGORICAL:
                 return 1
 
+    @staticmethod
+    def get_feature_slots(plant_attribute: PlantAttribute) -> int:
+        if plant_attribute.attribute_type == PlantAttributeType.MULTI_CATEGORICAL:
+            return -(-plant_attribute.max_categories // MULTI_CATEGORY_BITS)
+        return PlantAttributeService.get_number_of_feature_slots(plant_attribute.attribute_type)
+
+    @staticmethod
+    def get_category_index(plant_attribute: PlantAttribute, value: str) -> int:
+        category_index = plant_attribute.category_index
+        if len(category_index) != len(plant_attribute.categories):
+            category_index.clear()
+            for index in range(0, len(plant_attribute.categories)):
+                category_index[plant_attribute.categories[index]] = index
+
+        index = category_index.get(value)
+        if index is None:
+            index = len(plant_attribute.categories)
+            plant_attribute.categories.append(value)
+            category_index[value] = index
+        return index
+
+    @staticmethod
+    def get_category_codes(plant_attribute: PlantAttribute, value: str) -> list[int]:
+        codes = []
+        for category in value.split(MULTI_CATEGORY_SEPARATOR):
+            category = category.strip()
+            if category:
+                codes.append(PlantAttributeService.get_category_index(plant_attribute, category))
+        return codes
+
+    @staticmethod
+    def get_category_mask(plant_attribute: PlantAttribute, value: str) -> list[int]:
+        words = [0] * PlantAttributeService.get_feature_slots(plant_attribute)
+        for index in PlantAttributeService.get_category_codes(plant_attribute, value):
+            if index >= plant_attribute.max_categories:
+                raise ValueError(f'Attribute {plant_attribute.attribute_name} has more than '
+                                 f'{plant_attribute.max_categories} categories')
+            words[index // MULTI_CATEGORY_BITS] |= 1 << (index % MULTI_CATEGORY_BITS)
+        return words
+
 
 class UserService:
     @staticmethod
-    def init_user_attributes(user: User, plant_attributes: list[PlantAttribute]):
+    def get_user_features(user: User, plant_attributes: list[PlantAttribute],
+                          feature_store: Optional[FeatureStore] = None) -> np.ndarray:
+        user_plants = [user_plant.plant for user_plant in user.user_plants]
+        if feature_store is not None:
+            return feature_store.get_features(user_plants)
+        if not user_plants:
+            # nothing to stack, the aggregates of a user without plants are all zero
+            return np.zeros((0, max((plant_attribute.feature_index + PlantAttributeService.get_feature_slots(
+                plant_attribute) for plant_attribute in plant_attributes), default=0)))
+        return PlantRecommender.stack_features(user_plants)
+
+    @staticmethod
+    def init_user_attributes(user: User, plant_attributes: list[PlantAttribute],
+                             feature_store: Optional[FeatureStore] = None):
+        start = METRICS.start()
+        user_features = UserService.get_user_features(user, plant_attributes, feature_store)
+        ratings = np.array([user_plant.rating for user_plant in user.user_plants], dtype=np.float64)
+        user.rating_sum = float(np.sum(ratings))
         attribute_list = plant_attributes
         for attribute_index in range(0, len(attribute_list)):
+            attribute_start = METRICS.start()
             feature_index = attribute_list[attribute_index].feature_index
             data = user.attribute_data[attribute_index]
             if attribute_list[attribute_index].attribute_type == PlantAttributeType.BOOL:
-                for user_plant in user.user_plants:
-                    data.num_true += user_plant.plant.features[feature_index]
-                data.true_ratio = (data.num_true / len(user.user_plants)) - 0.5
+                data.num_true = float(ratings @ user_features[:, feature_index])
+                UserService.update_true_ratio(user, data)
             elif attribute_list[attribute_index].attribute_type == PlantAttributeType.CATEGORICAL:
-                data.category_distribution = np.zeros(len(attribute_list[attribute_index].categories))
-                for user_plant in user.user_plants:
-                    cat_index = user_plant.plant.features[feature_index]
-                    data.category_distribution[int(cat_index)] += 1
+                cat_indices = user_features[:, feature_index].astype(np.intp)
+                data.category_distribution = np.bincount(
+                    cat_indices, weights=ratings, minlength=len(attribute_list[attribute_index].categories))
+            elif attribute_list[attribute_index].attribute_type == PlantAttributeType.NUMERIC:
+                values = user_features[:, feature_index]
+                data.value_sum = float(ratings @ values)
+                data.square_sum = float(ratings @ (values ** 2))
+            elif attribute_list[attribute_index].attribute_type == PlantAttributeType.COLOR:
+                data.color_weights = np.bincount(user_features[:, feature_index].astype(np.intp), weights=ratings,
+                                                 minlength=len(COLOR_NAMES))
+            elif attribute_list[attribute_index].attribute_type == PlantAttributeType.MULTI_CATEGORICAL:
+                slots = PlantAttributeService.get_feature_slots(attribute_list[attribute_index])
+                masks, mask_codes = np.unique(user_features[:, feature_index:feature_index + slots], axis=0,
+                                              return_inverse=True)
+                data.masks = masks
+                data.mask_weights = np.bincount(mask_codes.reshape(-1), weights=ratings, minlength=len(masks))
+            if METRICS.enabled:
+                METRICS.stop('init_user_attributes_attribute', attribute_start,
+                             type=attribute_list[attribute_index].attribute_type.name)
+        if METRICS.enabled:
+            METRICS.stop('init_user_attributes', start, user_plants=get_size_class(len(user.user_plants)))
+
+    @staticmethod
+    def update_true_ratio(user: User, data: UserAttributeData):
+        data.true_ratio = (data.num_true / user.rating_sum) - 0.5 if user.rating_sum else 0.0
+
+    @staticmethod
+    def add_weighted_row(rows: np.ndarray, weights: np.ndarray, row: np.ndarray,
+                         rating: float) -> tuple[np.ndarray, np.ndarray]:
+        matches = np.flatnonzero(np.all(rows == row, axis=1)) if len(rows) else []
+        if len(matches):
+            weights[matches[0]] += rating
+            return rows, weights
+        return np.vstack([rows.reshape(-1, len(row)), row]), np.append(weights, rating)
+
+    @staticmethod
+    def apply_user_plant(user: User, plant: Plant, rating: float, plant_attributes: list[PlantAttribute]):
+        user.rating_sum += rating
+        features = plant.features
+        for attribute_index in range(0, len(plant_attributes)):
+            plant_attribute = plant_attributes[attribute_index]
+            feature_index = plant_attribute.feature_index
+            data = user.attribute_data[attribute_index]
+
+            match plant_attribute.attribute_type:
+                case PlantAttributeType.NUMERIC:
+                    value = float(features[feature_index])
+                    data.value_sum += rating * value
+                    data.square_sum += rating * value ** 2
+                case PlantAttributeType.BOOL:
+                    data.num_true += rating * float(features[feature_index])
+                case PlantAttributeType.COLOR:
+                    data.color_weights[int(features[feature_index])] += rating
+                case PlantAttributeType.MULTI_CATEGORICAL:
+                    slots = PlantAttributeService.get_feature_slots(plant_attribute)
+                    if data.masks.shape[1] < slots:
+                        data.masks = np.pad(data.masks, ((0, 0), (0, slots - data.masks.shape[1])))
+                    data.masks, data.mask_weights = UserService.add_weighted_row(
+                        data.masks, data.mask_weights, features[feature_index:feature_index + slots], rating)
+                case PlantAttributeType.CATEGORICAL:
+                    cat_index = int(features[feature_index])
+                    if cat_index >= len(data.category_distribution):
+                        data.category_distribution = np.pad(
+                            data.category_distribution,
+                            (0, max(cat_index + 1, len(plant_attribute.categories)) - len(data.category_distribution)))
+                    data.category_distribution[cat_index] += rating
+
+        # BOOL ratios depend on the total rating
+        for attribute_index in range(0, len(plant_attributes)):
+            if plant_attributes[attribute_index].attribute_type == PlantAttributeType.BOOL:
+                UserService.update_true_ratio(user, user.attribute_data[attribute_index])
+
+    @staticmethod
+    def add_user_plant(user: User, user_plant: UserPlant, plant_attributes: list[PlantAttribute]):
+        user.user_plants.append(user_plant)
+        UserService.apply_user_plant(user, user_plant.plant, user_plant.rating, plant_attributes)
+
+    @staticmethod
+    def remove_user_plant(user: User, user_plant: UserPlant, plant_attributes: list[PlantAttribute]):
+        for index in range(0, len(user.user_plants)):
+            if user.user_plants[index] is user_plant:
+                del user.user_plants[index]
+                break
+        else:
+            raise ValueError(f'{user_plant.plant} is not a plant of user {user.user_id}')
+        UserService.apply_user_plant(user, user_plant.plant, -user_plant.rating, plant_attributes)
+
+    @staticmethod
+    def update_rating(user: User, user_plant: UserPlant, rating: float, plant_attributes: list[PlantAttribute]):
+        UserService.apply_user_plant(user, user_plant.plant, rating - user_plant.rating, plant_attributes)
+        user_plant.rating = rating
 
 
 class PlantRecommendation:
@@ -48,131 +201,501 @@ class PlantRecommendation:
         return str(self.plant) + ": " + str(self.score)
 
 
+class TopKSelector:
+    __slots__ = "heap", "k", "count"
+    # rank score, negative arrival order, score and plant
+    heap: list[tuple[float, int, float, Plant]]
+    k: int
+    count: int
+
+    def __init__(self, k: int):
+        self.heap = []
+        self.k = k
+        self.count = 0
+
+    @staticmethod
+    def select(scores: np.ndarray, k: int = -1) -> np.ndarray:
+        scores = np.round(scores, RANK_DECIMALS)
+        if k < 0 or k >= len(scores):
+            return np.argsort(-scores, kind='stable')
+        if k == 0:
+            return np.array([], dtype=np.intp)
+
+        # take everything above the k-th score and fill up with the earliest ties to stay stable
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        selected = np.concatenate([above, ties])
+        return selected[np.argsort(-scores[selected], kind='stable')]
+
+    def push(self, plants: list[Plant], scores: np.ndarray):
+        rank_scores = np.round(scores, RANK_DECIMALS)
+        for index in TopKSelector.select(scores, self.k):
+            # ties are broken by arrival order, so later plants are evicted first
+            entry = (float(rank_scores[index]), -(self.count + int(index)), float(scores[index]), plants[index])
+            if self.k < 0 or len(self.heap) < self.k:
+                heapq.heappush(self.heap, entry)
+            elif entry[:2] > self.heap[0][:2]:
+                heapq.heapreplace(self.heap, entry)
+        self.count += len(plants)
+
+    def result(self) -> list[PlantRecommendation]:
+        entries = sorted(self.heap, key=lambda entry: entry[:2], reverse=True)
+        return [PlantRecommendation(plant, score) for _, _, score, plant in entries]
+
+
 class PlantRecommender:
     @staticmethod
-    def to_color(color_name):
-        if color_name not in COLOR_DICT:
-            result = COLOR_DICT['Black']
-        else:
-            rgb = COLOR_DICT[color_name]
-            result = np.zeros(3)
-            for i in range(3):
-                result[i] = rgb[i] / 255.0
-        return result
+    def to_color_code(color_name: str) -> int:
+        return COLOR_CODES.get(color_name, DEFAULT_COLOR_CODE)
 
     @staticmethod
-    def update_features(new_plants: list[Plant], current_plants: list[Plant], plant_attributes: list[PlantAttribute]):
+    def create_feature_store(plant_attributes: list[PlantAttribute], dtype=np.float64) -> FeatureStore:
         number_features = 0
+        attribute_slices = {}
         for plant_attribute in plant_attributes:
             plant_attribute.feature_index = number_features
-            number_features += PlantAttributeService.get_number_of_feature_slots(plant_attribute.attribute_type)
+            number_features += PlantAttributeService.get_feature_slots(plant_attribute)
+            attribute_slices[plant_attribute.attribute_name] = slice(plant_attribute.feature_index, number_features)
+        return FeatureStore(attribute_slices, dtype=dtype)
+
+    @staticmethod
+    def update_features(new_plants: list[Plant], current_plants: list[Plant], plant_attributes: list[PlantAttribute],
+                        feature_store: Optional[FeatureStore] = None) -> FeatureStore:
+        if feature_store is None:
+            feature_store = PlantRecommender.create_feature_store(plant_attributes)
+            if current_plants:
+                PlantRecommender.update_features(current_plants, [], plant_attributes, feature_store)
 
-        # init feature array
-        for plant in new_plants:
-            plant.features = np.zeros(number_features)
+        # new plants get zero-copy row views into the store
+        start = METRICS.start()
+        has_current_plants = len(feature_store) > 0
+        new_rows = feature_store.append(new_plants)
+        new_features = feature_store.matrix[new_rows]
+        if not new_plants:
+            return feature_store
 
         for plant_attribute in plant_attributes:
+            attribute_start = METRICS.start()
             feature_index = plant_attribute.feature_index
+            attribute_name = plant_attribute.attribute_name
 
             match plant_attribute.attribute_type:
                 case PlantAttributeType.NUMERIC:
-                    if current_plants:
-                        max_value = plant_attribute.max_value
-                        min_value = plant_attribute.min_value
+                    raw_column = feature_store.get_raw_column(attribute_name)
+                    raw_column[new_rows] = [getattr(plant, attribute_name) for plant in new_plants]
+                    values = raw_column[new_rows]
+                    if has_current_plants:
+                        max_value = max(plant_attribute.max_value, values.max())
+                        min_value = min(plant_attribute.min_value, values.min())
                     else:
-                        max_value = getattr(new_plants[0], plant_attribute.attribute_name)
-                        min_value = getattr(new_plants[0], plant_attribute.attribute_name)
-
-                    old_max_value = max_value
-                    old_min_value = min_value
-
-                    for plant in new_plants:
-                        current_value = getattr(plant, plant_attribute.attribute_name)
-                        if current_value > max_value:
-                            max_value = current_value
-                        if current_value < min_value:
-                            min_value = current_value
-
-                    plant_attribute.max_value = max_value
-                    plant_attribute.min_value = min_value
-
-                    if current_plants and (old_max_value != max_value or old_min_value != min_value):
-                        for plant in current_plants:
-                            current_value = getattr(plant, plant_attribute.attribute_name)
-                            plant.features[feature_index] = (current_value - min_value) / (max_value - min_value)
-
-                    for plant in new_plants:
-                        current_value = getattr(plant, plant_attribute.attribute_name)
-                        plant.features[feature_index] = (current_value - min_value) / (max_value - min_value)
+                        max_value = values.max()
+                        min_value = values.min()
+
+                    # only rewrite the whole column if the normalization range changed
+                    rows = new_rows
+                    if has_current_plants and (plant_attribute.max_value != max_value
+                                               or plant_attribute.min_value != min_value):
+                        rows = slice(0, len(feature_store))
+                        feature_store.mark_dirty(attribute_name)
+
+                    plant_attribute.max_value = float(max_value)
+                    plant_attribute.min_value = float(min_value)
+                    value_range = max_value - min_value
+                    if value_range == 0:
+                        feature_store.buffer[rows, feature_index] = 0
+                    else:
+                        feature_store.buffer[rows, feature_index] = (raw_column[rows] - min_value) / value_range
+                case PlantAttributeType.BOOL:
+                    new_features[:, feature_index] = [1 if getattr(plant, attribute_name) else 0
+                                                      for plant in new_plants]
+                case PlantAttributeType.COLOR:
+                    new_features[:, feature_index] = [
+                        PlantRecommender.to_color_code(getattr(plant, attribute_name)) for plant in new_plants]
+                case PlantAttributeType.CATEGORICAL:
+                    number_categories = len(plant_attribute.categories)
+                    new_features[:, feature_index] = [
+                        PlantAttributeService.get_category_index(plant_attribute, getattr(plant, attribute_name))
+                        for plant in new_plants]
+                    # the scores are divided by the number of categories, so a new one changes every row
+                    if has_current_plants and len(plant_attribute.categories) > number_categories:
+                        feature_store.mark_rewritten()
+                case PlantAttributeType.MULTI_CATEGORICAL:
+                    masks = dict.fromkeys(getattr(plant, attribute_name) for plant in new_plants)
+                    for value in masks:
+                        PlantAttributeService.get_category_codes(plant_attribute, value)
+                    if len(plant_attribute.categories) > plant_attribute.max_categories:
+                        PlantRecommender.add_mask_slots(feature_store, plant_attributes, plant_attribute)
+                        new_features = feature_store.matrix[new_rows]
+                        feature_index = plant_attribute.feature_index
+                    slots = PlantAttributeService.get_feature_slots(plant_attribute)
+                    for value in masks:
+                        masks[value] = PlantAttributeService.get_category_mask(plant_attribute, value)
+                    for row in range(0, len(new_plants)):
+                        value = getattr(new_plants[row], attribute_name)
+                        new_features[row, feature_index:feature_index + slots] = masks[value]
+            if METRICS.enabled:
+                METRICS.stop('update_features_attribute', attribute_start, type=plant_attribute.attribute_type.name)
+
+        feature_store.get_category_index(plant_attributes)
+        feature_store.version += 1
+        METRICS.stop('update_features', start)
+        METRICS.increment('update_features_plants_total', len(new_plants))
+        return feature_store
+
+    @staticmethod
+    def add_mask_slots(feature_store: FeatureStore, plant_attributes: list[PlantAttribute],
+                       plant_attribute: PlantAttribute):
+        # at least doubles the slots, the columns of the later attributes move and IVF indexes are trained again
+        slots = PlantAttributeService.get_feature_slots(plant_attribute)
+        new_slots = max(2 * slots, -(-len(plant_attribute.categories) // MULTI_CATEGORY_BITS))
+        feature_store.insert_columns(plant_attributes, plant_attribute, new_slots - slots)
+        plant_attribute.max_categories = new_slots * MULTI_CATEGORY_BITS
+
+    @staticmethod
+    def init_features(plant_list: list[Plant], plant_attributes: list[PlantAttribute],
+                      dtype=np.float64) -> FeatureStore:
+        feature_store = PlantRecommender.create_feature_store(plant_attributes, dtype)
+        return PlantRecommender.update_features(plant_list, [], plant_attributes, feature_store)
+
+    @staticmethod
+    def stack_features(plants: list[Plant]) -> np.ndarray:
+        return np.stack([plant.features for plant in plants])
+
+    @staticmethod
+    def count_bits(words: np.ndarray) -> np.ndarray:
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(words).sum(axis=-1)
+        # numpy < 2.0 has no popcount, count the bits of every byte with a lookup table
+        words = np.ascontiguousarray(words, dtype=np.uint32)
+        return BIT_COUNTS[words.view(np.uint8)].reshape(words.shape[:-1] + (-1,)).sum(axis=-1)
+
+    @staticmethod
+    def mask_similarity(user_masks: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        # jaccard similarity of the category sets, two empty sets are equal
+        if user_masks.shape[1] < masks.shape[1]:
+            # profiles from before the attribute got more slots
+            user_masks = np.pad(user_masks, ((0, 0), (0, masks.shape[1] - user_masks.shape[1])))
+        user_masks = user_masks.astype(np.uint32)[:, None, :]
+        masks = masks.astype(np.uint32)[None, :, :]
+        intersection = PlantRecommender.count_bits(user_masks & masks)
+        union = PlantRecommender.count_bits(user_masks | masks)
+        return np.divide(intersection, union, out=np.ones(union.shape), where=union > 0)
+
+    @staticmethod
+    def get_masks(feature_matrix: np.ndarray, plant_attribute: PlantAttribute,
+                  mask_codes: Optional[dict[str, tuple[np.ndarray, np.ndarray]]]) -> tuple[np.ndarray, np.ndarray]:
+        # distinct masks and the mask code of every row, taken from FeatureStore.get_mask_codes() if given
+        if mask_codes is not None and plant_attribute.attribute_name in mask_codes:
+            return mask_codes[plant_attribute.attribute_name]
+        slots = PlantAttributeService.get_feature_slots(plant_attribute)
+        masks, codes = np.unique(feature_matrix[:, plant_attribute.feature_index:plant_attribute.feature_index + slots],
+                                 axis=0, return_inverse=True)
+        return masks, codes.reshape(-1)
+
+    @staticmethod
+    def score_plants(feature_matrix: np.ndarray, plant_attributes: list[PlantAttribute], user: User,
+                     mask_codes: Optional[dict[str, tuple[np.ndarray, np.ndarray]]] = None) -> np.ndarray:
+        if user.rating_sum <= 0:
+            raise ValueError(f'User {user.user_id} has no plants with a positive rating sum')
+        number_user_plants = len(user.user_plants)
+        # rescales rating weighted aggregates to the number of user plants
+        rating_scale = number_user_plants / user.rating_sum
+        scores = np.zeros(len(feature_matrix))
+
+        for attribute_index in range(0, len(plant_attributes)):
+            attribute_start = METRICS.start()
+            plant_attribute = plant_attributes[attribute_index]
+            feature_index = plant_attribute.feature_index
+
+            match plant_attribute.attribute_type:
+                case PlantAttributeType.NUMERIC:
+                    # sum_j (x - u_j)^2 = k * x^2 - 2 * x * sum_j u_j + sum_j u_j^2
+                    data = user.attribute_data[attribute_index]
+                    column = feature_matrix[:, feature_index]
+                    distance = (number_user_plants * column ** 2 - 2 * (rating_scale * data.value_sum) * column) \
+                        + rating_scale * data.square_sum
+                    attribute_score = 1 - np.sqrt(np.maximum(distance, 0))
                 case PlantAttributeType.BOOL:
-                    for plant in new_plants:
-                        current_value = getattr(plant, plant_attribute.attribute_name)
-                        plant.features[feature_index] = 1 if current_value else 0
+                    a = user.attribute_data[attribute_index].true_ratio
+                    v = feature_matrix[:, feature_index]
+                    attribute_score = 0.5 + v * a - (1 - v) * a
                 case PlantAttributeType.COLOR:
-                    for plant in new_plants:
-                        color_string = getattr(plant, plant_attribute.attribute_name)
-                        current_value = PlantRecommender.to_color(color_string)
-                        for i in range(0, 3):
-                            plant.features[feature_index + i] = current_value[i]
+                    # score every palette color once, then look the plant colors up
+                    color_scores = (user.attribute_data[attribute_index].color_weights @ COLOR_SIMILARITY) \
+                        / user.rating_sum
+                    attribute_score = color_scores[feature_matrix[:, feature_index].astype(np.intp)]
+                case PlantAttributeType.MULTI_CATEGORICAL:
+                    # score every distinct mask once, then look the plant masks up
+                    data = user.attribute_data[attribute_index]
+                    masks, codes = PlantRecommender.get_masks(feature_matrix, plant_attribute, mask_codes)
+                    mask_scores = (data.mask_weights @ PlantRecommender.mask_similarity(data.masks, masks)) \
+                        / user.rating_sum
+                    attribute_score = mask_scores[codes]
                 case PlantAttributeType.CATEGORICAL:
-                    for plant in new_plants:
-                        current_value = getattr(plant, plant_attribute.attribute_name)
-                        index = None
-                        if current_value in plant_attribute.categories:
-                            index = plant_attribute.categories.index(current_value)
-                        else:
-                            index = len(plant_attribute.categories)
-                            plant_attribute.categories.append(current_value)
-                        plant.features[feature_index] = index
+                    number_categories = len(plant_attribute.categories)
+                    category_distribution = user.attribute_data[attribute_index].category_distribution
+                    if len(category_distribution) < number_categories:
+                        category_distribution = np.pad(category_distribution,
+                                                       (0, number_categories - len(category_distribution)))
+                    category_scores = category_distribution * number_user_plants / user.rating_sum / number_categories
+                    attribute_score = category_scores[feature_matrix[:, feature_index].astype(np.intp)]
+
+            scores += user.attribute_data[attribute_index].priority * attribute_score
+            if METRICS.enabled:
+                METRICS.stop('score_plants_attribute', attribute_start, type=plant_attribute.attribute_type.name)
+
+        prio = 0.0
+        for attribute_index in range(0, len(plant_attributes)):
+            prio += user.attribute_data[attribute_index].priority
+        scores /= prio
+        return scores
+
+    @staticmethod
+    def get_user_plant_positions(plants: list[Plant], user: User,
+                                 feature_store: Optional[FeatureStore] = None) -> np.ndarray:
+        if feature_store is not None and feature_store.is_catalog(plants):
+            return feature_store.get_rows([user_plant.plant for user_plant in user.user_plants])
+        user_plant_ids = {id(user_plant.plant) for user_plant in user.user_plants}
+        return np.array([index for index in range(0, len(plants)) if id(plants[index]) in user_plant_ids],
+                        dtype=np.intp)
 
     @staticmethod
-    def init_features(plant_list: list[Plant], plant_attributes: list[PlantAttribute]):
-        PlantRecommender.update_features(plant_list, [], plant_attributes)
+    def get_positions(plants: list[Plant], rows: np.ndarray, feature_store: FeatureStore) -> np.ndarray:
+        # sorted positions in plants of the given feature store rows
+        if feature_store.is_catalog(plants):
+            return rows
+        return np.flatnonzero(np.isin(feature_store.get_rows(plants), rows))
+
+    @staticmethod
+    def get_filtered_positions(plants: list[Plant], plant_attributes: list[PlantAttribute],
+                               conditions: dict[str, str | list[str]], feature_store: FeatureStore) -> np.ndarray:
+        rows = feature_store.get_category_index(plant_attributes).filter(plant_attributes, conditions)
+        return PlantRecommender.get_positions(plants, rows, feature_store)
 
     @staticmethod
     def recommend_plant(plants: list[Plant], plant_attributes: list[PlantAttribute], user: User,
-                        filter_user_plants: bool = False) -> list[PlantRecommendation]:
-        result: list[PlantRecommendation] = []
+                        filter_user_plants: bool = False, feature_store: Optional[FeatureStore] = None,
+                        top_k: int = -1, index: Optional[IvfIndex] = None, n_probe: int = 8,
+                        conditions: Optional[dict[str, str | list[str]]] = None) -> list[PlantRecommendation]:
+        start = METRICS.start()
+        if feature_store is None:
+            if conditions:
+                raise ValueError('Filter conditions need a feature store')
+            feature_matrix = PlantRecommender.stack_features(plants)
+            rows = None
+        else:
+            rows = None if feature_store.is_catalog(plants) else feature_store.get_rows(plants)
+            feature_matrix = feature_store.matrix if rows is None else feature_store.matrix[rows]
 
-        for plant in plants:
-            if filter_user_plants and any(user_plant.plant == plant for user_plant in user.user_plants):
+        # hard constraints and the index narrow the candidates before scoring
+        candidates = None
+        METRICS.observe('recommend_candidates', len(plants), stage='catalog')
+        if conditions:
+            candidates = PlantRecommender.get_filtered_positions(plants, plant_attributes, conditions, feature_store)
+            METRICS.observe('recommend_candidates', len(candidates), stage='filtered')
+        if index is not None:
+            if feature_store is not None:
+                feature_store.update_index(index, plant_attributes)
+            probed = index.search(index.get_query(user, plant_attributes), n_probe)
+            if feature_store is not None:
+                # index rows are feature store rows, without a store they are positions in plants
+                probed = PlantRecommender.get_positions(plants, probed, feature_store)
+            candidates = probed if candidates is None else np.intersect1d(candidates, probed, assume_unique=True)
+            METRICS.observe('recommend_candidates', len(candidates), stage='probed')
+        if candidates is None:
+            candidates = np.arange(len(plants))
+        else:
+            feature_matrix = feature_matrix[candidates]
+            rows = candidates if rows is None else rows[candidates]
+        mask_codes = None if feature_store is None else feature_store.get_mask_codes(plant_attributes, rows)
+        scores = PlantRecommender.score_plants(feature_matrix, plant_attributes, user, mask_codes)
+
+        if filter_user_plants:
+            keep = ~np.isin(candidates, PlantRecommender.get_user_plant_positions(plants, user, feature_store))
+            candidates = candidates[keep]
+            scores = scores[keep]
+
+        # only the winners are materialized as recommendations
+        order = TopKSelector.select(scores, top_k)
+        recommendations = [PlantRecommendation(plants[candidates[position]], float(scores[position]))
+                           for position in order]
+        METRICS.observe('recommend_candidates', len(recommendations), stage='returned')
+        if METRICS.enabled:
+            METRICS.stop('recommend_plant', start, user_plants=get_size_class(len(user.user_plants)))
+        return recommendations
+
+    @staticmethod
+    def recommend_plant_streaming(plant_chunks: Iterable[list[Plant]], plant_attributes: list[PlantAttribute],
+                                  user: User, top_k: int, filter_user_plants: bool = False,
+                                  feature_store: Optional[FeatureStore] = None) -> list[PlantRecommendation]:
+        user_plant_ids = {id(user_plant.plant) for user_plant in user.user_plants}
+        selector = TopKSelector(top_k)
+        for plants in plant_chunks:
+            if filter_user_plants:
+                plants = [plant for plant in plants if id(plant) not in user_plant_ids]
+            if not plants:
                 continue
+            if feature_store is None:
+                feature_matrix = PlantRecommender.stack_features(plants)
+                mask_codes = None
+            else:
+                rows = feature_store.get_rows(plants)
+                feature_matrix = feature_store.matrix[rows]
+                mask_codes = feature_store.get_mask_codes(plant_attributes, rows)
+            selector.push(plants, PlantRecommender.score_plants(feature_matrix, plant_attributes, user, mask_codes))
+        return selector.result()
+
+    @staticmethod
+    def score_batch(feature_matrix: np.ndarray, plant_attributes: list[PlantAttribute], users: list[User],
+                    user_features: np.ndarray, user_offsets: np.ndarray,
+                    mask_codes: Optional[dict[str, tuple[np.ndarray, np.ndarray]]] = None) -> np.ndarray:
+        number_users = len(users)
+        counts = np.diff(user_offsets)
+        user_index = np.repeat(np.arange(number_users), counts)
+        # rating weights rescaled so that every user's weights sum up to the number of user plants
+        ratings = np.array([user_plant.rating for user in users for user_plant in user.user_plants], dtype=np.float64)
+        rating_sums = np.bincount(user_index, weights=ratings, minlength=number_users)
+        if np.any(rating_sums <= 0):
+            user = users[int(np.argmax(rating_sums <= 0))]
+            raise ValueError(f'User {user.user_id} has no plants with a positive rating sum')
+        weights = ratings * (counts / rating_sums)[user_index]
+        priorities = np.array([[user.attribute_data[attribute_index].priority
+                                for attribute_index in range(0, len(plant_attributes))] for user in users])
+        scores = np.zeros((number_users, len(feature_matrix)))
+
+        for attribute_index in range(0, len(plant_attributes)):
+            attribute_start = METRICS.start()
+            plant_attribute = plant_attributes[attribute_index]
+            feature_index = plant_attribute.feature_index
+
+            match plant_attribute.attribute_type:
+                case PlantAttributeType.NUMERIC:
+                    # sum_j (x - u_j)^2 = k * x^2 - 2 * x * sum_j u_j + sum_j u_j^2
+                    column = feature_matrix[:, feature_index]
+                    user_values = user_features[:, feature_index]
+                    sums = np.bincount(user_index, weights=weights * user_values, minlength=number_users)
+                    square_sums = np.bincount(user_index, weights=weights * user_values ** 2, minlength=number_users)
+                    distance = (counts[:, None] * column ** 2 - 2 * sums[:, None] * column) + square_sums[:, None]
+                    attribute_score = 1 - np.sqrt(np.maximum(distance, 0))
+                case PlantAttributeType.BOOL:
+                    num_true = np.bincount(user_index, weights=weights * user_features[:, feature_index],
+                                           minlength=number_users)
+                    a = (num_true / counts) - 0.5
+                    v = feature_matrix[:, feature_index]
+                    # 0.5 + v * a - (1 - v) * a as one outer product
+                    attribute_score = (0.5 - a)[:, None] + (2 * a)[:, None] * v
+                case PlantAttributeType.COLOR:
+                    # score every palette color per user once, fold in priority and gather the plant colors
+                    color_histogram = np.zeros((number_users, len(COLOR_NAMES)))
+                    np.add.at(color_histogram, (user_index, user_features[:, feature_index].astype(np.intp)), weights)
+                    color_scores = (color_histogram @ COLOR_SIMILARITY) \
+                        * (priorities[:, attribute_index] / counts)[:, None]
+                    scores += color_scores[:, feature_matrix[:, feature_index].astype(np.intp)]
+                    if METRICS.enabled:
+                        METRICS.stop('score_batch_attribute', attribute_start, type=plant_attribute.attribute_type.name)
+                    continue
+                case PlantAttributeType.MULTI_CATEGORICAL:
+                    # score the distinct masks per user once, fold in priority and gather the plant masks
+                    slots = PlantAttributeService.get_feature_slots(plant_attribute)
+                    masks, codes = PlantRecommender.get_masks(feature_matrix, plant_attribute, mask_codes)
+                    user_masks, user_codes = np.unique(user_features[:, feature_index:feature_index + slots], axis=0,
+                                                       return_inverse=True)
+                    mask_histogram = np.zeros((number_users, len(user_masks)))
+                    np.add.at(mask_histogram, (user_index, user_codes.reshape(-1)), weights)
+                    mask_scores = (mask_histogram @ PlantRecommender.mask_similarity(user_masks, masks)) \
+                        * (priorities[:, attribute_index] / counts)[:, None]
+                    scores += mask_scores[:, codes]
+                    if METRICS.enabled:
+                        METRICS.stop('score_batch_attribute', attribute_start, type=plant_attribute.attribute_type.name)
+                    continue
+                case PlantAttributeType.CATEGORICAL:
+                    number_categories = len(plant_attribute.categories)
+                    category_distribution = np.zeros((number_users, number_categories))
+                    np.add.at(category_distribution,
+                              (user_index, user_features[:, feature_index].astype(np.intp)), weights)
+                    # fold priority and normalization into the small distribution before the gather
+                    category_distribution *= priorities[:, attribute_index, None] / number_categories
+                    scores += category_distribution[:, feature_matrix[:, feature_index].astype(np.intp)]
+                    if METRICS.enabled:
+                        METRICS.stop('score_batch_attribute', attribute_start, type=plant_attribute.attribute_type.name)
+                    continue
+
+            scores += priorities[:, attribute_index, None] * attribute_score
+            if METRICS.enabled:
+                METRICS.stop('score_batch_attribute', attribute_start, type=plant_attribute.attribute_type.name)
+
+        scores /= priorities.sum(axis=1)[:, None]
+        return scores
 
-            score: float = 0.0
-
-            for attribute_index in range(0, len(plant_attributes)):
-                plant_attribute = plant_attributes[attribute_index]
-                feature_index = plant_attribute.feature_index
-                attribute_score = 0.0
-
-                match plant_attribute.attribute_type:
-                    case PlantAttributeType.NUMERIC:
-                        for user_plant in user.user_plants:
-                            attribute_score += (plant.features[feature_index]
-                                                - user_plant.plant.features[feature_index]) ** 2
-                        attribute_score = 1 - math.sqrt(attribute_score)
-                    case PlantAttributeType.BOOL:
-                        a = user.attribute_data[attribute_index].true_ratio
-                        v = plant.features[feature_index]
-                        attribute_score = 0.5 + v * a - (1 - v) * a
-                    case PlantAttributeType.COLOR:
-                        for user_plant in user.user_plants:
-                            color_score = 0.0
-                            for i in range(feature_index, feature_index + 3):
-                                color_score += abs(plant.features[i] - user_plant.plant.features[i])
-                            attribute_score += 1 - (color_score / 3)
-                        attribute_score /= len(user.user_plants)
-                    case PlantAttributeType.CATEGORICAL:
-                        attribute_score = user.attribute_data[attribute_index].category_distribution[
-                                              int(plant.features[feature_index])] / len(plant_attribute.categories)
-
-                score += user.attribute_data[attribute_index].priority * attribute_score
-
-            prio = 0.0
-            for attribute_index in range(0, len(plant_attributes)):
-                prio += user.attribute_data[attribute_index].priority
-            score /= prio
-            result.append(PlantRecommendation(plant, score))
-
-        result.sort(key=lambda x: x.score, reverse=True)
+    @staticmethod
+    def chunk_users(users: list[User], chunk_size: int, max_user_plants: int) -> Iterator[list[User]]:
+        chunk = []
+        chunk_user_plants = 0
+        for user in users:
+            if chunk and (len(chunk) == chunk_size or chunk_user_plants + len(user.user_plants) > max_user_plants):
+                yield chunk
+                chunk = []
+                chunk_user_plants = 0
+            chunk.append(user)
+            chunk_user_plants += len(user.user_plants)
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def recommend_batch_chunks(plants: list[Plant], plant_attributes: list[PlantAttribute], users: list[User],
+                               filter_user_plants: bool = False, feature_store: Optional[FeatureStore] = None,
+                               top_k: int = -1, chunk_size: int = 64,
+                               max_user_plants: int = 1024) -> Iterator[list[list[PlantRecommendation]]]:
+        if feature_store is None:
+            feature_matrix = PlantRecommender.stack_features(plants)
+            positions = {id(plants[index]): index for index in range(0, len(plants))}
+            mask_codes = None
+        else:
+            rows = None if feature_store.is_catalog(plants) else feature_store.get_rows(plants)
+            feature_matrix = feature_store.matrix if rows is None else feature_store.matrix[rows]
+            positions = None if rows is None else {id(plants[index]): index for index in range(0, len(plants))}
+            mask_codes = feature_store.get_mask_codes(plant_attributes, rows)
+
+        for chunk in PlantRecommender.chunk_users(users, chunk_size, max_user_plants):
+            start = METRICS.start()
+            chunk_plants = [user_plant.plant for user in chunk for user_plant in user.user_plants]
+            user_offsets = np.cumsum([0] + [len(user.user_plants) for user in chunk])
+            if feature_store is None:
+                user_features = PlantRecommender.stack_features(chunk_plants)
+            else:
+                user_features = feature_store.get_features(chunk_plants)
+            scores = PlantRecommender.score_batch(feature_matrix, plant_attributes, chunk, user_features,
+                                                  user_offsets, mask_codes)
+
+            results = []
+            for user_index in range(0, len(chunk)):
+                user_scores = scores[user_index]
+                number_candidates = len(plants)
+                if filter_user_plants:
+                    user_plants = chunk_plants[user_offsets[user_index]:user_offsets[user_index + 1]]
+                    if positions is None:
+                        user_positions = np.unique(feature_store.get_rows(user_plants))
+                    else:
+                        user_positions = np.unique([positions[id(plant)] for plant in user_plants
+                                                    if id(plant) in positions]).astype(np.intp)
+                    # filtered plants sort last and are cut off below
+                    user_scores[user_positions] = -np.inf
+                    number_candidates -= len(user_positions)
+                k = number_candidates if top_k < 0 else min(top_k, number_candidates)
+                order = TopKSelector.select(user_scores, k)
+                results.append([PlantRecommendation(plants[index], float(user_scores[index])) for index in order])
+            if METRICS.enabled:
+                METRICS.stop('recommend_batch_chunk', start, users=get_size_class(len(chunk)))
+            yield results
+
+    @staticmethod
+    def recommend_batch(plants: list[Plant], plant_attributes: list[PlantAttribute], users: list[User],
+                        filter_user_plants: bool = False, feature_store: Optional[FeatureStore] = None,
+                        top_k: int = -1, chunk_size: int = 64,
+                        max_user_plants: int = 1024) -> list[list[PlantRecommendation]]:
+        result = []
+        for results in PlantRecommender.recommend_batch_chunks(plants, plant_attributes, users, filter_user_plants,
+                                                               feature_store, top_k, chunk_size, max_user_plants):
+            result.extend(results)
         return result
@@ -0,0 +1,273 @@
+import bisect
+import json
+import os
+import shutil
+import time
+
+from .data import *
+from .service import *
+
+SNAPSHOT_VERSION = 3
+
+FEATURES_FILE = 'features.npy'
+CODES_FILE = 'codes.npy'
+VALUES_FILE = 'values.npy'
+STRINGS_FILE = 'strings.npy'
+STRING_OFFSETS_FILE = 'string_offsets.npy'
+KEY_ORDER_FILE = 'key_order.npy'
+MANIFEST_FILE = 'manifest.json'
+INDEX_FILE = 'ivf_index.npz'
+CURRENT_LINK = 'current'
+
+
+def is_string_attribute(plant_attribute: PlantAttribute) -> bool:
+    return plant_attribute.attribute_type in (PlantAttributeType.COLOR, PlantAttributeType.CATEGORICAL,
+                                             PlantAttributeType.MULTI_CATEGORICAL)
+
+
+def save_snapshot(directory: str, feature_store: FeatureStore, plant_attributes: list[PlantAttribute],
+                  other_attributes: list[PlantAttribute]):
+    os.makedirs(directory, exist_ok=True)
+    plants = feature_store.plants
+    manifest_file = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    # an index of the previous snapshot would point at the wrong rows
+    if os.path.exists(os.path.join(directory, INDEX_FILE)):
+        os.remove(os.path.join(directory, INDEX_FILE))
+
+    all_attributes = plant_attributes + other_attributes
+    string_attributes = [plant_attribute for plant_attribute in all_attributes if is_string_attribute(plant_attribute)]
+    value_attributes = [plant_attribute for plant_attribute in all_attributes
+                        if not is_string_attribute(plant_attribute)]
+
+    # string attributes are dictionary encoded into one UTF-8 blob, numeric and bool attributes are plain columns
+    codes = np.zeros((len(plants), len(string_attributes)), dtype=np.int32)
+    values = np.zeros((len(plants), len(value_attributes)), dtype=np.float64)
+    encoded_strings = []
+    string_columns = []
+    for column in range(0, len(string_attributes)):
+        attribute_name = string_attributes[column].attribute_name
+        vocabulary = {}
+        codes[:, column] = [vocabulary.setdefault(getattr(plant, attribute_name, ''), len(vocabulary))
+                            for plant in plants]
+        string_columns.append({'attribute_name': attribute_name, 'start': len(encoded_strings),
+                               'size': len(vocabulary)})
+        encoded_strings.extend(value.encode() for value in vocabulary)
+    for column in range(0, len(value_attributes)):
+        attribute_name = value_attributes[column].attribute_name
+        values[:, column] = [getattr(plant, attribute_name, 0) for plant in plants]
+
+    # rows sorted by key for binary search without a per-process dictionary
+    key_order = sorted(range(0, len(plants)), key=lambda row: str(feature_store.get_key(plants[row])))
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'size': len(feature_store),
+        'key_attribute': feature_store.key_attribute,
+        'attribute_slices': {name: [s.start, s.stop] for name, s in feature_store.attribute_slices.items()},
+        'plant_attributes': [{
+            'attribute_name': plant_attribute.attribute_name,
+            'attribute_type': plant_attribute.attribute_type.name,
+            'feature_index': plant_attribute.feature_index,
+            'max_value': plant_attribute.max_value,
+            'min_value': plant_attribute.min_value,
+            'categories': plant_attribute.categories,
+            'max_categories': plant_attribute.max_categories,
+        } for plant_attribute in plant_attributes],
+        'string_columns': string_columns,
+        'value_columns': [{'attribute_name': plant_attribute.attribute_name,
+                           'attribute_type': plant_attribute.attribute_type.name}
+                          for plant_attribute in value_attributes],
+    }
+
+    np.save(os.path.join(directory, FEATURES_FILE), np.ascontiguousarray(feature_store.matrix))
+    np.save(os.path.join(directory, CODES_FILE), codes)
+    np.save(os.path.join(directory, VALUES_FILE), values)
+    np.save(os.path.join(directory, STRINGS_FILE), np.frombuffer(b''.join(encoded_strings), dtype=np.uint8))
+    np.save(os.path.join(directory, STRING_OFFSETS_FILE),
+            np.cumsum([0] + [len(value) for value in encoded_strings], dtype=np.int64))
+    np.save(os.path.join(directory, KEY_ORDER_FILE), np.array(key_order, dtype=np.int64))
+    # the manifest is written last, so a snapshot without one is incomplete
+    with open(manifest_file, 'w') as file:
+        json.dump(manifest, file)
+
+
+def save_index(directory: str, index: IvfIndex):
+    index.save(os.path.join(resolve_snapshot(directory), INDEX_FILE))
+
+
+def load_index(directory: str) -> Optional[IvfIndex]:
+    file = os.path.join(resolve_snapshot(directory), INDEX_FILE)
+    return IvfIndex.load(file) if os.path.exists(file) else None
+
+
+def publish_snapshot(root: str, feature_store: FeatureStore, plant_attributes: list[PlantAttribute],
+                     other_attributes: list[PlantAttribute], keep: int = 2) -> str:
+    os.makedirs(root, exist_ok=True)
+    name = str(time.time_ns())
+    save_snapshot(os.path.join(root, name), feature_store, plant_attributes, other_attributes)
+
+    # readers either see the old or the new snapshot, never a partially written one
+    temporary_link = os.path.join(root, f'.{CURRENT_LINK}-{os.getpid()}')
+    os.symlink(name, temporary_link)
+    os.replace(temporary_link, os.path.join(root, CURRENT_LINK))
+
+    # mapped files stay valid for attached processes after they are removed
+    snapshots = sorted(entry for entry in os.listdir(root) if entry.isdigit())
+    for entry in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return os.path.join(root, name)
+
+
+def resolve_snapshot(path: str) -> str:
+    current = os.path.join(path, CURRENT_LINK)
+    if os.path.islink(current):
+        return os.path.realpath(current)
+    return path
+
+
+def load_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'Unsupported snapshot version {manifest.get("version")} in {directory}, '
+                         f'expected {SNAPSHOT_VERSION}')
+    return manifest
+
+
+class SnapshotReader:
+    __slots__ = "codes", "directory", "key_order", "manifest", "matrix", "string_columns", "string_offsets", \
+                "strings", "value_columns", "values"
+    codes: np.ndarray
+    directory: str
+    key_order: np.ndarray
+    manifest: dict
+    matrix: np.ndarray
+    string_columns: dict[str, tuple[int, int]]
+    string_offsets: np.ndarray
+    strings: np.ndarray
+    value_columns: dict[str, tuple[int, PlantAttributeType]]
+    values: np.ndarray
+
+    def __init__(self, directory: str, mmap_mode: Optional[str] = 'r'):
+        self.directory = directory
+        self.manifest = load_manifest(directory)
+
+        def load(file_name):
+            array = np.load(os.path.join(directory, file_name), mmap_mode=mmap_mode)
+            # plain ndarray views on the mapping are cheaper to slice than memmap objects
+            return array.view(np.ndarray) if isinstance(array, np.memmap) else array
+
+        self.matrix = load(FEATURES_FILE)
+        self.codes = load(CODES_FILE)
+        self.values = load(VALUES_FILE)
+        self.strings = load(STRINGS_FILE)
+        self.string_offsets = load(STRING_OFFSETS_FILE)
+        self.key_order = load(KEY_ORDER_FILE)
+        self.string_columns = {}
+        for column, data in enumerate(self.manifest['string_columns']):
+            self.string_columns[data['attribute_name']] = (column, data['start'])
+        self.value_columns = {}
+        for column, data in enumerate(self.manifest['value_columns']):
+            self.value_columns[data['attribute_name']] = (column, PlantAttributeType[data['attribute_type']])
+
+    def __len__(self):
+        return self.manifest['size']
+
+    def apply_attribute_metadata(self, plant_attributes: list[PlantAttribute]):
+        attribute_data = {data['attribute_name']: data for data in self.manifest['plant_attributes']}
+        for plant_attribute in plant_attributes:
+            data = attribute_data.get(plant_attribute.attribute_name)
+            if data is None or data['attribute_type'] != plant_attribute.attribute_type.name:
+                raise ValueError(f'Snapshot in {self.directory} does not match attribute '
+                                 f'{plant_attribute.attribute_name}')
+            plant_attribute.feature_index = data['feature_index']
+            plant_attribute.max_value = data['max_value']
+            plant_attribute.min_value = data['min_value']
+            plant_attribute.categories = data['categories']
+            plant_attribute.max_categories = data.get('max_categories', plant_attribute.max_categories)
+            plant_attribute.category_index = {category: code
+                                              for code, category in enumerate(plant_attribute.categories)}
+
+    def get_attribute_slices(self) -> dict[str, slice]:
+        return {name: slice(start, stop) for name, (start, stop) in self.manifest['attribute_slices'].items()}
+
+    def decode_string(self, index: int) -> str:
+        return self.strings[self.string_offsets[index]:self.string_offsets[index + 1]].tobytes().decode()
+
+    def get_vocabulary(self, attribute_name: str) -> list[str]:
+        column, start = self.string_columns[attribute_name]
+        size = self.manifest['string_columns'][column]['size']
+        offsets = (self.string_offsets[start:start + size + 1] - self.string_offsets[start]).tolist()
+        data = self.strings[self.string_offsets[start]:self.string_offsets[start + size]].tobytes()
+        return [data[offsets[i]:offsets[i + 1]].decode() for i in range(0, size)]
+
+    def get_value(self, attribute_name: str, row: int):
+        if attribute_name in self.string_columns:
+            column, start = self.string_columns[attribute_name]
+            return self.decode_string(start + int(self.codes[row, column]))
+        column, attribute_type = self.value_columns[attribute_name]
+        value = float(self.values[row, column])
+        return value != 0 if attribute_type == PlantAttributeType.BOOL else value
+
+    def read_plant(self, row: int) -> Plant:
+        plant = Plant()
+        for attribute_name in self.string_columns:
+            setattr(plant, attribute_name, self.get_value(attribute_name, row))
+        for attribute_name in self.value_columns:
+            setattr(plant, attribute_name, self.get_value(attribute_name, row))
+        plant.features = self.matrix[row]
+        return plant
+
+    def find_row(self, key: str) -> Optional[int]:
+        if not isinstance(key, str):
+            return None
+        key_attribute = self.manifest['key_attribute']
+        index = bisect.bisect_left(self.key_order, key, key=lambda row: self.get_value(key_attribute, row))
+        if index < len(self.key_order) and self.get_value(key_attribute, self.key_order[index]) == key:
+            return int(self.key_order[index])
+        return None
+
+
+def load_snapshot(directory: str, plant_attributes: list[PlantAttribute], other_attributes: list[PlantAttribute],
+                  mmap_mode: Optional[str] = 'c') -> FeatureStore:
+    # copy-on-write mapping: pages are shared between processes until a process writes to them
+    reader = SnapshotReader(resolve_snapshot(directory), mmap_mode)
+    reader.apply_attribute_metadata(plant_attributes)
+
+    raw_columns = {}
+    for plant_attribute in plant_attributes:
+        if plant_attribute.attribute_type == PlantAttributeType.NUMERIC:
+            column, _ = reader.value_columns[plant_attribute.attribute_name]
+            raw_columns[plant_attribute.attribute_name] = np.array(reader.values[:, column])
+
+    feature_store = FeatureStore(reader.get_attribute_slices(), reader.manifest['key_attribute'], reader.matrix.dtype)
+    # plants are read from the mapped columns on first access and found by a binary search over the keys
+    plants = LazyPlantList(reader.read_plant, len(reader), reader.matrix)
+    feature_store.attach(reader.matrix, plants, raw_columns, LazyRowIndex(reader.find_row))
+    return feature_store
+
+
+def build_feature_store(csv_file: str, plant_attributes: list[PlantAttribute],
+                        other_attributes: list[PlantAttribute], chunk_size: int = 4096) -> FeatureStore:
+    # plants are parsed and appended to the store one chunk at a time
+    feature_store = PlantRecommender.create_feature_store(plant_attributes)
+    for plants in parse_plants_chunks(csv_file, plant_attributes + other_attributes, chunk_size=chunk_size):
+        PlantRecommender.update_features(plants, [], plant_attributes, feature_store)
+    return feature_store
+
+
+def load_or_build_snapshot(directory: str, csv_file: str, plant_attributes: list[PlantAttribute],
+                           other_attributes: list[PlantAttribute]) -> FeatureStore:
+    manifest_file = os.path.join(resolve_snapshot(directory), MANIFEST_FILE)
+    if os.path.exists(manifest_file) and os.path.getmtime(manifest_file) >= os.path.getmtime(csv_file):
+        try:
+            return load_snapshot(directory, plant_attributes, other_attributes)
+        except ValueError as e:
+            print(f'Rebuilding snapshot: {e}')
+
+    # published like a pipeline export, so the next start checks the snapshot that was written
+    feature_store = build_feature_store(csv_file, plant_attributes, other_attributes)
+    publish_snapshot(directory, feature_store, plant_attributes, other_attributes)
+    return feature_store
@@ -0,0 +1,275 @@
+import operator
+from collections.abc import Callable, Sequence
+
+from .index import *
+from .model import *
+
+
+class LazyPlantList(Sequence):
+    __slots__ = "buffer", "created", "read_plant", "size"
+    # plants of a snapshot are only created when their row is accessed, e.g. for the winners of a recommendation
+    buffer: np.ndarray
+    # created and appended plants by row
+    created: dict[int, Plant]
+    read_plant: Callable[[int], Plant]
+    size: int
+
+    def __init__(self, read_plant: Callable[[int], Plant], size: int, buffer: np.ndarray):
+        self.read_plant = read_plant
+        self.size = size
+        self.buffer = buffer
+        self.created = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[index] for index in range(*row.indices(self.size))]
+        row = operator.index(row)
+        if row < 0:
+            row += self.size
+        if not 0 <= row < self.size:
+            raise IndexError(f'Row {row} is out of range')
+        plant = self.created.get(row)
+        if plant is None:
+            plant = self.read_plant(row)
+            plant.features = self.buffer[row]
+            self.created[row] = plant
+        return plant
+
+    def __iter__(self):
+        for row in range(0, self.size):
+            yield self[row]
+
+    def append(self, plant: Plant):
+        self.created[self.size] = plant
+        self.size += 1
+
+
+class LazyRowIndex(dict):
+    __slots__ = "find_row",
+    # rows of a snapshot are found with find_row(), e.g. a binary search over the key column, appended rows are stored
+    find_row: Callable[[str], Optional[int]]
+
+    def __init__(self, find_row: Callable[[str], Optional[int]]):
+        super().__init__()
+        self.find_row = find_row
+
+    def get(self, key, default=None):
+        row = dict.get(self, key)
+        if row is None:
+            row = self.find_row(key)
+        return default if row is None else row
+
+    def __missing__(self, key):
+        row = self.find_row(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+
+class FeatureStore:
+    __slots__ = "attribute_slices", "buffer", "category_index", "dirty_attributes", "dtype", "key_attribute", \
+                "mask_codes", "number_features", "plants", "raw_columns", "rewritten_version", "row_index", "size", \
+                "version"
+    attribute_slices: dict[str, slice]
+    buffer: np.ndarray
+    category_index: CategoryIndex
+    dtype: np.dtype
+    # columns rewritten in place since the last clear_dirty(), appended rows are found by the size of the consumer
+    dirty_attributes: set[str]
+    key_attribute: str
+    # per MULTI_CATEGORICAL attribute the version they belong to, the distinct masks and the mask code of every row
+    mask_codes: dict[str, tuple[int, np.ndarray, np.ndarray]]
+    number_features: int
+    # a LazyPlantList for stores loaded from a snapshot
+    plants: list[Plant] | LazyPlantList
+    # unnormalized values of NUMERIC attributes, kept to renormalize whole columns
+    raw_columns: dict[str, np.ndarray]
+    # last version that changed rows already in the store, e.g. by renormalizing a column, later versions only
+    # appended rows
+    rewritten_version: int
+    row_index: dict[str, int]
+    size: int
+    # bumped whenever the features change, e.g. by update_features(), results computed on older versions are stale
+    version: int
+
+    def __init__(self, attribute_slices: dict[str, slice], key_attribute: str = 'scientific_name',
+                 dtype=np.float64, capacity: int = 0):
+        self.attribute_slices = attribute_slices
+        self.dtype = np.dtype(dtype)
+        self.key_attribute = key_attribute
+        self.number_features = max((s.stop for s in attribute_slices.values()), default=0)
+        self.buffer = np.zeros((capacity, self.number_features), dtype=self.dtype)
+        self.category_index = CategoryIndex()
+        self.mask_codes = {}
+        self.plants = []
+        self.raw_columns = {}
+        self.row_index = {}
+        self.size = 0
+        self.dirty_attributes = set()
+        self.rewritten_version = 0
+        self.version = 0
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.buffer[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity: int):
+        if capacity <= len(self.buffer):
+            return
+        buffer = np.zeros((max(capacity, 2 * len(self.buffer)), self.number_features), dtype=self.dtype)
+        buffer[:self.size] = self.buffer[:self.size]
+        self.buffer = buffer
+        for attribute_name, raw_column in self.raw_columns.items():
+            self.raw_columns[attribute_name] = np.concatenate([raw_column, np.zeros(len(buffer) - len(raw_column))])
+        self.bind_features()
+
+    def bind_features(self):
+        # existing row views point into the old buffer, plants that were not created yet get their view when they are
+        if isinstance(self.plants, LazyPlantList):
+            self.plants.buffer = self.buffer
+            rows = self.plants.created.items()
+        else:
+            rows = enumerate(self.plants)
+        for row, plant in rows:
+            plant.features = self.buffer[row]
+
+    def attach(self, matrix: np.ndarray, plants: list[Plant] | LazyPlantList,
+               raw_columns: Optional[dict[str, np.ndarray]] = None, row_index: Optional[dict[str, int]] = None):
+        # adopts an existing (e.g. memory-mapped) matrix without copying it
+        self.buffer = matrix
+        self.category_index = CategoryIndex()
+        self.dtype = matrix.dtype
+        self.plants = plants
+        self.raw_columns = {} if raw_columns is None else raw_columns
+        self.size = len(plants)
+        if row_index is None:
+            row_index = {self.get_key(plants[row]): row for row in range(0, self.size)}
+        self.row_index = row_index
+        self.bind_features()
+        self.clear_dirty()
+        self.version += 1
+        self.rewritten_version = self.version
+
+    def append(self, plants: list[Plant]) -> slice:
+        start = self.size
+        self.reserve(start + len(plants))
+        for plant in plants:
+            row = self.size
+            plant.features = self.buffer[row]
+            self.plants.append(plant)
+            self.row_index[self.get_key(plant)] = row
+            self.size += 1
+        return slice(start, self.size)
+
+    def insert_columns(self, plant_attributes: list[PlantAttribute], plant_attribute: PlantAttribute,
+                       number_columns: int):
+        # appends zero columns to an attribute, the columns of all later attributes move to the right
+        attribute_slice = self.attribute_slices[plant_attribute.attribute_name]
+        end = attribute_slice.stop
+        self.buffer = np.insert(self.buffer, [end] * number_columns, 0, axis=1)
+        self.number_features += number_columns
+        for attribute_name, other_slice in self.attribute_slices.items():
+            if other_slice.start >= end:
+                self.attribute_slices[attribute_name] = slice(other_slice.start + number_columns,
+                                                              other_slice.stop + number_columns)
+        self.attribute_slices[plant_attribute.attribute_name] = slice(attribute_slice.start, end + number_columns)
+        for other_attribute in plant_attributes:
+            if other_attribute.feature_index >= end:
+                other_attribute.feature_index += number_columns
+        self.mask_codes = {}
+        self.bind_features()
+        self.mark_rewritten()
+
+    def get_raw_column(self, attribute_name: str) -> np.ndarray:
+        if attribute_name not in self.raw_columns:
+            self.raw_columns[attribute_name] = np.zeros(len(self.buffer))
+        return self.raw_columns[attribute_name]
+
+    def mark_dirty(self, attribute_name: str):
+        self.dirty_attributes.add(attribute_name)
+        self.mark_rewritten()
+
+    def mark_rewritten(self):
+        # the change belongs to the next version
+        self.rewritten_version = self.version + 1
+
+    def clear_dirty(self):
+        self.dirty_attributes = set()
+
+    def update_index(self, index: IvfIndex, plant_attributes: list[PlantAttribute]):
+        # an index from before insert_columns() reads moved columns and is trained again, appended rows join their
+        # closest list, a renormalized index column redistributes all rows
+        if index.number_features != self.number_features:
+            index.rebuild(self.matrix, plant_attributes)
+            self.clear_dirty()
+            return
+        index_columns = set(index.columns.tolist()) | set(index.color_columns.tolist())
+        reassign = any(self.attribute_slices[attribute_name].start in index_columns
+                       for attribute_name in self.dirty_attributes)
+        if reassign or len(index.assignments) < self.size:
+            index.update(self.matrix, len(index.assignments), reassign)
+        self.clear_dirty()
+
+    def get_category_index(self, plant_attributes: list[PlantAttribute]) -> CategoryIndex:
+        if self.category_index.size < self.size:
+            self.category_index.update(self.matrix, plant_attributes)
+        return self.category_index
+
+    def get_mask_codes(self, plant_attributes: list[PlantAttribute],
+                       rows: Optional[np.ndarray] = None) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        # distinct masks of every MULTI_CATEGORICAL attribute and the mask codes of the given rows, all rows by default
+        result = {}
+        for plant_attribute in plant_attributes:
+            if plant_attribute.attribute_type != PlantAttributeType.MULTI_CATEGORICAL:
+                continue
+            attribute_name = plant_attribute.attribute_name
+            if attribute_name not in self.mask_codes or self.mask_codes[attribute_name][0] != self.version:
+                masks, codes = np.unique(self.get_column(plant_attribute), axis=0, return_inverse=True)
+                self.mask_codes[attribute_name] = (self.version, masks, codes.reshape(-1))
+            version, masks, codes = self.mask_codes[attribute_name]
+            result[attribute_name] = (masks, codes if rows is None else codes[rows])
+        return result
+
+    def get_key(self, plant: Plant):
+        return getattr(plant, self.key_attribute, id(plant))
+
+    def get_row(self, plant: Plant) -> int:
+        return self.row_index[self.get_key(plant)]
+
+    def get_plant(self, key) -> Optional[Plant]:
+        row = self.row_index.get(key)
+        return None if row is None else self.plants[row]
+
+    def is_catalog(self, plants: list[Plant]) -> bool:
+        # list equality falls back to identity for plants and runs in C
+        return plants is self.plants or (len(plants) == self.size and plants == self.plants)
+
+    def get_rows(self, plants: list[Plant]) -> np.ndarray:
+        if self.is_catalog(plants):
+            return np.arange(self.size)
+        return np.fromiter((self.get_row(plant) for plant in plants), dtype=np.intp, count=len(plants))
+
+    def get_features(self, plants: list[Plant]) -> np.ndarray:
+        if self.is_catalog(plants):
+            return self.matrix
+        return self.matrix[self.get_rows(plants)]
+
+    def get_column(self, plant_attribute: PlantAttribute) -> np.ndarray:
+        return self.matrix[:, self.attribute_slices[plant_attribute.attribute_name]]
+
+    def get_feature_names(self) -> list[str]:
+        names = [''] * self.number_features
+        for attribute_name, attribute_slice in self.attribute_slices.items():
+            width = attribute_slice.stop - attribute_slice.start
+            for i in range(0, width):
+                names[attribute_slice.start + i] = attribute_name if width == 1 else f'{attribute_name}_{i}'
+        return names
@@ -0,0 +1,164 @@
+import math
+from collections import Counter
+
+from .model import *
+
+# categorical attributes with at least this many values get more values in larger catalogs
+HIGH_CARDINALITY = 32
+DEFAULT_CARDINALITIES = {
+    PlantAttributeType.CATEGORICAL: 8,
+    PlantAttributeType.MULTI_CATEGORICAL: 12,
+}
+
+
+def copy_attributes(plant_attributes: list[PlantAttribute]) -> list[PlantAttribute]:
+    # generated catalogs must not add their categories and value ranges to the shared attributes
+    return [PlantAttribute(plant_attribute.attribute_name, plant_attribute.attribute_type, plant_attribute.unit,
+                           plant_attribute.unique, plant_attribute.optional, plant_attribute.max_categories)
+            for plant_attribute in plant_attributes]
+
+
+def get_zipf_weights(size: int, exponent: float = 1.0) -> np.ndarray:
+    return 1 / np.arange(1, size + 1) ** exponent
+
+
+class ValueDistribution:
+    __slots__ = 'values', 'weights'
+    values: np.ndarray
+    # relative frequencies of the values
+    weights: np.ndarray
+
+    def __init__(self, values: list, weights: np.ndarray):
+        self.values = np.empty(len(values), dtype=object)
+        self.values[:] = values
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    def sample(self, rng: np.random.Generator, size: int) -> list:
+        codes = rng.choice(len(self.values), size, p=self.weights / self.weights.sum())
+        return self.values[codes].tolist()
+
+
+class CatalogProfile:
+    __slots__ = 'distributions', 'plant_attributes', 'size'
+    distributions: dict[str, ValueDistribution]
+    plant_attributes: list[PlantAttribute]
+    # number of plants the distributions were taken from
+    size: int
+
+    def __init__(self, plant_attributes: list[PlantAttribute], distributions: dict[str, ValueDistribution], size: int):
+        self.plant_attributes = plant_attributes
+        self.distributions = distributions
+        self.size = size
+
+    @staticmethod
+    def from_plants(plants: list[Plant], plant_attributes: list[PlantAttribute]) -> 'CatalogProfile':
+        # a real catalog gives the value frequencies and keeps the values of multi categorical attributes together
+        distributions = {}
+        for plant_attribute in plant_attributes:
+            counts = Counter(getattr(plant, plant_attribute.attribute_name) for plant in plants)
+            values = list(counts)
+            distributions[plant_attribute.attribute_name] = ValueDistribution(values, [counts[v] for v in values])
+        return CatalogProfile(plant_attributes, distributions, len(plants))
+
+    @staticmethod
+    def get_default(plant_attributes: list[PlantAttribute], seed: int = 0) -> 'CatalogProfile':
+        # zipf distributed values for catalogs without a real export
+        rng = np.random.default_rng(seed)
+        distributions = {}
+        for plant_attribute in plant_attributes:
+            attribute_name = plant_attribute.attribute_name
+            match plant_attribute.attribute_type:
+                case PlantAttributeType.NUMERIC:
+                    values = np.round(rng.lognormal(0, 1, 64), 2).tolist()
+                    weights = np.ones(len(values))
+                case PlantAttributeType.BOOL:
+                    values = [True, False]
+                    weights = [1.0, 3.0]
+                case PlantAttributeType.COLOR:
+                    values = [str(color_name) for color_name in rng.permutation(COLOR_NAMES)]
+                    weights = get_zipf_weights(len(values), 1.5)
+                case PlantAttributeType.MULTI_CATEGORICAL:
+                    categories = [f'{attribute_name} {index}'
+                                  for index in range(0, DEFAULT_CARDINALITIES[PlantAttributeType.MULTI_CATEGORICAL])]
+                    category_weights = get_zipf_weights(len(categories))
+                    category_weights /= category_weights.sum()
+                    # sorted, a set of strings has no reproducible order
+                    values = sorted({MULTI_CATEGORY_SEPARATOR.join(sorted(
+                        rng.choice(categories, rng.integers(1, 4), replace=False, p=category_weights)))
+                        for _ in range(0, 64)})
+                    weights = get_zipf_weights(len(values))
+                case PlantAttributeType.CATEGORICAL:
+                    values = [f'{attribute_name} {index}'
+                              for index in range(0, DEFAULT_CARDINALITIES[PlantAttributeType.CATEGORICAL])]
+                    weights = get_zipf_weights(len(values))
+            distributions[attribute_name] = ValueDistribution(values, weights)
+        return CatalogProfile(plant_attributes, distributions, 1000)
+
+    def get_distribution(self, plant_attribute: PlantAttribute, number_plants: int) -> ValueDistribution:
+        # larger catalogs have more families etc., the number of values grows with the square root like heaps' law,
+        # the new values are as rare as the rarest known value
+        distribution = self.distributions[plant_attribute.attribute_name]
+        if plant_attribute.attribute_type != PlantAttributeType.CATEGORICAL \
+                or len(distribution.values) < HIGH_CARDINALITY or number_plants <= self.size:
+            return distribution
+        number_values = int(len(distribution.values) * math.sqrt(number_plants / self.size))
+        new_values = [f'{plant_attribute.attribute_name} {index}'
+                      for index in range(len(distribution.values), number_values)]
+        return ValueDistribution(distribution.values.tolist() + new_values,
+                                 np.append(distribution.weights, np.full(len(new_values), distribution.weights.min())))
+
+
+def generate_plants(profile: CatalogProfile, number_plants: int, other_attributes: list[PlantAttribute],
+                    seed: int = 0) -> list[Plant]:
+    rng = np.random.default_rng(seed)
+    attribute_names = []
+    value_columns = []
+    for plant_attribute in profile.plant_attributes:
+        attribute_names.append(plant_attribute.attribute_name)
+        value_columns.append(profile.get_distribution(plant_attribute, number_plants).sample(rng, number_plants))
+    for plant_attribute in other_attributes:
+        attribute_names.append(plant_attribute.attribute_name)
+        value_columns.append([f'Synthetica {plant_attribute.attribute_name} {index}'
+                              for index in range(0, number_plants)])
+
+    plants = []
+    for values in zip(*value_columns):
+        plant = Plant()
+        vars(plant).update(zip(attribute_names, values))
+        plants.append(plant)
+    return plants
+
+
+def get_priorities(rng: np.random.Generator, number_attributes: int) -> list[float]:
+    # equal, random or focused on a few attributes
+    match rng.integers(0, 3):
+        case 0:
+            return [1.0] * number_attributes
+        case 1:
+            return rng.uniform(0.1, 1.0, number_attributes).tolist()
+        case _:
+            priorities = np.full(number_attributes, 0.1)
+            priorities[rng.choice(number_attributes, min(3, number_attributes), replace=False)] = 1.0
+            return priorities.tolist()
+
+
+def generate_users(plants: list[Plant], number_attributes: int, number_users: int, seed: int = 0,
+                   min_plants: int = 1, max_plants: int = 500) -> list[User]:
+    # collection sizes are log-uniform, so most users have few plants, and popular plants are in many collections
+    rng = np.random.default_rng(seed)
+    popularity = np.cumsum(get_zipf_weights(len(plants), 0.8)[rng.permutation(len(plants))])
+    popularity /= popularity[-1]
+    max_plants = min(max_plants, len(plants))
+
+    users = []
+    for user_id in range(0, number_users):
+        size = min(int(math.exp(rng.uniform(math.log(min_plants), math.log(max_plants + 1)))), max_plants)
+        positions = np.array([], dtype=np.intp)
+        while len(positions) < size:
+            drawn = np.searchsorted(popularity, rng.random(2 * size))
+            positions = np.concatenate([positions, drawn])
+            positions = positions[np.sort(np.unique(positions, return_index=True)[1])]
+        ratings = rng.choice([1.0, 2.0, 3.0, 4.0, 5.0], size, p=[0.05, 0.1, 0.2, 0.3, 0.35])
+        user_plants = [UserPlant(plants[position], rating) for position, rating in zip(positions[:size], ratings)]
+        users.append(User(user_id, f'synthetic user {user_id}', get_priorities(rng, number_attributes), user_plants))
+    return users
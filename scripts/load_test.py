@@ -0,0 +1,81 @@
+import argparse
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from internal.server import *
+from internal.snapshot import *
+from internal.synthetic import *
+
+# usage: python load_test.py [--url http://localhost:8080/recommend] [--requests 2000] [--concurrency 64]
+
+
+async def post(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str,
+               body: bytes) -> tuple[int, bytes]:
+    writer.write(f'POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body)
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+    status = int(head.split(' ', 2)[1])
+    length = 0
+    for line in head.split('\r\n')[1:]:
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':', 1)[1])
+    return status, await reader.readexactly(length)
+
+
+async def run_worker(url: str, bodies: list[bytes], next_request: Iterator[int], latencies: list[float],
+                     statuses: Counter):
+    # one keep-alive connection per worker
+    url = urlsplit(url)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port)
+    try:
+        for request in next_request:
+            start = time.perf_counter()
+            status, _ = await post(reader, writer, url.netloc, url.path, bodies[request % len(bodies)])
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+    finally:
+        writer.close()
+
+
+async def main(args: argparse.Namespace, bodies: list[bytes]):
+    latencies = []
+    statuses = Counter()
+    next_request = iter(range(0, args.requests))
+    start = time.perf_counter()
+    await asyncio.gather(*(run_worker(args.url, bodies, next_request, latencies, statuses)
+                           for _ in range(0, args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f'{args.requests} requests with {args.concurrency} connections in {elapsed:.2f} s, '
+          f'{args.requests / elapsed:.1f} requests/s')
+    print(f'latency mean {latencies.mean():.2f} ms, p50 {np.percentile(latencies, 50):.2f} ms, '
+          f'p99 {np.percentile(latencies, 99):.2f} ms')
+    print(f'status codes: {dict(statuses)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:8080/recommend')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--users', type=int, default=2000, help='distinct user profiles, fewer give cache hits')
+    parser.add_argument('--max-user-plants', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # request bodies in the format of example.json with synthetic users of the real catalog
+    feature_store = load_or_build_snapshot('../export/plants.snapshot', '../export/plants.csv', Plant.plant_attributes,
+                                           Plant.other_attributes)
+    users = generate_users(feature_store.plants, len(Plant.plant_attributes), args.users, args.seed,
+                           max_plants=args.max_user_plants)
+    bodies = []
+    for user in users:
+        json_plants = [{'name': feature_store.get_key(user_plant.plant), 'rating': user_plant.rating}
+                       for user_plant in user.user_plants]
+        json_user = {'user_id': user.user_id, 'priorities': [data.priority for data in user.attribute_data],
+                     'plants': json_plants}
+        bodies.append(json.dumps({'user': json_user, 'top_k': 10}).encode())
+    asyncio.run(main(args, bodies))
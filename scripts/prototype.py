@@ -1,19 +1,14 @@
 from internal.service import *
 from internal.data import *
+from internal.snapshot import *
 import json
 
 
-def get_plant_by_name(plant_list, name):
-    for plant in plant_list:
-        if name == plant.scientific_name:
-            return plant
-
-
 plant_attributes = Plant.plant_attributes
-all_attributes = plant_attributes + Plant.other_attributes
 
-plants = parse_plants('../export/plants.csv', all_attributes)
-PlantRecommender.init_features(plants, plant_attributes)
+feature_store = load_or_build_snapshot('../export/plants.snapshot', '../export/plants.csv', plant_attributes,
+                                       Plant.other_attributes)
+plants = feature_store.plants
 
 priorities = [1.0 for _ in plant_attributes]
 user = User(0, "Daniel", priorities, [])
@@ -26,11 +21,11 @@ with open("example.json") as json_file:
 
     user_plants = []
     for plant_name in json_plants:
-        user_plants.append(UserPlant(get_plant_by_name(plants, plant_name)))
+        user_plants.append(UserPlant(feature_store.get_plant(plant_name)))
     user.user_plants = user_plants
 
-UserService.init_user_attributes(user, plant_attributes)
-recs = PlantRecommender.recommend_plant(plants, plant_attributes, user, True)
+UserService.init_user_attributes(user, plant_attributes, feature_store)
+recs = PlantRecommender.recommend_plant(plants, plant_attributes, user, True, feature_store, top_k=10)
 
-for i in range(10):
-    print(recs[i])
+for rec in recs:
+    print(rec)
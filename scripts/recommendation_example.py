@@ -1,18 +1,19 @@
 from internal.service import *
 from internal.data import *
+from internal.snapshot import *
 
 
 plant_attributes = Plant.plant_attributes
-all_attributes = plant_attributes + Plant.other_attributes
 
-plants = parse_plants('../export/plants.csv', all_attributes)
+feature_store = load_or_build_snapshot('../export/plants.snapshot', '../export/plants.csv', plant_attributes,
+                                       Plant.other_attributes)
+plants = feature_store.plants
 
 priorities = [1.0 for _ in plant_attributes]
 users = [User(0, "Daniel", priorities, [UserPlant(plants[8], 10), UserPlant(plants[9], 10)])]
 
-PlantRecommender.init_features(plants, plant_attributes)
-UserService.init_user_attributes(users[0], plant_attributes)
-recs = PlantRecommender.recommend_plant(plants, plant_attributes, users[0], False)
+UserService.init_user_attributes(users[0], plant_attributes, feature_store)
+recs = PlantRecommender.recommend_plant(plants, plant_attributes, users[0], False, feature_store)
 
 for user_plant in users[0].user_plants:
     print(user_plant.plant)
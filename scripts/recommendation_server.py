@@ -0,0 +1,35 @@
+import argparse
+
+from internal.server import *
+from internal.snapshot import *
+
+# usage: python recommendation_server.py [--port 8080], then POST example.json to http://localhost:8080/recommend
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=64, help='1 scores every request on its own')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='wait for more requests to fill a batch')
+    parser.add_argument('--max-queue', type=int, default=1024, help='requests beyond this are answered with 503')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds until a request is answered with 504')
+    parser.add_argument('--cache-entries', type=int, default=4096, help='0 disables the result cache')
+    args = parser.parse_args()
+
+    plant_attributes = Plant.plant_attributes
+    # the catalog is loaded once and shared by all requests
+    feature_store = load_or_build_snapshot('../export/plants.snapshot', '../export/plants.csv', plant_attributes,
+                                           Plant.other_attributes)
+    print(f'loaded {len(feature_store)} plants')
+
+
+    async def main():
+        batcher = MicroBatcher(feature_store, plant_attributes, args.max_batch_size, args.max_wait_ms / 1000,
+                               args.max_queue)
+        cache = ResultCache(args.cache_entries) if args.cache_entries > 0 else None
+        server = RecommendationServer(feature_store, plant_attributes, batcher, cache, args.timeout)
+        print(f'serving on http://{args.host}:{args.port}/recommend')
+        await server.serve(args.host, args.port)
+
+
+    asyncio.run(main())
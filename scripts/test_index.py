@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from internal.service import *
+from internal.synthetic import *
+
+NUMBER_PLANTS = 300
+
+
+@pytest.fixture
+def catalog():
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    plants = generate_plants(CatalogProfile.get_default(plant_attributes), NUMBER_PLANTS, Plant.other_attributes)
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    index = IvfIndex.build(feature_store.matrix, plant_attributes, number_lists=16)
+    user = User(0, 'index', [1.0] * len(plant_attributes), [UserPlant(plants[4], 3.0), UserPlant(plants[90])])
+    UserService.init_user_attributes(user, plant_attributes, feature_store)
+    return plants, plant_attributes, feature_store, index, user
+
+
+def test_search_probes_at_least_one_list(catalog):
+    plants, plant_attributes, feature_store, index, user = catalog
+    query = index.get_query(user, plant_attributes)
+    closest = index.search(query, 1)
+    assert len(closest)
+    for n_probe in (0, -3):
+        np.testing.assert_array_equal(index.search(query, n_probe), closest)
+    np.testing.assert_array_equal(index.search(query, 100), np.arange(NUMBER_PLANTS))
+    assert PlantRecommender.recommend_plant(plants, plant_attributes, user, False, feature_store, 5, index, 0)
+
+
+def test_all_lists_give_the_exhaustive_result(catalog):
+    plants, plant_attributes, feature_store, index, user = catalog
+    expected = PlantRecommender.recommend_plant(plants, plant_attributes, user, True, feature_store, 10)
+    probed = PlantRecommender.recommend_plant(plants, plant_attributes, user, True, feature_store, 10, index,
+                                              len(index.centroids))
+    assert [r.plant for r in probed] == [r.plant for r in expected]
+
+
+def test_index_follows_inserted_columns():
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    # the first attribute runs out of mask slots, so the columns of all other attributes move
+    plant_attributes[0].max_categories = MULTI_CATEGORY_BITS
+    profile = CatalogProfile.get_default(plant_attributes)
+    plants = generate_plants(profile, NUMBER_PLANTS, Plant.other_attributes)
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    index = IvfIndex.build(feature_store.matrix, plant_attributes, number_lists=16)
+
+    new_plants = generate_plants(profile, 40, Plant.other_attributes, seed=1)
+    attribute_name = plant_attributes[0].attribute_name
+    for number, plant in enumerate(new_plants):
+        plant.scientific_name += ' new'
+        setattr(plant, attribute_name, f'new category {number}')
+    PlantRecommender.update_features(new_plants, [], plant_attributes, feature_store)
+    assert feature_store.number_features > index.number_features
+
+    user = User(0, 'moved', [1.0] * len(plant_attributes), [UserPlant(plants[4], 3.0), UserPlant(new_plants[2])])
+    UserService.init_user_attributes(user, plant_attributes, feature_store)
+    expected = PlantRecommender.recommend_plant(feature_store.plants, plant_attributes, user, True, feature_store, 10)
+    probed = PlantRecommender.recommend_plant(feature_store.plants, plant_attributes, user, True, feature_store, 10,
+                                              index, len(index.centroids))
+    assert [r.plant for r in probed] == [r.plant for r in expected]
+    assert index.number_features == feature_store.number_features
+    np.testing.assert_array_equal(index.columns, IvfIndex.get_columns(plant_attributes)[0])
@@ -0,0 +1,216 @@
+import math
+
+import numpy as np
+import pytest
+
+from internal.service import *
+from internal.synthetic import *
+
+NUMBER_PLANTS = 120
+# the vectorized scores are sums in a different order than the per-plant loop
+TOLERANCE = 1e-9
+
+
+def reference_scores(plants: list[Plant], plant_attributes: list[PlantAttribute], user: User) -> list[float]:
+    # the per-plant loop of the original recommender with rating weights, lab colors and category sets,
+    # works on the raw attribute values instead of the feature matrix
+    rating_sum = sum(user_plant.rating for user_plant in user.user_plants)
+    number_user_plants = len(user.user_plants)
+    result = []
+    for plant in plants:
+        score = 0.0
+        for attribute_index in range(0, len(plant_attributes)):
+            plant_attribute = plant_attributes[attribute_index]
+            attribute_name = plant_attribute.attribute_name
+            value = getattr(plant, attribute_name)
+            attribute_score = 0.0
+
+            match plant_attribute.attribute_type:
+                case PlantAttributeType.NUMERIC:
+                    value_range = plant_attribute.max_value - plant_attribute.min_value
+                    for user_plant in user.user_plants:
+                        user_value = getattr(user_plant.plant, attribute_name)
+                        difference = (value - user_value) / value_range if value_range else 0.0
+                        attribute_score += user_plant.rating * number_user_plants / rating_sum * difference ** 2
+                    attribute_score = 1 - math.sqrt(attribute_score)
+                case PlantAttributeType.BOOL:
+                    a = sum(user_plant.rating for user_plant in user.user_plants
+                            if getattr(user_plant.plant, attribute_name)) / rating_sum - 0.5
+                    v = 1 if value else 0
+                    attribute_score = 0.5 + v * a - (1 - v) * a
+                case PlantAttributeType.COLOR:
+                    for user_plant in user.user_plants:
+                        user_code = COLOR_CODES.get(getattr(user_plant.plant, attribute_name), DEFAULT_COLOR_CODE)
+                        code = COLOR_CODES.get(value, DEFAULT_COLOR_CODE)
+                        attribute_score += user_plant.rating * COLOR_SIMILARITY[user_code, code]
+                    attribute_score /= rating_sum
+                case PlantAttributeType.MULTI_CATEGORICAL:
+                    categories = {category.strip() for category in value.split(MULTI_CATEGORY_SEPARATOR)} - {''}
+                    for user_plant in user.user_plants:
+                        user_categories = {category.strip() for category in getattr(
+                            user_plant.plant, attribute_name).split(MULTI_CATEGORY_SEPARATOR)} - {''}
+                        union = categories | user_categories
+                        similarity = len(categories & user_categories) / len(union) if union else 1.0
+                        attribute_score += user_plant.rating * similarity
+                    attribute_score /= rating_sum
+                case PlantAttributeType.CATEGORICAL:
+                    for user_plant in user.user_plants:
+                        if getattr(user_plant.plant, attribute_name) == value:
+                            attribute_score += user_plant.rating * number_user_plants / rating_sum
+                    attribute_score /= len(plant_attribute.categories)
+
+            score += user.attribute_data[attribute_index].priority * attribute_score
+
+        prio = 0.0
+        for attribute_index in range(0, len(plant_attributes)):
+            prio += user.attribute_data[attribute_index].priority
+        result.append(score / prio)
+    return result
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    profile = CatalogProfile.get_default(plant_attributes)
+    plants = generate_plants(profile, NUMBER_PLANTS, Plant.other_attributes)
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    users = generate_users(plants, len(plant_attributes), 12, max_plants=30)
+    for user in users:
+        UserService.init_user_attributes(user, plant_attributes, feature_store)
+    return plants, plant_attributes, feature_store, users
+
+
+def test_score_plants_matches_reference(catalog):
+    plants, plant_attributes, feature_store, users = catalog
+    for user in users:
+        scores = PlantRecommender.score_plants(feature_store.matrix, plant_attributes, user)
+        np.testing.assert_allclose(scores, reference_scores(plants, plant_attributes, user), rtol=0, atol=TOLERANCE)
+
+
+def test_score_batch_matches_score_plants(catalog):
+    plants, plant_attributes, feature_store, users = catalog
+    user_plants = [user_plant.plant for user in users for user_plant in user.user_plants]
+    user_offsets = np.cumsum([0] + [len(user.user_plants) for user in users])
+    scores = PlantRecommender.score_batch(feature_store.matrix, plant_attributes, users,
+                                          feature_store.get_features(user_plants), user_offsets)
+    for user, user_scores in zip(users, scores):
+        np.testing.assert_allclose(user_scores, PlantRecommender.score_plants(feature_store.matrix, plant_attributes,
+                                                                              user), rtol=0, atol=TOLERANCE)
+
+
+def test_streaming_matches_recommend_plant(catalog):
+    plants, plant_attributes, feature_store, users = catalog
+    for user in users:
+        expected = PlantRecommender.recommend_plant(plants, plant_attributes, user, True, feature_store, top_k=10)
+        chunks = [plants[start:start + 25] for start in range(0, len(plants), 25)]
+        recommendations = PlantRecommender.recommend_plant_streaming(chunks, plant_attributes, user, 10, True,
+                                                                     feature_store)
+        assert [r.plant for r in recommendations] == [r.plant for r in expected]
+        np.testing.assert_allclose([r.score for r in recommendations], [r.score for r in expected],
+                                   rtol=0, atol=TOLERANCE)
+
+
+def test_incremental_updates_match_init(catalog):
+    plants, plant_attributes, feature_store, _ = catalog
+    priorities = [1.0] * len(plant_attributes)
+    user = User(1, 'incremental', priorities, [UserPlant(plants[0], 3.0), UserPlant(plants[1], 1.0)])
+    UserService.init_user_attributes(user, plant_attributes, feature_store)
+    added = UserPlant(plants[2], 4.0)
+    UserService.add_user_plant(user, added, plant_attributes)
+    UserService.add_user_plant(user, UserPlant(plants[3], 2.0), plant_attributes)
+    UserService.update_rating(user, added, 5.0, plant_attributes)
+    UserService.remove_user_plant(user, user.user_plants[1], plant_attributes)
+
+    fresh = User(1, 'fresh', priorities, list(user.user_plants))
+    UserService.init_user_attributes(fresh, plant_attributes, feature_store)
+    assert user.rating_sum == pytest.approx(fresh.rating_sum)
+    for plant_attribute, data, fresh_data in zip(plant_attributes, user.attribute_data, fresh.attribute_data):
+        match plant_attribute.attribute_type:
+            case PlantAttributeType.NUMERIC:
+                assert data.value_sum == pytest.approx(fresh_data.value_sum)
+                assert data.square_sum == pytest.approx(fresh_data.square_sum)
+            case PlantAttributeType.BOOL:
+                assert data.true_ratio == pytest.approx(fresh_data.true_ratio)
+            case PlantAttributeType.COLOR:
+                np.testing.assert_allclose(data.color_weights, fresh_data.color_weights)
+            case PlantAttributeType.CATEGORICAL:
+                np.testing.assert_allclose(data.category_distribution, fresh_data.category_distribution)
+    np.testing.assert_allclose(PlantRecommender.score_plants(feature_store.matrix, plant_attributes, user),
+                               PlantRecommender.score_plants(feature_store.matrix, plant_attributes, fresh),
+                               rtol=0, atol=TOLERANCE)
+
+
+def test_ties_keep_catalog_order():
+    # every plant is in the catalog twice, so all scores are tied in pairs
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    profile = CatalogProfile.get_default(plant_attributes)
+    plants = generate_plants(profile, NUMBER_PLANTS // 2, Plant.other_attributes)
+    twins = []
+    for plant in plants:
+        twin = Plant()
+        vars(twin).update(vars(plant))
+        twin.scientific_name += ' twin'
+        twins.append(twin)
+    plants = [plant for pair in zip(plants, twins) for plant in pair]
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    user = User(0, 'ties', [1.0] * len(plant_attributes), [UserPlant(plants[0]), UserPlant(plants[7], 2.0)])
+    UserService.init_user_attributes(user, plant_attributes, feature_store)
+
+    scores = PlantRecommender.score_plants(feature_store.matrix, plant_attributes, user)
+    expected = sorted(range(0, len(plants)), key=lambda row: (-scores[row], row))
+    for top_k in (-1, 1, 9, 40):
+        recommendations = PlantRecommender.recommend_plant(plants, plant_attributes, user, False, feature_store,
+                                                           top_k=top_k)
+        assert [feature_store.get_row(r.plant) for r in recommendations] == expected[:len(recommendations)]
+    [batch] = PlantRecommender.recommend_batch(plants, plant_attributes, [user], False, feature_store, 9)
+    assert [feature_store.get_row(r.plant) for r in batch] == expected[:9]
+    chunks = [plants[start:start + 7] for start in range(0, len(plants), 7)]
+    streamed = PlantRecommender.recommend_plant_streaming(chunks, plant_attributes, user, 9, False, feature_store)
+    assert [feature_store.get_row(r.plant) for r in streamed] == expected[:9]
+
+
+def test_ranking_matches_reference(catalog):
+    plants, plant_attributes, feature_store, users = catalog
+    for user in users:
+        scores = np.round(reference_scores(plants, plant_attributes, user), RANK_DECIMALS)
+        expected = sorted(range(0, len(plants)), key=lambda row: (-scores[row], row))
+        recommendations = PlantRecommender.recommend_plant(plants, plant_attributes, user, False, feature_store)
+        assert [feature_store.get_row(r.plant) for r in recommendations] == expected
+
+
+def test_rounding_errors_do_not_reorder_ties():
+    scores = np.array([0.5, 0.7, 0.5 + 1e-12, 0.7 - 1e-12, 0.5 - 1e-12, 0.3])
+    assert TopKSelector.select(scores).tolist() == [1, 3, 0, 2, 4, 5]
+    assert TopKSelector.select(scores, 3).tolist() == [1, 3, 0]
+    selector = TopKSelector(3)
+    plants = [Plant() for _ in scores]
+    selector.push(plants[:3], scores[:3])
+    selector.push(plants[3:], scores[3:])
+    recommendations = selector.result()
+    assert [plants.index(r.plant) for r in recommendations] == [1, 3, 0]
+    # the returned scores are not rounded
+    assert recommendations[1].score == scores[3]
+
+
+def test_user_without_plants_has_zero_aggregates(catalog):
+    plants, plant_attributes, feature_store, _ = catalog
+    for store in (None, feature_store):
+        user = User(2, 'empty', [1.0] * len(plant_attributes))
+        UserService.init_user_attributes(user, plant_attributes, store)
+        assert user.rating_sum == 0
+        for plant_attribute, data in zip(plant_attributes, user.attribute_data):
+            if plant_attribute.attribute_type == PlantAttributeType.CATEGORICAL:
+                assert not data.category_distribution.any()
+                assert len(data.category_distribution) == len(plant_attribute.categories)
+            elif plant_attribute.attribute_type == PlantAttributeType.MULTI_CATEGORICAL:
+                assert data.masks.shape == (0, PlantAttributeService.get_feature_slots(plant_attribute))
+        with pytest.raises(ValueError):
+            PlantRecommender.score_plants(feature_store.matrix, plant_attributes, user)
+
+        # a profile started empty is built up incrementally
+        UserService.add_user_plant(user, UserPlant(plants[5], 2.0), plant_attributes)
+        fresh = User(2, 'fresh', [1.0] * len(plant_attributes), [UserPlant(plants[5], 2.0)])
+        UserService.init_user_attributes(fresh, plant_attributes, feature_store)
+        np.testing.assert_allclose(PlantRecommender.score_plants(feature_store.matrix, plant_attributes, user),
+                                   PlantRecommender.score_plants(feature_store.matrix, plant_attributes, fresh),
+                                   rtol=0, atol=TOLERANCE)
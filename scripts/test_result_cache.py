@@ -0,0 +1,123 @@
+import pytest
+
+from internal.result_cache import *
+from internal.synthetic import *
+
+NUMBER_PLANTS = 150
+
+
+@pytest.fixture
+def catalog():
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    profile = CatalogProfile.get_default(plant_attributes)
+    plants = generate_plants(profile, NUMBER_PLANTS, Plant.other_attributes)
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    users = generate_users(plants, len(plant_attributes), 6, max_plants=10)
+    for user in users:
+        UserService.init_user_attributes(user, plant_attributes, feature_store)
+    return plant_attributes, feature_store, users
+
+
+def copy_plants(plants: list[Plant], suffix: str) -> list[Plant]:
+    # same values under new names, so neither the normalization nor the categories change
+    copies = []
+    for plant in plants:
+        copy = Plant()
+        vars(copy).update(vars(plant))
+        copy.scientific_name += suffix
+        copies.append(copy)
+    return copies
+
+
+def rows(feature_store: FeatureStore, recommendations: list[PlantRecommendation]) -> list[tuple[int, float]]:
+    return [(feature_store.get_row(r.plant), r.score) for r in recommendations]
+
+
+def test_appended_plants_update_cached_results(catalog):
+    plant_attributes, feature_store, users = catalog
+    cache = ResultCache()
+    requests = [(user, top_k, filter_user_plants) for user in users for top_k in (-1, 10) for filter_user_plants in
+                (False, True)]
+    for user, top_k, filter_user_plants in requests:
+        cache.recommend_plant(feature_store.plants, plant_attributes, user, filter_user_plants, feature_store, top_k)
+
+    # copies tie with their originals and have to come after them
+    PlantRecommender.update_features(copy_plants(feature_store.plants[::3], ' copy'), [], plant_attributes,
+                                     feature_store)
+    for user, top_k, filter_user_plants in requests:
+        recommendations = cache.recommend_plant(feature_store.plants, plant_attributes, user, filter_user_plants,
+                                                feature_store, top_k)
+        expected = PlantRecommender.recommend_plant(feature_store.plants, plant_attributes, user, filter_user_plants,
+                                                    feature_store, top_k)
+        assert rows(feature_store, recommendations) == rows(feature_store, expected)
+    assert cache.stats.invalidations == 0
+    assert cache.stats.updates == len(requests)
+    assert cache.stats.misses == len(requests)
+
+    cache.recommend_plant(feature_store.plants, plant_attributes, users[0], False, feature_store, 10)
+    assert cache.stats.hits == 1
+
+
+def test_rewritten_rows_invalidate_cached_results(catalog):
+    plant_attributes, feature_store, users = catalog
+    cache = ResultCache()
+    for user in users:
+        cache.recommend_plant(feature_store.plants, plant_attributes, user, False, feature_store, 10)
+
+    # a value outside the range renormalizes its column, so every row changes
+    [plant] = copy_plants(feature_store.plants[:1], ' tall')
+    plant_attribute = next(plant_attribute for plant_attribute in plant_attributes
+                           if plant_attribute.attribute_type == PlantAttributeType.NUMERIC)
+    setattr(plant, plant_attribute.attribute_name, plant_attribute.max_value * 2 + 1)
+    PlantRecommender.update_features([plant], [], plant_attributes, feature_store)
+    assert feature_store.rewritten_version == feature_store.version
+
+    for user in users:
+        UserService.init_user_attributes(user, plant_attributes, feature_store)
+        recommendations = cache.recommend_plant(feature_store.plants, plant_attributes, user, False, feature_store,
+                                                10)
+        expected = PlantRecommender.recommend_plant(feature_store.plants, plant_attributes, user, False,
+                                                    feature_store, 10)
+        assert rows(feature_store, recommendations) == rows(feature_store, expected)
+    assert cache.stats.invalidations == len(users)
+    assert cache.stats.updates == 0
+
+
+def test_key_ignores_number_types_and_follows_the_index(catalog):
+    plant_attributes, feature_store, users = catalog
+    user_plants = [UserPlant(feature_store.plants[0], 5), UserPlant(feature_store.plants[1], 2)]
+    user = User(0, 'int', [1] * len(plant_attributes), user_plants)
+    float_user = User(1, 'float', [1.0] * len(plant_attributes),
+                      [UserPlant(user_plant.plant, float(user_plant.rating)) for user_plant in reversed(user_plants)])
+    for profile in (user, float_user):
+        UserService.init_user_attributes(profile, plant_attributes, feature_store)
+    assert ResultCache.get_key(user, feature_store, True, 10, None, None, 8) == \
+        ResultCache.get_key(float_user, feature_store, True, 10, None, None, 8)
+
+    index = IvfIndex.build(feature_store.matrix, plant_attributes, 4)
+    key = ResultCache.get_key(user, feature_store, True, 10, None, index, 8)
+    # n_probe beyond the number of lists probes the same lists
+    assert key == ResultCache.get_key(user, feature_store, True, 10, None, index, 4)
+    assert key != ResultCache.get_key(user, feature_store, True, 10, None, IvfIndex.build(
+        feature_store.matrix, plant_attributes, 4), 8)
+    index.update(feature_store.matrix, 0, True)
+    assert key != ResultCache.get_key(user, feature_store, True, 10, None, index, 8)
+
+
+def test_callers_cannot_change_cached_results(catalog):
+    plant_attributes, feature_store, users = catalog
+    cache = ResultCache()
+    cache.set_feature_store(feature_store)
+    key = ResultCache.get_key(users[0], feature_store, False, 5, None, None, 8)
+    recommendations = PlantRecommender.recommend_plant(feature_store.plants, plant_attributes, users[0], False,
+                                                       feature_store, 5)
+    expected = rows(feature_store, recommendations)
+    cache.put(key, recommendations)
+    recommendations[0].score = -1.0
+    recommendations.clear()
+
+    cached = cache.get(key)
+    assert rows(feature_store, cached) == expected
+    cached[0].score = -1.0
+    cached.pop()
+    assert rows(feature_store, cache.get(key)) == expected
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+from internal.server import *
+from internal.synthetic import *
+
+
+@pytest.fixture
+def server():
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    plants = generate_plants(CatalogProfile.get_default(plant_attributes), 50, Plant.other_attributes)
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    return RecommendationServer(feature_store, plant_attributes, MicroBatcher(feature_store, plant_attributes))
+
+
+async def send(server: RecommendationServer, request: bytes) -> tuple[str, dict[str, str], dict]:
+    # one raw request against handle_connection, returns the status line, the headers and the json body
+    asyncio_server = await asyncio.start_server(server.handle_connection, 'localhost', 0)
+    port = asyncio_server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(request)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+    finally:
+        asyncio_server.close()
+        await asyncio_server.wait_closed()
+    head, body = response.split(b'\r\n\r\n', 1)
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in header_lines)
+    return status_line, headers, json.loads(body)
+
+
+@pytest.mark.parametrize('request_head', [
+    b'GARBAGE\r\n\r\n',
+    b'GET /stats HTTP/1.1\r\nNo colon here\r\n\r\n',
+    b'POST /recommend HTTP/1.1\r\nContent-Length: ten\r\n\r\n',
+    b'POST /recommend HTTP/1.1\r\nContent-Length: -5\r\n\r\n',
+])
+def test_malformed_request_is_answered_with_400(server, request_head):
+    status_line, headers, payload = asyncio.run(send(server, request_head))
+    assert status_line == 'HTTP/1.1 400 Bad Request'
+    assert headers['Connection'] == 'close'
+    assert payload['error'].startswith('Malformed request')
+
+
+def test_infinite_numbers_are_rejected(server):
+    name = server.feature_store.get_key(server.feature_store.plants[0])
+    number_priorities = len(server.plant_attributes)
+    users = [
+        {'plants': [{'name': name, 'rating': float('inf')}]},
+        {'plants': [{'name': name, 'rating': 'nan'}]},
+        {'plants': [name], 'priorities': [float('inf')] + [1.0] * (number_priorities - 1)},
+        {'plants': [name], 'priorities': [1e308] * number_priorities},
+    ]
+    for user in users:
+        with pytest.raises(ValueError):
+            server.parse_user({'user': user})
+        status, payload = asyncio.run(server.recommend(json.dumps({'user': user}).encode()))
+        assert status == HTTPStatus.BAD_REQUEST
+    assert server.parse_user({'user': {'plants': [{'name': name, 'rating': 3}]}}).user_plants[0].rating == 3.0
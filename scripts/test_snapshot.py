@@ -0,0 +1,103 @@
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+import pytest
+
+from internal.snapshot import *
+from internal.synthetic import *
+
+NUMBER_PLANTS = 200
+EXPORT_FILE = os.path.join(os.path.dirname(__file__), '..', 'export', 'plants.csv')
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    profile = CatalogProfile.get_default(plant_attributes)
+    plants = generate_plants(profile, NUMBER_PLANTS, Plant.other_attributes)
+    feature_store = PlantRecommender.init_features(plants, plant_attributes)
+    directory = str(tmp_path / 'plants.snapshot')
+    save_snapshot(directory, feature_store, plant_attributes, Plant.other_attributes)
+    return directory, feature_store, plant_attributes
+
+
+def recommend(feature_store: FeatureStore, plant_attributes: list[PlantAttribute], keys: list[str]) -> list:
+    user = User(0, 'snapshot', [1.0] * len(plant_attributes),
+                [UserPlant(feature_store.get_plant(key), 2.0) for key in keys])
+    UserService.init_user_attributes(user, plant_attributes, feature_store)
+    recommendations = PlantRecommender.recommend_plant(feature_store.plants, plant_attributes, user, True,
+                                                       feature_store, top_k=5)
+    return [(feature_store.get_key(r.plant), r.score) for r in recommendations]
+
+
+def test_loaded_plants_are_created_on_access(snapshot):
+    directory, built_store, built_attributes = snapshot
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    feature_store = load_snapshot(directory, plant_attributes, Plant.other_attributes)
+    assert len(feature_store) == NUMBER_PLANTS
+    assert not feature_store.plants.created
+
+    keys = [built_store.get_key(built_store.plants[row]) for row in (3, 50, 120)]
+    assert recommend(feature_store, plant_attributes, keys) == recommend(built_store, built_attributes, keys)
+    # only the user plants and the winners were created
+    assert len(feature_store.plants.created) == 3 + 5
+    plant = feature_store.get_plant(keys[1])
+    assert plant is feature_store.plants[50]
+    assert np.shares_memory(plant.features, feature_store.matrix)
+    assert feature_store.get_plant('Unknown plant') is None
+
+
+def test_loaded_store_takes_new_plants(snapshot):
+    directory, built_store, built_attributes = snapshot
+    plant_attributes = copy_attributes(Plant.plant_attributes)
+    feature_store = load_snapshot(directory, plant_attributes, Plant.other_attributes)
+    new_plants, built_plants = [generate_plants(CatalogProfile.get_default(plant_attributes), 40,
+                                                Plant.other_attributes, seed=1) for _ in range(0, 2)]
+    for plant in new_plants + built_plants:
+        plant.scientific_name += ' new'
+    created_plant = feature_store.plants[10]
+    PlantRecommender.update_features(new_plants, [], plant_attributes, feature_store)
+    PlantRecommender.update_features(built_plants, [], built_attributes, built_store)
+
+    assert len(feature_store) == NUMBER_PLANTS + 40
+    assert feature_store.get_plant(new_plants[7].scientific_name) is new_plants[7]
+    np.testing.assert_array_equal(feature_store.matrix, built_store.matrix)
+    # the row view of a plant created before the buffer grew points into the new buffer
+    assert np.shares_memory(created_plant.features, feature_store.buffer)
+    keys = [new_plants[0].scientific_name, built_store.get_key(built_store.plants[10])]
+    assert recommend(feature_store, plant_attributes, keys) == recommend(built_store, built_attributes, keys)
+
+
+def test_rebuilt_snapshot_is_loaded_on_the_next_start(tmp_path):
+    csv_file = str(tmp_path / 'plants.csv')
+    shutil.copy(EXPORT_FILE, csv_file)
+    directory = str(tmp_path / 'plants.snapshot')
+
+    def start() -> FeatureStore:
+        return load_or_build_snapshot(directory, csv_file, copy_attributes(Plant.plant_attributes),
+                                      Plant.other_attributes)
+
+    assert not isinstance(start().plants, LazyPlantList)
+    assert isinstance(start().plants, LazyPlantList)
+    first_snapshot = resolve_snapshot(directory)
+
+    # a newer export is built once and then loaded from the published snapshot
+    os.utime(os.path.join(first_snapshot, MANIFEST_FILE), (time.time() - 20, time.time() - 20))
+    os.utime(csv_file, (time.time() - 10, time.time() - 10))
+    assert not isinstance(start().plants, LazyPlantList)
+    assert resolve_snapshot(directory) != first_snapshot
+    assert isinstance(start().plants, LazyPlantList)
+
+
+def test_lazy_plants_are_a_sequence(snapshot):
+    directory, built_store, _ = snapshot
+    feature_store = load_snapshot(directory, copy_attributes(Plant.plant_attributes), Plant.other_attributes)
+    plants = feature_store.plants
+    assert random.Random(0).sample(plants, 3)
+    assert plants[-1] is plants[NUMBER_PLANTS - 1]
+    assert [plant.scientific_name for plant in plants[:3]] == [plant.scientific_name for plant in built_store.plants[:3]]
+    with pytest.raises(IndexError):
+        plants[NUMBER_PLANTS]